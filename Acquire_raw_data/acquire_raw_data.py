@@ -1,10 +1,25 @@
-from flim_labs_api import FlimLabsApi, generate_unique_filename
+import time
+
+from flim_labs_api import FlimLabsApi
 
 api = FlimLabsApi()
 
-output_filename = 'acquisition_raw.bin'
+output_filename = time.strftime("acquisition_raw_%Y%m%d-%H%M%S.bin")
 firmware = 'firmwares\\photons_tracing_simulator.flim'
 acquisition_size_in_MB = 25
+chunk_size = 1024 * 1024
+
+bytes_received = [0]
+
+
+def raw_data_handler(data):
+    # data is a read-only uint8 NumPy array over the received buffer, not a copy
+    bytes_received[0] += len(data)
+
 
-api.acquire_raw_data(firmware, generate_unique_filename(output_filename, "datetime"),
-                     acquisition_size_in_MB)
+api.set_firmware(firmware)
+api.set_raw_data_file(output_filename)
+api.set_batch_consumer_handler(raw_data_handler)
+api.acquire_raw_data(chunk_size, acquisition_size_in_MB)
+api.consumer_thread.join()
+print("Received " + str(bytes_received[0]) + " bytes, saved in " + output_filename)
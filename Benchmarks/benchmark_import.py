@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# every statement is timed in a fresh interpreter, after psutil is imported to read the RSS
+STATEMENTS = {
+    'import': "import flim_labs_api",
+    'create': "import flim_labs_api; flim_labs_api.FlimLabsApi().close()",
+}
+# a headless process must not load any of these
+GUI_MODULES = ('PyQt5', 'matplotlib')
+
+CHILD = """
+import json, sys, time
+import psutil
+process = psutil.Process()
+rss = process.memory_info().rss
+started = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    'ms': elapsed * 1000,
+    'rss_mb': (process.memory_info().rss - rss) / (1024 * 1024),
+    'gui_modules': sorted(m for m in sys.modules if m.split('.')[0] in %r),
+}))
+""" % (GUI_MODULES,)
+
+
+def measure(statement, runs, path):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', CHILD, statement], cwd=path, capture_output=True, text=True,
+                                check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'median_ms': statistics.median(s['ms'] for s in samples),
+        'max_ms': max(s['ms'] for s in samples),
+        'rss_mb': statistics.median(s['rss_mb'] for s in samples),
+        'gui_modules': sorted(set(m for s in samples for m in s['gui_modules'])),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and memory of the headless FlimLabsApi")
+    parser.add_argument('--runs', type=int, default=10, help="fresh interpreters per measure")
+    parser.add_argument('--budget-ms', type=float, default=250,
+                        help="fail when the median time of 'import flim_labs_api' exceeds it")
+    parser.add_argument('--path', default=None, help="folder of the flim_labs modules (default: ../src)")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per measure")
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    failed = False
+    for name, statement in STATEMENTS.items():
+        result = measure(statement, args.runs, path)
+        result['name'] = name
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print("%-7s median=%7.1f ms max=%7.1f ms rss=+%.1f MB gui_modules=%s" % (
+                name, result['median_ms'], result['max_ms'], result['rss_mb'], ",".join(result['gui_modules']) or '-'))
+        if result['gui_modules']:
+            failed = True
+        if name == 'import' and result['median_ms'] > args.budget_ms:
+            print("Import time over the budget of " + str(args.budget_ms) + " ms")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+import argparse
+import json
+import threading
+import time
+
+import psutil
+
+from flim_labs_api import FlimLabsApi, AcquisitionMode
+from flim_labs_fanin import DeviceFanIn
+from flim_labs_wire import WireFormat
+from flim_processor_simulator import FlimProcessorSimulator
+
+MODES = [AcquisitionMode.SPECTROSCOPY, AcquisitionMode.PHOTONS_TRACING, AcquisitionMode.MEASURE_FREQUENCY,
+         AcquisitionMode.RAW_DATA]
+# raw data is requested in chunks of this many bytes
+RAW_CHUNK_SIZE = 65536
+HANDLERS = ['batch', 'event', 'histogram']
+# the simulated device n listens on these ports + 10 * n
+COMMANDS_PORT = 5550
+DATA_PORT = 5556
+
+
+class ResourceSampler:
+    def __init__(self, interval_s: float = 0.05):
+        self.process = psutil.Process()
+        self.interval_s = interval_s
+        self.max_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_task, daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.cpu_started = self.process.cpu_times()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        wall = time.perf_counter() - self.started_at
+        cpu = self.process.cpu_times()
+        cpu_seconds = (cpu.user - self.cpu_started.user) + (cpu.system - self.cpu_started.system)
+        return cpu_seconds / wall * 100
+
+    def _sample_task(self):
+        while not self._stop.wait(self.interval_s):
+            self.max_rss = max(self.max_rss, self.process.memory_info().rss)
+
+
+def run_benchmark(mode, rate, seconds, wire_format, handler, max_batch, repeat: int = 1,
+                  persistent_session: bool = False, raw_data_file=None, autotune: bool = False):
+    delivered = [0]
+    api = FlimLabsApi()
+    api.set_processor_executable(None)
+    api.set_persistent_session(persistent_session)
+    api.set_firmware("simulator.flim")
+    api.set_wire_format(wire_format)
+    if raw_data_file is not None:
+        api.set_raw_data_file(raw_data_file)
+    histogram = None
+    match handler:
+        case 'batch':
+            api.set_batch_consumer_handler(lambda batch: delivered.__setitem__(0, delivered[0] + len(batch)),
+                                           max_batch=max_batch)
+        case 'event':
+            # raw data frames are counted in bytes, like the expected raw data
+            api.set_consumer_handler(lambda *event: delivered.__setitem__(
+                0, delivered[0] + (len(event[0]) if mode == AcquisitionMode.RAW_DATA else 1)))
+        case 'histogram':
+            histogram = api.enable_decay_histogram()
+    tuner = api.enable_autotuning() if autotune else None
+
+    # a little more than the acquisition time, so that the acquisition reaches its cutoff
+    simulator = FlimProcessorSimulator(rate, seconds + 0.2, wire_format)
+    simulator.start()
+    results = []
+    for _ in range(repeat):
+        delivered[0] = 0
+        if histogram is not None:
+            histogram.reset()
+        sampler = ResourceSampler()
+        sampler.start()
+        started = time.perf_counter()
+        match mode:
+            case AcquisitionMode.SPECTROSCOPY:
+                api.acquire_spectroscopy(laser_frequency_mhz=40, acquisition_time_seconds=seconds)
+            case AcquisitionMode.PHOTONS_TRACING:
+                api.acquire_photons_tracing(channels=[1], acquisition_time_seconds=seconds)
+            case AcquisitionMode.MEASURE_FREQUENCY:
+                api.acquire_measure_frequency()
+            case AcquisitionMode.RAW_DATA:
+                api.acquire_raw_data(chunk_size=RAW_CHUNK_SIZE, chunks=_raw_chunks(rate, seconds))
+        startup = time.perf_counter() - started
+        if mode == AcquisitionMode.MEASURE_FREQUENCY:
+            # measure frequency runs until stopped, wait for the first value only
+            deadline = time.perf_counter() + seconds + 10
+            while api.metrics.events_delivered == 0 and time.perf_counter() < deadline:
+                time.sleep(0.001)
+        else:
+            api.consumer_thread.join(seconds + 10)
+        elapsed = time.perf_counter() - started
+        api.stop_acquisition()
+        cpu_percent = sampler.stop()
+        results.append(_result(api, mode, handler, rate, seconds, simulator, histogram, delivered[0], startup,
+                               elapsed, cpu_percent, sampler.max_rss))
+        if tuner is not None:
+            # the settings chosen for the next acquisition
+            results[-1]['autotuning'] = tuner.report()
+    api.close()
+    simulator.join(10)
+    return results
+
+
+def _result(api, mode, handler, rate, seconds, simulator, histogram, delivered, startup, elapsed, cpu_percent,
+            max_rss):
+    stats = api.stats()
+    if histogram is not None:
+        delivered = int(histogram.total().sum())
+    match mode:
+        case AcquisitionMode.SPECTROSCOPY:
+            expected = _spectroscopy_events(rate, seconds)
+        case AcquisitionMode.PHOTONS_TRACING:
+            # every time_bin is 100 microseconds seconds
+            expected = seconds * 10_000
+        case AcquisitionMode.RAW_DATA:
+            expected = RAW_CHUNK_SIZE * _raw_chunks(rate, seconds)
+        case _:
+            expected = 1
+    return {
+        'mode': mode,
+        'wire_format': api.negotiated_wire_format,
+        'handler': handler,
+        'rate': rate,
+        'sent': simulator.sent.value,
+        'decoded': stats['events_decoded'],
+        'delivered': delivered,
+        'expected': expected,
+        'lost': max(expected - delivered, 0),
+        'ring_dropped': stats['queue_dropped'],
+        'queue_high_water_mark': stats['queue_high_water_mark'],
+        'startup_ms': startup * 1000,
+        'events_per_second': stats['events_decoded'] / elapsed,
+        'handler_time_p99_ms': stats['handler_time_p99_ms'],
+        'cpu_percent': cpu_percent,
+        'max_rss_mb': max_rss / (1024 * 1024),
+    }
+
+
+def run_replay_benchmark(path, laser_frequency_mhz, speed, handler, max_batch):
+    # replays a recorded spectroscopy file instead of the simulator, e.g. to profile a handler
+    delivered = [0]
+    api = FlimLabsApi()
+    api.set_processor_executable(None)
+    histogram = None
+    match handler:
+        case 'batch':
+            api.set_batch_consumer_handler(lambda batch: delivered.__setitem__(0, delivered[0] + len(batch)),
+                                           max_batch=max_batch)
+        case 'event':
+            api.set_consumer_handler(lambda *event: delivered.__setitem__(0, delivered[0] + 1))
+        case 'histogram':
+            histogram = api.enable_decay_histogram()
+    sampler = ResourceSampler()
+    sampler.start()
+    started = time.perf_counter()
+    api.replay_spectroscopy(path, laser_frequency_mhz, speed)
+    stats = api.join()
+    elapsed = time.perf_counter() - started
+    cpu_percent = sampler.stop()
+    api.close()
+    if histogram is not None:
+        delivered[0] = int(histogram.total().sum())
+    return {
+        'mode': 'replay',
+        'handler': handler,
+        'speed': speed,
+        'decoded': stats['events_decoded'],
+        'delivered': delivered[0],
+        'ring_dropped': stats['queue_dropped'],
+        'events_per_second': stats['events_decoded'] / elapsed,
+        'handler_time_p99_ms': stats['handler_time_p99_ms'],
+        'cpu_percent': cpu_percent,
+        'max_rss_mb': sampler.max_rss / (1024 * 1024),
+    }
+
+
+def run_fan_in_benchmark(mode, rate, seconds, wire_format, devices, merge, max_batch):
+    # one simulator and one FlimLabsApi per device, all acquiring at the same time
+    delivered = [0]
+    simulators = []
+    apis = []
+    for device in range(devices):
+        commands_port = COMMANDS_PORT + 10 * device
+        data_port = DATA_PORT + 10 * device
+        simulators.append(FlimProcessorSimulator(rate, seconds + 0.2, wire_format, commands_port=commands_port,
+                                                 data_port=data_port))
+        api = FlimLabsApi("tcp://localhost:" + str(data_port), "tcp://localhost:" + str(commands_port),
+                          "device" + str(device))
+        api.set_processor_executable(None)
+        api.set_firmware("simulator.flim")
+        api.set_wire_format(wire_format)
+        apis.append(api)
+    if merge:
+        handler = lambda batch: delivered.__setitem__(0, delivered[0] + len(batch))
+    else:
+        handler = lambda device, batch: delivered.__setitem__(0, delivered[0] + len(batch))
+    fan_in = DeviceFanIn(apis, handler, merge, max_batch)
+    for simulator in simulators:
+        simulator.start()
+    sampler = ResourceSampler()
+    sampler.start()
+    started = time.perf_counter()
+    if mode == AcquisitionMode.SPECTROSCOPY:
+        fan_in.acquire_spectroscopy(laser_frequency_mhz=40, acquisition_time_seconds=seconds)
+        expected = _spectroscopy_events(rate, seconds) * devices
+    else:
+        fan_in.acquire_photons_tracing(channels=[1], acquisition_time_seconds=seconds)
+        # merged bins carry the channels of all the devices
+        expected = seconds * 10_000 * (1 if merge else devices)
+    fan_in.join(seconds + 10)
+    elapsed = time.perf_counter() - started
+    cpu_percent = sampler.stop()
+    stats = fan_in.stats()
+    fan_in.close()
+    for simulator in simulators:
+        simulator.join(10)
+    decoded = sum(device['events_decoded'] for device in stats['devices'])
+    return {
+        'mode': mode,
+        'devices': devices,
+        'merge': merge,
+        'delivered': delivered[0],
+        'expected': expected,
+        'lost': max(expected - delivered[0], 0),
+        'events_per_second': decoded / elapsed,
+        'cpu_percent': cpu_percent,
+        'max_rss_mb': sampler.max_rss / (1024 * 1024),
+    }
+
+
+def _spectroscopy_events(rate, seconds):
+    # the simulator publishes an event every 1 / rate seconds from 0 ns and the cutoff is
+    # inclusive: the event at exactly the acquisition time is delivered too
+    return int(rate * seconds) + 1
+
+
+def _raw_chunks(rate, seconds):
+    return max(int(rate * seconds) // RAW_CHUNK_SIZE, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FlimLabsApi throughput benchmark against a simulated flim-processor")
+    parser.add_argument('--mode', choices=MODES + ['all'], default='all')
+    parser.add_argument('--rate', type=float, default=1_000_000,
+                        help="photons/s (spectroscopy), photons/s per channel (photons tracing) or bytes/s (raw data)")
+    parser.add_argument('--seconds', type=int, default=5)
+    parser.add_argument('--wire-format', choices=[WireFormat.BINARY, WireFormat.TEXT], default=WireFormat.BINARY)
+    parser.add_argument('--handler', choices=HANDLERS, default='batch')
+    parser.add_argument('--max-batch', type=int, default=4096)
+    parser.add_argument('--repeat', type=int, default=1, help="back-to-back acquisitions of every mode")
+    parser.add_argument('--persistent-session', action='store_true',
+                        help="keep the simulated flim-processor armed between the repeated acquisitions")
+    parser.add_argument('--raw-data-file', help="also write the raw data to this file (raw data mode)")
+    parser.add_argument('--devices', type=int, default=1,
+                        help="simulated devices acquiring at the same time (spectroscopy and photons tracing)")
+    parser.add_argument('--no-merge', action='store_true',
+                        help="with more devices, deliver the batches of every device instead of merging them")
+    parser.add_argument('--replay', help="replay this spectroscopy output file instead of running the simulator")
+    parser.add_argument('--speed', type=float, default=None,
+                        help="replay speed, 1 is real time by macro_time (default: as fast as possible)")
+    parser.add_argument('--laser-frequency', type=int, choices=[40, 80], default=40,
+                        help="laser frequency of the replayed file")
+    parser.add_argument('--autotune', action='store_true',
+                        help="tune the batch size during the acquisitions and the buffers between them")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per run")
+    args = parser.parse_args()
+
+    if args.replay is not None:
+        result = run_replay_benchmark(args.replay, args.laser_frequency, args.speed, args.handler, args.max_batch)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print("replay %-9s speed=%-6s delivered=%-10d ring_dropped=%-8d events/s=%-12.0f handler_p99=%.3f ms "
+                  "cpu=%5.1f%% rss=%.1f MB" % (
+                      result['handler'], result['speed'] or 'max', result['delivered'], result['ring_dropped'] or 0,
+                      result['events_per_second'], result['handler_time_p99_ms'] or 0, result['cpu_percent'],
+                      result['max_rss_mb']))
+        return
+
+    if args.devices > 1:
+        modes = [AcquisitionMode.SPECTROSCOPY, AcquisitionMode.PHOTONS_TRACING] if args.mode == 'all' else [args.mode]
+        for mode in modes:
+            if mode not in (AcquisitionMode.SPECTROSCOPY, AcquisitionMode.PHOTONS_TRACING):
+                raise Exception("More devices are only supported in spectroscopy and photons tracing modes")
+            result = run_fan_in_benchmark(mode, args.rate, args.seconds, args.wire_format, args.devices,
+                                          not args.no_merge, args.max_batch)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print("%-18s devices=%-3d merge=%-5s expected=%-10d delivered=%-10d lost=%-8d events/s=%-12.0f "
+                      "cpu=%5.1f%% rss=%.1f MB" % (
+                          result['mode'], result['devices'], result['merge'], result['expected'], result['delivered'],
+                          result['lost'], result['events_per_second'], result['cpu_percent'], result['max_rss_mb']))
+        return
+
+    modes = MODES if args.mode == 'all' else [args.mode]
+    for mode in modes:
+        handler = args.handler
+        if handler == 'histogram' and mode != AcquisitionMode.SPECTROSCOPY:
+            handler = 'batch'
+        results = run_benchmark(mode, args.rate, args.seconds, args.wire_format, handler, args.max_batch,
+                                args.repeat, args.persistent_session, args.raw_data_file, args.autotune)
+        for result in results:
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print("%-18s %-6s %-9s expected=%-10d delivered=%-10d lost=%-8d ring_dropped=%-8d "
+                      "startup=%7.1f ms events/s=%-12.0f cpu=%5.1f%% rss=%.1f MB" % (
+                          result['mode'], result['wire_format'], result['handler'], result['expected'],
+                          result['delivered'], result['lost'], result['ring_dropped'] or 0, result['startup_ms'],
+                          result['events_per_second'], result['cpu_percent'], result['max_rss_mb']))
+                if 'autotuning' in result:
+                    tuning = result['autotuning']
+                    print("%-18s autotuning batch=%d ring_buffer=%d receive_hwm=%s receive_buffer=%s chunk_size=%d" % (
+                        '', tuning['batch_max_size'], tuning['ring_buffer_capacity'], tuning['receive_hwm'],
+                        tuning['receive_buffer'], tuning['chunk_size']))
+
+
+if __name__ == '__main__':
+    main()
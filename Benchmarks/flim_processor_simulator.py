@@ -0,0 +1,169 @@
+import multiprocessing
+import time
+
+import numpy as np
+import zmq
+
+from flim_labs_filter import EventFilter
+from flim_labs_wire import WireFormat, SPECTROSCOPY_DTYPE, encode_binary_frame
+
+# Stand-in for flim-processor.exe: answers the commands handshake on tcp://*:5550
+# (mode -> "args" -> args -> "ok", then the optional filter and wire-format requests) and publishes
+# synthetic data on tcp://*:5556 at a fixed rate, other ports simulate more devices. It serves acquisitions until no command
+# arrives for idle_timeout_s.
+
+
+def _spectroscopy_events(rng, count, first_macro_time, rate, laser_frequency_mhz, lifetime_ns, channels):
+    period_ns = 1000 / laser_frequency_mhz
+    events = np.zeros(count, dtype=SPECTROSCOPY_DTYPE)
+    micro_time = rng.exponential(lifetime_ns, count) % period_ns
+    events['channel'] = rng.integers(0, channels, count)
+    events['time_bin'] = np.minimum(micro_time / period_ns * 256, 255)
+    events['micro_time'] = micro_time
+    events['macro_time'] = first_macro_time + np.arange(count) * (1_000_000_000 / rate)
+    events['monotonic_counter'] = events['macro_time'] // period_ns
+    return events
+
+
+def _text_messages(mode, records):
+    if mode == 'spectroscopy':
+        return ["[%d,%d,%f,%d,%f]" % tuple(record) for record in records.tolist()]
+    if mode == 'photons-tracing':
+        return ["[" + ",".join(map(str, record)) + "]" for record in records.tolist()]
+    return ["[%f]" % record for record in records.tolist()]
+
+
+def _stream(z_pub, z_commands, rng, mode, args, negotiated, event_filter, rate, seconds, frame_events, lifetime_ns,
+            spectroscopy_channels, sent, startup_delay_s):
+    # let the subscriber join before the first message
+    time.sleep(startup_delay_s)
+
+    if mode == 'measure-frequency':
+        records = np.array([80.0 + rng.normal(0, 0.0001)])
+        frame_events = 1
+        rate = 1.0
+    elif mode == 'raw-data':
+        # chunks frames of chunk_size random bytes, rate is in bytes/s
+        chunk_size = int(args[2])
+        frame_events = 1
+        records = rng.integers(0, 256, chunk_size, dtype=np.uint8).tobytes()
+        rate = rate / chunk_size
+        seconds = int(args[3]) / rate
+    elif mode == 'photons-tracing':
+        # one record per 100 microseconds time bin, rate is the photons/s per channel
+        channels = len(args[4].split(","))
+        rate_per_bin = rate / 10_000
+        rate = 10_000
+    else:
+        laser_frequency_mhz = int(args[4])
+
+    started = time.perf_counter()
+    total = 1 if mode == 'measure-frequency' else int(rate * seconds)
+    count = 0
+    while count < total:
+        if z_commands.poll(0):
+            # stop of a persistent session before the end of the acquisition
+            z_commands.recv_string()
+            z_commands.send_string("ok")
+            return
+        size = min(frame_events, total - count)
+        match mode:
+            case 'spectroscopy':
+                records = _spectroscopy_events(rng, size, count * (1_000_000_000 / rate), rate,
+                                               laser_frequency_mhz, lifetime_ns, spectroscopy_channels)
+                if event_filter is not None:
+                    records = event_filter.apply(records)
+            case 'photons-tracing':
+                records = rng.poisson(rate_per_bin, (size, channels)).astype(np.uint32)
+        if mode == 'raw-data':
+            z_pub.send(records, copy=False)
+        elif len(records) == 0:
+            # every event of the frame was filtered out
+            pass
+        elif negotiated == WireFormat.BINARY:
+            z_pub.send(encode_binary_frame(mode, records))
+        else:
+            for message in _text_messages(mode, records):
+                z_pub.send_string(message)
+        count += size
+        if sent is not None:
+            sent.value = count
+        # keep the average rate
+        delay = count / rate - (time.perf_counter() - started)
+        if delay > 0 and count < total:
+            time.sleep(delay)
+
+
+def run_simulator(rate: float, seconds: float, wire_format: str = WireFormat.BINARY, frame_events: int = 1024,
+                  lifetime_ns: float = 4.0, spectroscopy_channels: int = 1, sent=None, ready=None,
+                  idle_timeout_s: float = 2.0, startup_delay_s: float = 0.3, commands_port: int = 5550,
+                  data_port: int = 5556, filters: bool = True):
+    context = zmq.Context()
+    z_commands = context.socket(zmq.REP)
+    z_commands.bind("tcp://*:" + str(commands_port))
+    z_pub = context.socket(zmq.PUB)
+    z_pub.SNDHWM = 0
+    z_pub.bind("tcp://*:" + str(data_port))
+    if ready is not None:
+        ready.set()
+    rng = np.random.default_rng(0)
+    try:
+        # a persistent session sends "stop" and then the next mode on the same process
+        wait_ms = -1
+        while z_commands.poll(wait_ms):
+            wait_ms = idle_timeout_s * 1000
+            mode = z_commands.recv_string()
+            if mode == "stop":
+                z_commands.send_string("ok")
+                continue
+            z_commands.send_string("args")
+            args = z_commands.recv_string().split(";")
+            z_commands.send_string("ok")
+            negotiated = WireFormat.TEXT
+            event_filter = None
+            while z_commands.poll(1000):
+                request = z_commands.recv_string()
+                if request.startswith("filter;"):
+                    # without filters: a processor that does not know the request
+                    if filters:
+                        event_filter = EventFilter.from_processor_args(request[len("filter;"):])
+                    z_commands.send_string("ok" if filters else "unknown")
+                    continue
+                if request == "wire-format;" + WireFormat.BINARY and wire_format == WireFormat.BINARY:
+                    negotiated = WireFormat.BINARY
+                z_commands.send_string(negotiated)
+                break
+            _stream(z_pub, z_commands, rng, mode, args, negotiated, event_filter, rate, seconds, frame_events,
+                    lifetime_ns, spectroscopy_channels, sent, startup_delay_s)
+            # only the first acquisition waits for the subscriber to join
+            startup_delay_s = 0
+    finally:
+        z_commands.close(linger=0)
+        z_pub.close(linger=1000)
+        context.term()
+
+
+class FlimProcessorSimulator:
+    # runs the simulator in its own process, so it does not share the GIL with the API
+    # without filters the simulator answers the filter request like an older flim-processor
+    def __init__(self, rate: float, seconds: float, wire_format: str = WireFormat.BINARY, frame_events: int = 1024,
+                 commands_port: int = 5550, data_port: int = 5556, filters: bool = True):
+        context = multiprocessing.get_context('spawn')
+        self.sent = context.Value('q', 0)
+        self._ready = context.Event()
+        self.process = context.Process(
+            target=run_simulator,
+            args=(rate, seconds, wire_format, frame_events),
+            kwargs={'sent': self.sent, 'ready': self._ready, 'commands_port': commands_port, 'data_port': data_port,
+                    'filters': filters},
+            daemon=True
+        )
+
+    def start(self):
+        self.process.start()
+        self._ready.wait(10)
+
+    def join(self, timeout: float = None):
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
@@ -1,8 +1,8 @@
 import os
 import glob
-import struct
 import matplotlib.pyplot as plt
-import numpy as np
+
+from flim_labs_io import open_spectroscopy_file
 
 # get current working directory
 cwd = os.getcwd()
@@ -23,18 +23,11 @@ while True:
     else:
         break
         
-microtime_array=[]
-
-with open(file, "rb") as f:
-    
-    while f.read(1):       
-        microtime = struct.unpack('d', f.read(8))
-        macrotime = struct.unpack('d', f.read(8))
-        microtime_array.append(microtime) 
-        
-microtime_asarray = np.asarray(microtime_array)
+spectroscopy_file = open_spectroscopy_file(file)
+
+counts, edges = spectroscopy_file.histogram(bins=256)
 
-plt.hist(microtime_asarray, bins=256)
+plt.stairs(counts, edges, fill=True)
 plt.xlabel('Microtime')
 plt.ylabel('Counts')
 plt.title('Microtime Histogram')
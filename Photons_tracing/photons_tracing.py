@@ -1,15 +1,16 @@
+import time
+
 import matplotlib
 import numpy as np
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
-from numpy import linspace
 
 matplotlib.use('Qt5Agg')
 
-from PyQt5.QtCore import QTimer, QMutex
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QLabel
 
-from flim_labs_api import FlimLabsApi
+from flim_labs_api import FlimLabsApi, AcquisitionMode
 
 SLICE_SECONDS = 10_000
 
@@ -29,19 +30,19 @@ class MainWindow(QMainWindow):
         self.setWindowTitle('Photons tracing')
 
         self.api = FlimLabsApi()
-        self.api.set_consumer_handler(self.receive_data)
+        self.trace_view = self.api.enable_trace_view()
+        # every bin of the acquisition, saved to photons_tracing.npz when the window is closed
+        self.trace_store = self.api.enable_trace_store()
+        self.correlator = self.api.enable_photon_correlator(window_seconds=1)
 
         self.chart = MplCanvas(self, width=12, height=5, dpi=100)
         self.setCentralWidget(self.chart)
 
         self.slice = 1 * SLICE_SECONDS
+        self.pixels = 1000
         self.channels = [1]
         self.acquisition_time_in_seconds = 10
 
-        self.data = []
-        for _ in self.channels:
-            self.data.append([])
-
         # create timer to refresh histogram
         self.refresh_timer = QTimer()
         self.refresh_timer.timeout.connect(self.refresh_histogram)
@@ -53,56 +54,47 @@ class MainWindow(QMainWindow):
         self.start_button.move(5, 5)
         self.start_button.clicked.connect(self.start_acquisition)
 
-        self.mutex = QMutex()
-
         # create a label to show the current phase
         self.phase_label = QLabel(self)
         self.phase_label.move(5, 40)
         self.phase_label.setText('Row received: 0')
         self.phase_label.adjustSize()
-        self.rows_received = 0
-
-        # self.data = np.load('correlation_data.npz')['data']
 
         self.show()
 
     def closeEvent(self, event):
+        # stopping the acquisition also closes the recording
         self.api.stop_acquisition()
-        np.savez_compressed('photons_tracing', data=self.data)
+        # (channels x bins) photon counts, as saved by the previous versions of the example
+        np.savez_compressed('photons_tracing', data=self.trace_store.counts().T.astype(np.int64))
         event.accept()
 
     def start_acquisition(self):
         self.start_button.setEnabled(False)
         self.api.set_firmware("firmwares\\photons_tracing.flim")
+        self.api.attach_recorder(time.strftime("photons_tracing_%Y%m%d-%H%M%S.flrec"), AcquisitionMode.PHOTONS_TRACING)
         self.api.acquire_photons_tracing(channels=self.channels,
                                          acquisition_time_seconds=self.acquisition_time_in_seconds)
 
-    def receive_data(self, row_data):
-        self.mutex.lock()
-        for i, channel in enumerate(self.channels):
-            # self.data[i].append(row_data[i] + self.data[i][-1] if len(self.data[i]) > 0 else 0)
-            self.data[i].append(row_data[i])
-        self.rows_received += 1
-        self.mutex.unlock()
-
     def refresh_histogram(self):
         try:
             self.chart.axes.clear()
-            total_x = len(self.data[0])
-            slice_x = min(total_x, self.slice)
-            if slice_x == 0:
+            # the last slice of the acquisition, already reduced to at most self.pixels points
+            x_data, _, _, y_data = self.trace_view.view(self.slice / SLICE_SECONDS, self.pixels)
+            if len(x_data) == 0:
                 return
-            starting_seconds = max((total_x - slice_x) / SLICE_SECONDS, 0)
-            x_data = linspace(starting_seconds, starting_seconds + (self.slice / SLICE_SECONDS),
-                              num=min(slice_x, self.slice))
+            starting_seconds = x_data[0]
             for i, channel in enumerate(self.channels):
-                self.chart.axes.plot(x_data, self.data[i][-slice_x:])
+                self.chart.axes.plot(x_data, y_data[:, i])
             self.chart.axes.set_xbound(lower=starting_seconds,
-                                       upper=starting_seconds + (min(slice_x, self.slice) / SLICE_SECONDS))
+                                       upper=starting_seconds + (self.slice / SLICE_SECONDS))
             self.chart.axes.set_xlabel('Time Bins (100μs)')
             self.chart.axes.set_ylabel('Photon counts')
             self.chart.draw()
-            self.phase_label.setText(f'Bins received: {self.rows_received}')
+            # count rate and Fano factor of the first channel over the last second
+            rate = self.correlator.count_rates(window=True)[0]
+            fano = self.correlator.fano_factors(window=True)[0]
+            self.phase_label.setText(f'Bins received: {self.trace_view.total_bins}, {rate:.0f} photons/s, Fano {fano:.2f}')
             self.phase_label.adjustSize()
         except Exception as e:
             print(e)
@@ -6,10 +6,11 @@ from numpy import linspace
 matplotlib.use('Qt5Agg')
 
 import numpy as np
-from PyQt5.QtCore import QTimer, QMutex
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QLabel
 
 from flim_labs_api import FlimLabsApi
+from flim_labs_fit import LifetimeFitter
 
 
 class MplCanvas(FigureCanvasQTAgg):
@@ -34,7 +35,8 @@ class MainWindow(QMainWindow):
         self.setWindowTitle('Spectroscopy ' + str(self.laser_mhz) + ' MHz')
 
         self.api = FlimLabsApi()
-        self.api.set_consumer_handler(self.receive_point)
+        self.histogram = self.api.enable_decay_histogram()
+        self.fitter = LifetimeFitter(self.laser_mhz, workers=1)
 
         self.chart = MplCanvas(self, width=12, height=5, dpi=100)
         self.chart.axes.plot(self.x_data, self.y_data)
@@ -56,8 +58,6 @@ class MainWindow(QMainWindow):
         self.stop_button.move(120, 5)
         self.stop_button.clicked.connect(self.stop_acquisition)
 
-        self.mutex = QMutex()
-
         # create a label to show the current phase
         self.phase_label = QLabel(self)
         self.phase_label.move(5, 40)
@@ -85,17 +85,15 @@ class MainWindow(QMainWindow):
     def stop_acquisition(self):
         self.stop_button.setEnabled(False)
         self.api.stop_acquisition()
+        self.histogram.reset()
+        self.fitter.reset()
         self.y_data = np.zeros(256)
         self.points_received = 0
         self.start_button.setEnabled(True)
 
-    def receive_point(self, channel, time_bin, micro_time, monotonic_counter, macro_time):
-        self.mutex.lock()
-        self.y_data[time_bin] += 1
-        self.points_received += 1
-        self.mutex.unlock()
-
     def refresh_histogram(self):
+        self.y_data = self.histogram.total()
+        self.points_received = int(self.y_data.sum())
         self.chart.axes.clear()
         self.chart.axes.plot(self.x_data, self.y_data)
         self.chart.axes.set_xlabel('Time (ns)')
@@ -103,7 +101,12 @@ class MainWindow(QMainWindow):
         self.chart.axes.set_xbound(0, 1000 / self.laser_mhz)
         self.chart.draw()
         # format points received with commas
-        self.phase_label.setText(f'Total photons: {self.points_received:,}')
+        lifetime = ''
+        if self.points_received > 1000:
+            # single exponential tail fit, started from the previous lifetime
+            self.fitter.fit(self.y_data)
+            lifetime = f'   Lifetime: {self.fitter.lifetimes()[0]:.2f} ns'
+        self.phase_label.setText(f'Total photons: {self.points_received:,}' + lifetime)
         self.phase_label.adjustSize()
 
 
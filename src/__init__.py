@@ -1,4 +1,33 @@
-from flim_labs_api import FlimLabsApi
+import importlib
 
 # Version of the package
-__version__ = "1.0.0"
\ No newline at end of file
+__version__ = "1.0.0"
+
+# the public names are imported from their module on first use, so that importing the
+# package does not import the modules of the features that are not used
+_LAZY_NAMES = {
+    'FlimLabsApi': 'flim_labs_api',
+    'AcquisitionMode': 'flim_labs_api',
+    'AsyncFlimLabsApi': 'flim_labs_async',
+    'DeviceFanIn': 'flim_labs_fanin',
+    'OverflowPolicy': 'flim_labs_ring',
+    'WireFormat': 'flim_labs_wire',
+    'SpectroscopyFile': 'flim_labs_io',
+    'open_spectroscopy_file': 'flim_labs_io',
+    'RecordingReader': 'flim_labs_recorder',
+    'FitModel': 'flim_labs_fit',
+    'LifetimeFitter': 'flim_labs_fit',
+    'fit_decays': 'flim_labs_fit',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_NAMES:
+        raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+    value = getattr(importlib.import_module(_LAZY_NAMES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_NAMES))
@@ -1,12 +1,21 @@
-import subprocess
 import threading
 import time
 import traceback
-from queue import Queue, Empty
+from concurrent.futures import Future
 
-import psutil
+import numpy as np
 import zmq
 
+from flim_labs_metrics import AcquisitionMetrics, MetricsExporter
+from flim_labs_raw import RawDataWriter, RawFrameQueue, raw_frame_array
+from flim_labs_ring import RingBuffer, OverflowPolicy
+from flim_labs_session import ProcessorProcess, kill_stale_processor, pid_file, DATA_ENDPOINT, COMMANDS_ENDPOINT
+from flim_labs_wire import WireFormat, is_binary_frame, decode_binary_frame, decode_text_message, events_to_array, \
+    SPECTROSCOPY_DTYPE, PHOTONS_TRACING_DTYPE, MEASURE_FREQUENCY_DTYPE
+
+# the modules of the optional features (accumulators, recorder, pipeline, replay) are
+# imported by the methods enabling them, so that a headless process only pays for the
+# acquisition path: numpy, pyzmq and the modules imported here
 MB = 262144
 
 
@@ -18,26 +27,114 @@ class AcquisitionMode:
     RAW_DATA = 'raw-data'                  # salva i dati da fpga
 
 
+def photons_tracing_args(channels):
+    if channels is None:
+        raise Exception("Channel list is None")
+    if len(channels) > 12:
+        raise Exception("Maximum number of channels is 12")
+    for channel in channels:
+        if channel < 1 or channel > 12:
+            raise Exception("Channel number must be between 1 and 12")
+    if len(channels) == 0:
+        raise Exception("Channel list is empty")
+    if len(channels) != len(set(channels)):
+        raise Exception("Channel list contains duplicated")
+
+    channels_str = ""
+    for channel in channels:
+        channels_str += str(channel) + ","
+    return channels_str[:-1]
+
+
+def spectroscopy_args(laser_frequency_mhz, acquisition_time_seconds):
+    if laser_frequency_mhz != 40 and laser_frequency_mhz != 80:
+        raise Exception("Laser frequency must be 40 or 80 MHz")
+
+    if acquisition_time_seconds <= 0:
+        raise Exception("Acquisition time must be greater than 0 seconds")
+
+    return str(laser_frequency_mhz)
+
+
+def processor_commands(firmware, output_file, chunk_size, chunks, additional_args=None):
+    commands = firmware + ";" + output_file + ";" + str(chunk_size) + ";" + str(chunks)
+    if additional_args is not None:
+        commands += ";" + additional_args
+    return commands
+
+
 class FlimLabsApi:
-    def __init__(self):
-        self._kill_process_if_exists("flim-processor.exe")
-        self._kill_process_if_exists("flim-reader.exe")
+    # every FlimLabsApi is one session with one device: a second card is used through a
+    # second FlimLabsApi connected to the endpoints of its flim-processor, see
+    # flim_labs_fanin.DeviceFanIn to acquire from several devices at once
+    def __init__(self, data_endpoint: str = DATA_ENDPOINT, commands_endpoint: str = COMMANDS_ENDPOINT,
+                 name: str = None):
+        self.data_endpoint = data_endpoint
+        self.commands_endpoint = commands_endpoint
+        # also used in the output file names, so that the devices do not share them
+        self.name = name
 
         self.acquisition_time_seconds = None
         self.acquisition_mode = AcquisitionMode.UNSET
-        self.queue = Queue()
+        self.ring_buffer = None
+        self.ring_buffer_capacity = 1024 * 1024
+        self.ring_buffer_overflow_policy = OverflowPolicy.BLOCK
 
-        self.z_sub = zmq.Context().socket(zmq.SUB)
-        self.z_sub.RCVTIMEO = 1000
-        self.z_sub.connect("tcp://localhost:5556")
-        self.z_sub.setsockopt(zmq.SUBSCRIBE, b"")
+        # ZMQ receive high water mark (messages) and kernel receive buffer (bytes) of the
+        # data socket, None for the ZMQ defaults, see set_receive_buffers
+        self.receive_hwm = None
+        self.receive_buffer = None
+        self._receive_buffers_applied = (None, None)
+
+        # one context for all the sockets of the process
+        self.z_sub = None
+        self._connect_data_socket()
 
-        self.z_commands = zmq.Context().socket(zmq.REQ)
-        self.z_commands.connect("tcp://localhost:5550")
+        self.z_commands = None
+        self._connect_commands_socket()
+        # ZMQ sockets are not thread-safe: every exchange on the REQ commands socket, from the
+        # acquiring thread or from any thread stopping the acquisition, holds this lock
+        self._commands_lock = threading.RLock()
+
+        # stop requests wake the receiver through this inproc socket, polled with z_sub
+        control_endpoint = "inproc://flim-labs-control-" + str(id(self))
+        self.z_control = zmq.Context.instance().socket(zmq.PULL)
+        self.z_control.bind(control_endpoint)
+        self._z_control_push = zmq.Context.instance().socket(zmq.PUSH)
+        self._z_control_push.connect(control_endpoint)
+        self._control_lock = threading.Lock()
+        self.drain_on_stop = False
+        # resolved with the final stats() when both threads of the acquisition are done
+        self.acquisition_done = None
+        # current flim-processor builds only publish text and never answer the requests
+        # that follow the handshake: binary, and with it the filter request, are opt-in
+        self.wire_format = WireFormat.TEXT
+        self.negotiated_wire_format = WireFormat.TEXT
+
+        # None when flim-processor is started by someone else, e.g. the benchmark simulator
+        self.processor_executable = "flim-processor.exe"
+        self.processor_args = []
+        self.processor = None
+        # the processor and readers left by a crashed session are killed by the first
+        # acquisition, once the executable is known
+        self._stale_processor_checked = False
+        self.persistent_session = False
+        # size in bytes of the reads of flim-reader and their number, for the photons
+        # tracing and spectroscopy acquisitions, see set_chunk_size
+        self.chunk_size = 1024
+        self.chunks = 800 * 1024
+        self.tuner = None
+        # spectroscopy events kept, see set_event_filter. The active filter is the part left
+        # to the API in the running acquisition, None when flim-processor applies it all
+        self.event_filter = None
+        self._active_filter = None
 
         self.receiver_thread = None
         self.consumer_thread = None
         self.consumer_handler = None
+        self.batch_consumer_handler = None
+        self.batch_max_size = 4096
+        self.batch_max_latency_ms = 50
         self.firmware = None
         self.enable_consumer = False
         self.enable_consumer_lock = threading.Lock()
@@ -45,8 +142,36 @@ class FlimLabsApi:
         self.enable_receiver_lock = threading.Lock()
 
         self.photons_tracing_bin_count = 0
+        self.photons_tracing_channels = []
+
+        # accumulators are fed with whole batches directly by the receiver thread
+        self.accumulators = []
+        self._accumulator_stage = []
+        self._accumulated_bins = 0
+
+        # optional multiprocess decoding, see enable_pipeline
+        self.pipeline = None
+
+        # raw data frames are queued as received, without copies, see acquire_raw_data
+        self.raw_queue = None
+        self.raw_queue_frames = 1024
+        self.raw_data_file = None
+        self.raw_data_preallocate = True
+        self.raw_data_writer = None
+
+        # spectroscopy output file fed to the consumer instead of flim-processor, see replay_spectroscopy
+        self.replay_file = None
+
+        self.metrics = AcquisitionMetrics()
+        self.metrics_exporter = None
 
     def receiver_task(self):
+        poller = zmq.Poller()
+        poller.register(self.z_sub, zmq.POLLIN)
+        poller.register(self.z_control, zmq.POLLIN)
+        # stop requests sent while no acquisition was running
+        while self.z_control.poll(0):
+            self.z_control.recv()
         while True:
             self.enable_receiver_lock.acquire()
             if not self.enable_receiver:
@@ -54,99 +179,476 @@ class FlimLabsApi:
                 break
             self.enable_receiver_lock.release()
             try:
+                sockets = dict(poller.poll(100))
+                if self.z_control in sockets:
+                    self.z_control.recv()
+                    break
+                if self.z_sub not in sockets:
+                    # idle, hand the staged text events to the accumulators
+                    self._flush_accumulator_stage()
+                    # the workers may reach the cutoff after the last message was forwarded
+                    if self.pipeline is not None and self.pipeline.cutoff_reached():
+                        print("[PY-API] Acquisition time reached. Stopping acquisition.")
+                        self.stop_acquisition()
+                    continue
+
+                if self.raw_queue is not None:
+                    frame = self.z_sub.recv(copy=False)
+                    self.metrics.record_message(len(frame), size=len(frame))
+                    if not self.raw_queue.put(frame):
+                        # all the requested bytes are queued, the consumer stops the acquisition
+                        self.raw_queue.finish()
+                        break
+                    continue
+
                 message = self.z_sub.recv()
-                message = message.decode('utf-8')
 
-                if message == 'exp':
+                if self.pipeline is not None:
+                    self.metrics.record_message(0, size=len(message))
+                    if not self.pipeline.forward(message) or self.pipeline.cutoff_reached():
+                        print("[PY-API] Acquisition time reached. Stopping acquisition.")
+                        self.stop_acquisition()
+                    continue
+
+                if is_binary_frame(message):
+                    batch = decode_binary_frame(message)
+                    self.metrics.record_message(len(batch), self._last_macro_time(batch), len(message))
+                    if self._active_filter is not None:
+                        batch = self._filter_batch(batch)
+                        if len(batch) == 0:
+                            continue
+                    if self.accumulators:
+                        self._feed_accumulators(batch)
+                    self.ring_buffer.push(batch)
+                    continue
+
+                size = len(message)
+                message = decode_text_message(self.acquisition_mode, message)
+                if message is None:
+                    self.metrics.record_message(0, size=size)
+                    continue
+                self.metrics.record_message(
+                    1, message[4] if self.acquisition_mode == AcquisitionMode.SPECTROSCOPY else None, size)
+                if self._active_filter is not None and not self._active_filter.accepts(message):
+                    self.metrics.record_filtered(1)
+                    self._check_filtered_cutoff(message[4])
                     continue
 
-                message = message[1:-1].split(',')
-
-                match self.acquisition_mode:
-                    case AcquisitionMode.PHOTONS_TRACING:
-                        message = list(map(int, message))
-                    case AcquisitionMode.MEASURE_FREQUENCY:
-                        message = list(map(float, message))[0]
-                    case AcquisitionMode.SPECTROSCOPY:
-                        message = (
-                            int(message[0]),
-                            int(message[1]),
-                            float(message[2]),
-                            int(message[3]),
-                            float(message[4])
-                        )
-                    case _:
-                        raise Exception("[PY-API] receiver_task: Invalid acquisition mode=" + self.acquisition_mode)
-
-                self.queue.put(message)
-
-            except zmq.error.Again:
-                pass
+                if self.accumulators:
+                    self._stage_for_accumulators(message)
+                self.ring_buffer.push_one(message)
+
             except Exception as e:
+                self.metrics.record_parse_error()
                 print(e)
+        self._flush_accumulator_stage()
+        # nothing else will be queued: a draining consumer stops once the queue is empty
+        if self.ring_buffer is not None:
+            self.ring_buffer.close()
+        if self.raw_queue is not None:
+            self.raw_queue.finish()
         print("[PY-API] Receiver thread stopped.")
 
+    def replay_task(self, laser_frequency_mhz, speed, chunk_events):
+        from flim_labs_io import spectroscopy_events
+
+        # stands in for receiver_task: the events of the file are pushed to the ring buffer
+        # and the accumulators when the replay clock reaches their macro_time
+        while self.z_control.poll(0):
+            self.z_control.recv()
+        stopped = False
+        first_macro_time = None
+        started = time.perf_counter()
+        for chunk in self.replay_file.iter_chunks(chunk_events):
+            events = spectroscopy_events(chunk, laser_frequency_mhz)
+            if first_macro_time is None and len(events) > 0:
+                first_macro_time = events['macro_time'][0]
+            while len(events) > 0 and not stopped:
+                self.enable_receiver_lock.acquire()
+                stopped = not self.enable_receiver
+                self.enable_receiver_lock.release()
+                if stopped:
+                    break
+                count = len(events)
+                if speed is not None:
+                    replay_time = first_macro_time + (time.perf_counter() - started) * speed * 1_000_000_000
+                    count = int(np.searchsorted(events['macro_time'], replay_time, 'right'))
+                    if count == 0:
+                        # sleep until the next event, or until stop_acquisition wakes us up
+                        wait_ms = (events['macro_time'][0] - replay_time) / speed / 1_000_000
+                        if self.z_control.poll(min(max(int(wait_ms), 1), 100)):
+                            self.z_control.recv()
+                            stopped = True
+                        continue
+                batch = events[:count]
+                events = events[count:]
+                self.metrics.record_message(len(batch), float(batch['macro_time'][-1]))
+                if self._active_filter is not None:
+                    batch = self._filter_batch(batch)
+                    if len(batch) == 0:
+                        continue
+                if self.accumulators:
+                    self._feed_accumulators(batch)
+                self.ring_buffer.push(batch)
+            if stopped:
+                break
+        self.replay_file.close()
+        self.ring_buffer.close()
+        if not stopped:
+            # the consumer delivers what is still queued and completes the acquisition
+            print("[PY-API] End of the replayed file. Stopping acquisition.")
+            self.stop_acquisition(drain=True)
+        print("[PY-API] Replay thread stopped.")
+
+    def _filter_batch(self, batch):
+        filtered = self._active_filter.apply(batch)
+        if len(filtered) < len(batch):
+            self.metrics.record_filtered(len(batch) - len(filtered))
+            if len(filtered) == 0 or filtered['macro_time'][-1] < batch['macro_time'][-1]:
+                self._check_filtered_cutoff(batch['macro_time'][-1])
+        return filtered
+
+    def _check_filtered_cutoff(self, macro_time):
+        # the consumer stops at the first event after the acquisition time, which may have
+        # been filtered out: stop here and let the consumer deliver the queued events
+        if macro_time > self.acquisition_time_seconds * 1_000_000_000 and self.enable_receiver:
+            print("[PY-API] Acquisition time reached. Stopping acquisition.")
+            self.stop_acquisition(drain=True)
+
+    def _stage_for_accumulators(self, message):
+        # text messages carry a single event, group them before feeding the accumulators
+        self._accumulator_stage.append(message)
+        if len(self._accumulator_stage) >= 256:
+            self._flush_accumulator_stage()
+
+    def _flush_accumulator_stage(self):
+        if not self._accumulator_stage:
+            return
+        stage = self._accumulator_stage
+        self._accumulator_stage = []
+        if self.ring_buffer is not None:
+            self._feed_accumulators(events_to_array(self.acquisition_mode, stage))
+
+    def _feed_accumulators(self, batch):
+        match self.acquisition_mode:
+            case AcquisitionMode.SPECTROSCOPY:
+                batch = batch[batch['macro_time'] <= self.acquisition_time_seconds * 1_000_000_000]
+            case AcquisitionMode.PHOTONS_TRACING:
+                # every time_bin is 100 microseconds seconds
+                remaining_bins = int(self.acquisition_time_seconds * 10_000) - self._accumulated_bins
+                batch = batch[:max(remaining_bins, 0)]
+                self._accumulated_bins += len(batch)
+        if len(batch) == 0:
+            return
+        for accumulator in self.accumulators:
+            if accumulator.acquisition_mode == self.acquisition_mode:
+                accumulator.feed(batch)
+
     def consumer_task(self):
         while True:
             self.enable_consumer_lock.acquire()
-            if not self.enable_consumer:
-                self.enable_consumer_lock.release()
-                break
+            stopping = not self.enable_consumer
             self.enable_consumer_lock.release()
+            if stopping and not (self.drain_on_stop and self._events_pending()):
+                break
             try:
-                message = self.queue.get(timeout=0.1)
+                if self.raw_queue is not None:
+                    if not self._consume_raw():
+                        break
+                    continue
+
+                if self.ring_buffer is None:
+                    time.sleep(0.1)
+                    continue
+
+                # without a per-event handler the batch path still applies the acquisition
+                # time cutoff, e.g. when only accumulators are used
+                if self.batch_consumer_handler or not self.consumer_handler:
+                    if not self._consume_batch():
+                        break
+                    continue
+
+                if self.ring_buffer.wait_for_data(0.1) == 0:
+                    continue
+                # events are unpacked to the same python values the text path produces
+                messages = self.ring_buffer.pop(self.batch_max_size).tolist()
 
                 if self.consumer_handler:
-                    match self.acquisition_mode:
-                        case AcquisitionMode.PHOTONS_TRACING:
-                            self.photons_tracing_bin_count += 1
-                            # every time_bin is 100 microseconds seconds
-                            if self.photons_tracing_bin_count > self.acquisition_time_seconds * 10_000:
-                                print("[PY-API] Acquisition time reached. Stopping acquisition.")
-                                print("[PY-API] Acquisition time: " + str(
-                                    self.acquisition_time_seconds) + " s, bin_count: " + str(
-                                    self.photons_tracing_bin_count))
-                                self.stop_acquisition()
-                                break
-                            self.consumer_handler(message)
-                        case AcquisitionMode.MEASURE_FREQUENCY:
-                            self.consumer_handler(message)
-                        case AcquisitionMode.SPECTROSCOPY:
-                            channel, time_bin, micro_time, monotonic_counter, macro_time = message
-                            if macro_time > self.acquisition_time_seconds * 1_000_000_000:
-                                print("[PY-API] Acquisition time reached. Stopping acquisition.")
-                                print("[PY-API] Acquisition time: " + str(
-                                    self.acquisition_time_seconds) + " s, macro_time: " + str(macro_time) + " ns")
-                                self.stop_acquisition()
-                                 
-                                break
-                            self.consumer_handler(channel, time_bin, micro_time, monotonic_counter, macro_time)
-                        case AcquisitionMode.RAW_DATA:
-                            pass
-                        case _:
-                            raise Exception("[PY-API] consumer_task: Invalid acquisition mode=" + self.acquisition_mode)
-            except Empty:
-                pass
+                    started = time.perf_counter()
+                    dispatched = self._dispatch_messages(messages)
+                    self.metrics.record_handler(time.perf_counter() - started, dispatched,
+                                                self._last_macro_time(messages[:dispatched]))
+                    # fewer events dispatched than popped: the acquisition time was reached
+                    if dispatched < len(messages):
+                        break
             except Exception as e:
                 print("[PY-API] Consumer error: " + str(e))
                 traceback.print_exc()
+        # whatever is still queued is never delivered
+        if self.ring_buffer is not None:
+            self.metrics.record_discarded(len(self.ring_buffer))
+        if self.raw_queue is not None:
+            self.metrics.record_discarded(self.raw_queue.queued_bytes())
+        if self.raw_data_writer is not None:
+            self.raw_data_writer.close()
+            self.raw_data_writer = None
         print("[PY-API] Consumer thread stopped.")
+        self._complete_acquisition()
+
+    def _events_pending(self):
+        # queued events, or events the receiver may still queue
+        if self.raw_queue is not None:
+            return not self.raw_queue.closed
+        return self.ring_buffer is not None and (len(self.ring_buffer) > 0 or not self.ring_buffer.closed)
+
+    def _complete_acquisition(self):
+        if self.receiver_thread is not None and self.receiver_thread is not threading.current_thread():
+            self.receiver_thread.join()
+        if self.acquisition_done is not None and not self.acquisition_done.done():
+            self.acquisition_done.set_result(self.stats())
+
+    def _consume_raw(self):
+        # the handlers and the raw data file get views of the received ZMQ buffers
+        frames, views, finished = self.raw_queue.get_many(self.batch_max_size, 0.1)
+        if views:
+            started = time.perf_counter()
+            if self.raw_data_writer is not None:
+                self.raw_data_writer.write(views)
+            for view in views:
+                if self.consumer_handler:
+                    self.consumer_handler(view)
+                if self.batch_consumer_handler:
+                    self.batch_consumer_handler(raw_frame_array(view))
+            self.metrics.record_handler(time.perf_counter() - started, sum(len(view) for view in views))
+        if finished:
+            if self.enable_consumer:
+                print("[PY-API] Raw data received: " + str(self.raw_queue.bytes_received) + " bytes. Stopping acquisition.")
+                self.stop_acquisition()
+            return False
+        return True
+
+    def _consume_batch(self):
+        if self.ring_buffer.wait_for_data(0.1) == 0:
+            return True
+        deadline = time.monotonic() + self.batch_max_latency_ms / 1000
+        while len(self.ring_buffer) < self.batch_max_size and not self.ring_buffer.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.ring_buffer.wait_for_data(remaining, self.batch_max_size)
+        return self._dispatch_batch(self.ring_buffer.pop(self.batch_max_size))
+
+    def _dispatch_batch(self, batch):
+        match self.acquisition_mode:
+            case AcquisitionMode.PHOTONS_TRACING:
+                # every time_bin is 100 microseconds seconds
+                remaining_bins = int(self.acquisition_time_seconds * 10_000) - self.photons_tracing_bin_count
+                if len(batch) > remaining_bins:
+                    self.metrics.record_discarded(len(batch) - max(remaining_bins, 0))
+                    batch = batch[:max(remaining_bins, 0)]
+                    self.photons_tracing_bin_count += len(batch)
+                    if len(batch) > 0:
+                        self._call_batch_handler(batch)
+                    print("[PY-API] Acquisition time reached. Stopping acquisition.")
+                    print("[PY-API] Acquisition time: " + str(
+                        self.acquisition_time_seconds) + " s, bin_count: " + str(
+                        self.photons_tracing_bin_count))
+                    self.stop_acquisition()
+                    return False
+                self.photons_tracing_bin_count += len(batch)
+                self._call_batch_handler(batch)
+            case AcquisitionMode.MEASURE_FREQUENCY:
+                self._call_batch_handler(batch)
+            case AcquisitionMode.SPECTROSCOPY:
+                over = np.flatnonzero(batch['macro_time'] > self.acquisition_time_seconds * 1_000_000_000)
+                if len(over) > 0:
+                    macro_time = batch['macro_time'][over[0]]
+                    self.metrics.record_discarded(len(batch) - over[0])
+                    batch = batch[:over[0]]
+                    if len(batch) > 0:
+                        self._call_batch_handler(batch)
+                    print("[PY-API] Acquisition time reached. Stopping acquisition.")
+                    print("[PY-API] Acquisition time: " + str(
+                        self.acquisition_time_seconds) + " s, macro_time: " + str(macro_time) + " ns")
+                    self.stop_acquisition()
+                    return False
+                self._call_batch_handler(batch)
+            case _:
+                raise Exception("[PY-API] consumer_task: Invalid acquisition mode=" + self.acquisition_mode)
+        return True
+
+    def _call_batch_handler(self, batch):
+        if self.batch_consumer_handler is None:
+            return
+        started = time.perf_counter()
+        self.batch_consumer_handler(batch)
+        self.metrics.record_handler(time.perf_counter() - started, len(batch), self._last_macro_time(batch))
+
+    def _last_macro_time(self, events):
+        if self.acquisition_mode != AcquisitionMode.SPECTROSCOPY or len(events) == 0:
+            return None
+        if isinstance(events, np.ndarray):
+            return float(events['macro_time'][-1])
+        return events[-1][4]
+
+    # returns the number of events passed to the handler, all of them unless the
+    # acquisition time is reached
+    def _dispatch_messages(self, messages):
+        for index, message in enumerate(messages):
+            match self.acquisition_mode:
+                case AcquisitionMode.PHOTONS_TRACING:
+                    self.photons_tracing_bin_count += 1
+                    # every time_bin is 100 microseconds seconds
+                    if self.photons_tracing_bin_count > self.acquisition_time_seconds * 10_000:
+                        self.metrics.record_discarded(len(messages) - index)
+                        print("[PY-API] Acquisition time reached. Stopping acquisition.")
+                        print("[PY-API] Acquisition time: " + str(
+                            self.acquisition_time_seconds) + " s, bin_count: " + str(
+                            self.photons_tracing_bin_count))
+                        self.stop_acquisition()
+                        return index
+                    self.consumer_handler(message)
+                case AcquisitionMode.MEASURE_FREQUENCY:
+                    self.consumer_handler(message)
+                case AcquisitionMode.SPECTROSCOPY:
+                    channel, time_bin, micro_time, monotonic_counter, macro_time = message
+                    if macro_time > self.acquisition_time_seconds * 1_000_000_000:
+                        self.metrics.record_discarded(len(messages) - index)
+                        print("[PY-API] Acquisition time reached. Stopping acquisition.")
+                        print("[PY-API] Acquisition time: " + str(
+                            self.acquisition_time_seconds) + " s, macro_time: " + str(macro_time) + " ns")
+                        self.stop_acquisition()
+                        return index
+                    self.consumer_handler(channel, time_bin, micro_time, monotonic_counter, macro_time)
+                case AcquisitionMode.RAW_DATA:
+                    pass
+                case _:
+                    raise Exception("[PY-API] consumer_task: Invalid acquisition mode=" + self.acquisition_mode)
+        return len(messages)
+
+    def join(self, timeout: float = None):
+        # waits for the end of the acquisition (acquisition time reached or stopped) and
+        # returns its final stats
+        if self.acquisition_done is None:
+            return None
+        return self.acquisition_done.result(timeout)
+
+    def _join_threads(self):
+        for thread in (self.receiver_thread, self.consumer_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+
+    def _output_file(self):
+        prefix = "output_" if self.name is None else "output_" + self.name + "_"
+        return prefix + time.strftime("%Y%m%d-%H%M%S") + ".bin"
 
-    @staticmethod
-    def _kill_process_if_exists(process_name):
-        if process_name is None:
+    def _start_processor(self):
+        if not self._stale_processor_checked:
+            kill_stale_processor(pid_file(self.commands_endpoint), self.processor_executable)
+            self._stale_processor_checked = True
+        if self.processor_executable is None:
             return
-        processes = list(p.name() for p in psutil.process_iter())
-        if process_name in processes:
+        if self.processor is not None and self.processor.is_running():
+            print("[PY-API] Reusing running flim-processor")
+            return
+        print("[PY-API] Starting flim-processor")
+        self.processor = ProcessorProcess(self.processor_executable, self.processor_args,
+                                          pid_file(self.commands_endpoint))
+        self.processor.start()
+
+    def _stop_processor(self):
+        if self.processor is not None:
+            self.processor.kill()
+            self.processor = None
+
+    def _disarm_processor(self):
+        # asks a persistent session processor to stop streaming and wait for the next
+        # acquisition, processors that do not know the command are killed instead
+        if self.processor_executable is not None and (self.processor is None or not self.processor.is_running()):
+            return False
+        # the handshake takes at most two 500 ms negotiations once flim-processor answers
+        if not self._commands_lock.acquire(timeout=2):
+            print("[PY-API] flim-processor commands busy, killing it")
+            return False
+        try:
             try:
-                subprocess.Popen(["taskkill", "/F", "/T", "/IM", process_name])
-            except:
-                pass
+                self.z_commands.send_string("stop")
+            except zmq.ZMQError:
+                self._connect_commands_socket()
+                return False
+            if self.z_commands.poll(500) == 0:
+                print("[PY-API] flim-processor did not answer stop, killing it")
+                self._connect_commands_socket()
+                return False
+            self.z_commands.recv_string()
+            return True
+        finally:
+            self._commands_lock.release()
+
+    def _connect_data_socket(self):
+        if self.z_sub is not None:
+            self.z_sub.close(linger=0)
+        self.z_sub = zmq.Context.instance().socket(zmq.SUB)
+        # the buffers apply to the connections made after they are set
+        if self.receive_hwm is not None:
+            self.z_sub.setsockopt(zmq.RCVHWM, self.receive_hwm)
+        if self.receive_buffer is not None:
+            self.z_sub.setsockopt(zmq.RCVBUF, self.receive_buffer)
+        self.z_sub.connect(self.data_endpoint)
+        self.z_sub.setsockopt(zmq.SUBSCRIBE, b"")
+        self._receive_buffers_applied = (self.receive_hwm, self.receive_buffer)
+
+    def _connect_commands_socket(self):
+        if self.z_commands is not None:
+            self.z_commands.close(linger=0)
+        self.z_commands = zmq.Context.instance().socket(zmq.REQ)
+        self.z_commands.connect(self.commands_endpoint)
+
+    def _negotiate_filter(self):
+        # flim-processor builds that know this command apply the filter before publishing
+        # and answer "ok", any other answer or none leaves the filter to the API. Only sent
+        # with the binary wire format, which already requires a recent processor
+        if self._active_filter is None or self.pipeline is not None or self.wire_format != WireFormat.BINARY:
+            return
+        args = self._active_filter.processor_args()
+        if args is None:
+            return
+        self.z_commands.send_string("filter;" + args)
+        if self.z_commands.poll(500) == 0:
+            print("[PY-API] flim-processor did not answer filter, filtering events in the API")
+            self._connect_commands_socket()
+            return
+        if self.z_commands.recv_string() != "ok":
+            print("[PY-API] flim-processor does not filter events, filtering events in the API")
+            return
+        print("[PY-API] Event filter applied by flim-processor: " + args)
+        self._active_filter = self._active_filter.local_part()
 
-    def stop_acquisition(self):
+    def _negotiate_wire_format(self):
+        # older flim-processor builds do not know this command: they never answer,
+        # so wait a short time and fall back to the text format on a fresh socket
+        self.negotiated_wire_format = WireFormat.TEXT
+        if self.wire_format != WireFormat.BINARY:
+            return
+        self.z_commands.send_string("wire-format;" + WireFormat.BINARY)
+        if self.z_commands.poll(500) == 0:
+            print("[PY-API] flim-processor did not answer wire-format, using text format")
+            self._connect_commands_socket()
+            return
+        response = self.z_commands.recv_string()
+        if response == WireFormat.BINARY:
+            self.negotiated_wire_format = WireFormat.BINARY
+        print("[PY-API] Wire format: " + self.negotiated_wire_format)
+
+    # returns right away: the receiver is woken up through the control socket and the
+    # end of the acquisition is signaled by acquisition_done (see join). With drain the
+    # events already received are still delivered to the handlers before the end.
+    def stop_acquisition(self, drain: bool = False):
         print("[PY-API] Stopping acquisition")
-        self._kill_process_if_exists("flim-processor.exe")
-        self._kill_process_if_exists("flim-reader.exe")
+        self.drain_on_stop = drain
+        # a replay has no flim-processor of its own
+        if self.replay_file is None and not (self.persistent_session and self._disarm_processor()):
+            self._stop_processor()
         self.enable_receiver_lock.acquire()
         print("[PY-API] Disabling receiver thread")
         self.enable_receiver = False
@@ -155,15 +657,251 @@ class FlimLabsApi:
         print("[PY-API] Disabling consumer thread")
         self.enable_consumer = False
         self.enable_consumer_lock.release()
+        self._control_lock.acquire()
+        try:
+            self._z_control_push.send(b"stop", zmq.NOBLOCK)
+        except zmq.Again:
+            # a stop request is already pending
+            pass
+        finally:
+            self._control_lock.release()
+        if not drain:
+            if self.ring_buffer is not None:
+                self.ring_buffer.close()
+            if self.raw_queue is not None:
+                self.raw_queue.close()
+        for accumulator in self.accumulators:
+            if getattr(accumulator, 'close_on_stop', False):
+                self.detach_recorder(accumulator)
+        if self.pipeline is not None:
+            self.pipeline.stop()
         print("[PY-API] Acquisition stopped.")
 
     def set_firmware(self, firmware):    #firmawre per settare la frequenza a cui vogliamo fare acquisizione
         print("[PY-API] Setting firmware to " + firmware)
         self.firmware = firmware
 
+    # args are appended to the command line of the processor, e.g. to select the card and
+    # the endpoints of a second device
+    def set_processor_executable(self, executable, args: list[str] = None):
+        self.processor_executable = executable
+        self.processor_args = list(args or [])
+
+    # keeps flim-processor running between acquisitions: stop_acquisition only stops the
+    # streaming and the next acquisition repeats the handshake on the running process
+    def set_persistent_session(self, persistent: bool):
+        self.persistent_session = persistent
+
+    def close(self):
+        self.disable_autotuning()
+        self.stop_acquisition()
+        self._stop_processor()
+        # the sockets can only be closed once the threads using them are gone
+        self._join_threads()
+        self.z_sub.close(linger=0)
+        self._commands_lock.acquire()
+        try:
+            self.z_commands.close(linger=0)
+        finally:
+            self._commands_lock.release()
+        self.z_control.close(linger=0)
+        self._z_control_push.close(linger=0)
+
+    # chunks None keeps the total size of chunk_size x chunks bytes
+    def set_chunk_size(self, chunk_size: int, chunks: int = None):
+        if chunk_size <= 0:
+            raise Exception("Chunk size must be greater than 0")
+        if chunks is None:
+            chunks = -(-self.chunk_size * self.chunks // chunk_size)
+        if chunks <= 0:
+            raise Exception("Number of chunks must be greater than 0")
+        self.chunk_size = chunk_size
+        self.chunks = chunks
+
+    # applied to the data socket at the start of the next acquisition
+    def set_receive_buffers(self, hwm: int = None, buffer_bytes: int = None):
+        if hwm is not None and hwm < 0:
+            raise Exception("Receive high water mark must not be negative")
+        if buffer_bytes is not None and buffer_bytes <= 0:
+            raise Exception("Receive buffer must be greater than 0 bytes")
+        self.receive_hwm = hwm
+        self.receive_buffer = buffer_bytes
+
+    # tunes the consumer batch size while the acquisitions run and, when each one ends, the
+    # ring buffer, the receive buffers and the chunk size of the next one, see
+    # flim_labs_tuning.AcquisitionTuner
+    def enable_autotuning(self, max_latency_ms: float = None, interval_s: float = 0.25):
+        from flim_labs_tuning import AcquisitionTuner
+        self.disable_autotuning()
+        self.tuner = AcquisitionTuner(self, self.batch_max_latency_ms if max_latency_ms is None else max_latency_ms,
+                                      interval_s)
+        return self.tuner
+
+    def disable_autotuning(self):
+        if self.tuner is not None:
+            self.tuner.stop()
+            self.tuner = None
+
+    # keeps only the spectroscopy events matching all the criteria, from the next
+    # acquisition (or replay): channels, inclusive (low, high) ranges of micro_time (ns),
+    # time_bin and macro_time (ns) where None is unbounded, and one event every decimation.
+    # The events are dropped by flim-processor when it supports it, otherwise right after
+    # decoding, before the accumulators and the ring buffer, see flim_labs_filter.EventFilter
+    def set_event_filter(self, channels=None, micro_time=None, time_bin=None, macro_time=None, decimation: int = 1):
+        from flim_labs_filter import EventFilter
+        event_filter = EventFilter(channels, micro_time, time_bin, macro_time, decimation)
+        self.event_filter = None if event_filter.is_empty() else event_filter
+        return self.event_filter
+
+    def clear_event_filter(self):
+        self.event_filter = None
+
+    # only one of the consumer handler and the batch consumer handler is called, None clears it
     def set_consumer_handler(self, handler):
+        if handler is not None and self.batch_consumer_handler is not None:
+            raise Exception("A batch consumer handler is already set, clear it with set_batch_consumer_handler(None)")
         self.consumer_handler = handler
 
+    # the handler receives the buffered events as one array: a structured array with the
+    # channel, time_bin, micro_time, monotonic_counter and macro_time fields in
+    # spectroscopy mode, a (bins x channels) array in photons tracing mode and a 1-D
+    # array of frequencies in measure frequency mode
+    def set_batch_consumer_handler(self, handler, max_batch: int = 4096, max_latency_ms: float = 50):
+        if max_batch <= 0:
+            raise Exception("Maximum batch size must be greater than 0")
+        if max_latency_ms < 0:
+            raise Exception("Maximum batch latency must not be negative")
+        if handler is not None and self.consumer_handler is not None:
+            raise Exception("A consumer handler is already set, clear it with set_consumer_handler(None)")
+        self.batch_max_size = max_batch
+        self.batch_max_latency_ms = max_latency_ms
+        self.batch_consumer_handler = handler
+
+    def add_accumulator(self, accumulator):
+        if accumulator not in self.accumulators:
+            self.accumulators = self.accumulators + [accumulator]
+        return accumulator
+
+    def remove_accumulator(self, accumulator):
+        self.accumulators = [a for a in self.accumulators if a is not accumulator]
+
+    # the recorder writes compressed column chunks of the acquisition in background and is
+    # closed, without waiting for the pending chunks, when the acquisition stops
+    def attach_recorder(self, path, acquisition_mode: str, chunk_records: int = 65536, compression_level: int = 1):
+        from flim_labs_recorder import StreamRecorder
+        return self.add_accumulator(StreamRecorder(path, acquisition_mode, chunk_records, compression_level))
+
+    def detach_recorder(self, recorder, wait: bool = False):
+        self.remove_accumulator(recorder)
+        recorder.close(wait)
+
+    def enable_decay_histogram(self, channels: int = 16, bins: int = 256, window_ms: float = None):
+        from flim_labs_histogram import DecayHistogram
+        return self.add_accumulator(DecayHistogram(channels, bins, window_ms))
+
+    def enable_phasor(self, laser_frequency_mhz: int, harmonic: int = 1, channels: int = 16, window_ms: float = None):
+        from flim_labs_phasor import PhasorEngine
+        return self.add_accumulator(PhasorEngine(laser_frequency_mhz, harmonic, channels, window_ms))
+
+    # decode and reduce the received data in worker processes instead of this process:
+    # the handlers and accumulators are not called, the results (decay histograms, photons
+    # tracing sums) are read from the returned pipeline
+    def enable_pipeline(self, workers: int = None, channels: int = 16, bins: int = 256):
+        self.disable_pipeline()
+        from flim_labs_pipeline import PhotonPipeline
+        self.pipeline = PhotonPipeline(workers, channels, bins)
+        return self.pipeline
+
+    def disable_pipeline(self):
+        if self.pipeline is not None:
+            self.pipeline.close()
+            self.pipeline = None
+
+    def _start_pipeline(self):
+        match self.acquisition_mode:
+            case AcquisitionMode.SPECTROSCOPY:
+                self.pipeline.start(self.acquisition_mode, macro_time_limit=self.acquisition_time_seconds * 1_000_000_000,
+                                    event_filter=self._active_filter)
+            case AcquisitionMode.PHOTONS_TRACING:
+                # every time_bin is 100 microseconds seconds
+                self.pipeline.start(self.acquisition_mode, record_limit=int(self.acquisition_time_seconds * 10_000))
+            case _:
+                self.pipeline.start(self.acquisition_mode)
+
+    def stats(self):
+        return self.metrics.snapshot(self.ring_buffer_stats())
+
+    # appends api.stats() as a JSON line to path every interval_s seconds
+    def export_stats(self, path, interval_s: float = 1.0):
+        self.stop_stats_export()
+        self.metrics_exporter = MetricsExporter(path, self.stats, interval_s)
+
+    def stop_stats_export(self):
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+            self.metrics_exporter = None
+
+    def enable_trace_view(self, capacity: int = 16384, levels: int = 8, factor: int = 4):
+        from flim_labs_trace import TraceViewBuffer
+        return self.add_accumulator(TraceViewBuffer(capacity, levels, factor))
+
+    def enable_trace_store(self, chunk_bins: int = 100_000, max_bins: int = None):
+        from flim_labs_trace import TraceStore
+        return self.add_accumulator(TraceStore(chunk_bins, max_bins))
+
+    def enable_photon_correlator(self, levels: int = 16, points: int = 16, window_seconds: float = None):
+        from flim_labs_correlation import PhotonCorrelator
+        return self.add_accumulator(PhotonCorrelator(levels, points, window_seconds))
+
+    def set_ring_buffer(self, capacity: int, overflow_policy: str = OverflowPolicy.BLOCK):
+        if capacity <= 0:
+            raise Exception("Ring buffer capacity must be greater than 0")
+        if overflow_policy not in (OverflowPolicy.BLOCK, OverflowPolicy.DROP_OLDEST, OverflowPolicy.DROP_NEWEST):
+            raise Exception("Invalid ring buffer overflow policy=" + str(overflow_policy))
+        self.ring_buffer_capacity = capacity
+        self.ring_buffer_overflow_policy = overflow_policy
+
+    def ring_buffer_stats(self):
+        if self.raw_queue is not None:
+            return self.raw_queue.stats()
+        if self.ring_buffer is None:
+            return None
+        return self.ring_buffer.stats()
+
+    def _create_ring_buffer(self):
+        match self.acquisition_mode:
+            case AcquisitionMode.PHOTONS_TRACING:
+                dtype = np.dtype((PHOTONS_TRACING_DTYPE, (len(self.photons_tracing_channels),)))
+            case AcquisitionMode.SPECTROSCOPY:
+                dtype = SPECTROSCOPY_DTYPE
+            case AcquisitionMode.MEASURE_FREQUENCY:
+                dtype = MEASURE_FREQUENCY_DTYPE
+            case _:
+                return None
+        return RingBuffer(dtype, self.ring_buffer_capacity, self.ring_buffer_overflow_policy)
+
+    def set_wire_format(self, wire_format):
+        if wire_format != WireFormat.TEXT and wire_format != WireFormat.BINARY:
+            raise Exception("Wire format must be " + WireFormat.TEXT + " or " + WireFormat.BINARY)
+        self.wire_format = wire_format
+
+    # raw data frames are passed to the consumer handler as memoryview and to the batch
+    # consumer handler as uint8 NumPy arrays, both over the received ZMQ buffers, and
+    # optionally appended to path with gathered writes
+    def set_raw_data_file(self, path, preallocate: bool = True):
+        self.raw_data_file = path
+        self.raw_data_preallocate = preallocate
+
+    def set_raw_queue(self, max_frames: int):
+        if max_frames <= 0:
+            raise Exception("Raw frame queue size must be greater than 0")
+        self.raw_queue_frames = max_frames
+
+    def _open_raw_data(self, total_bytes):
+        self.raw_queue = RawFrameQueue(self.raw_queue_frames, total_bytes)
+        if self.raw_data_file is not None:
+            self.raw_data_writer = RawDataWriter(self.raw_data_file, total_bytes if self.raw_data_preallocate else 0)
+
     def acquire_raw_data(self, chunk_size: int, chunks: int):
         self.acquisition_mode = AcquisitionMode.RAW_DATA
         self._acquire_from_reader(chunk_size, chunks)
@@ -174,29 +912,15 @@ class FlimLabsApi:
         self._acquire_from_reader(32, 1)
 
     def acquire_photons_tracing(self, channels: list[int], acquisition_time_seconds: int = 300):  #channels: canali su fpga abilitati per fare photon tracing
-        if channels is None:
-            raise Exception("Channel list is None")
-        if len(channels) > 12:
-            raise Exception("Maximum number of channels is 12")
-        for channel in channels:
-            if channel < 1 or channel > 12:
-                raise Exception("Channel number must be between 1 and 12")
-        if len(channels) == 0:
-            raise Exception("Channel list is empty")
-        if len(channels) != len(set(channels)):
-            raise Exception("Channel list contains duplicated")
+        channels_str = photons_tracing_args(channels)
 
         self.acquisition_mode = AcquisitionMode.PHOTONS_TRACING
         self.photons_tracing_bin_count = 0
+        self.photons_tracing_channels = list(channels)
         self.acquisition_time_seconds = acquisition_time_seconds
 
-        channels_str = ""
-        for channel in channels:
-            channels_str += str(channel) + ","
-        channels_str = channels_str[:-1]
-
         #self._acquire_from_reader(100 * MB, 10, channels_str)
-        self._acquire_from_reader(1024, 800*1024, channels_str) #avvia questo metodo privato che va a inviare comando al processor
+        self._acquire_from_reader(self.chunk_size, self.chunks, channels_str) #avvia questo metodo privato che va a inviare comando al processor
 
 
     # def acquire_raw_data(self, firmware: str, output_file: str, chunk_size: int, chunks: int):
@@ -207,48 +931,93 @@ class FlimLabsApi:
     def acquire_spectroscopy(self, laser_frequency_mhz: int, acquisition_time_seconds: int):
         self.acquisition_mode = AcquisitionMode.SPECTROSCOPY
 
-        if laser_frequency_mhz != 40 and laser_frequency_mhz != 80:
-            raise Exception("Laser frequency must be 40 or 80 MHz")
-
-        if acquisition_time_seconds <= 0:
-            raise Exception("Acquisition time must be greater than 0 seconds")
+        additional_args = spectroscopy_args(laser_frequency_mhz, acquisition_time_seconds)
 
         self.acquisition_time_seconds = acquisition_time_seconds
 
-        self._acquire_from_reader(1024, 800*1024, str(laser_frequency_mhz))
+        self._acquire_from_reader(self.chunk_size, self.chunks, additional_args)
         
     
+    # replays a spectroscopy output file (output_*.bin, see flim_labs_io) through the ring
+    # buffer, accumulators and consumer handlers of a live acquisition. speed is the ratio
+    # to real time by macro_time (1 real time, 10 ten times faster), None replays the file
+    # as fast as the consumer takes the events. Without acquisition_time_seconds the whole
+    # file is replayed. Returns right away, see join.
+    def replay_spectroscopy(self, path, laser_frequency_mhz: int, speed: float = 1.0,
+                            acquisition_time_seconds: float = None, chunk_events: int = 65536):
+        spectroscopy_args(laser_frequency_mhz, 1 if acquisition_time_seconds is None else acquisition_time_seconds)
+        if speed is not None and speed <= 0:
+            raise Exception("Replay speed must be greater than 0")
+        if chunk_events <= 0:
+            raise Exception("Chunk size must be greater than 0")
+        if self.pipeline is not None:
+            raise Exception("Files can not be replayed through the pipeline")
+        print("[PY-API] Replaying " + str(path))
+        self._join_threads()
+        self.acquisition_mode = AcquisitionMode.SPECTROSCOPY
+        self.acquisition_time_seconds = np.inf if acquisition_time_seconds is None else acquisition_time_seconds
+        from flim_labs_io import SpectroscopyFile
+        self.replay_file = SpectroscopyFile(path)
+        self._start_threads(lambda: self.replay_task(laser_frequency_mhz, speed, chunk_events))
+        self.metrics.acquisition_started()
+
+    def _start_threads(self, receiver_target, raw_data_bytes: int = 0):
+        # the threads of the previous acquisition must not share the sockets with the new ones
+        self._join_threads()
+        if self._receive_buffers_applied != (self.receive_hwm, self.receive_buffer):
+            self._connect_data_socket()
+        self.enable_receiver_lock.acquire()
+        print("[PY-API] Enabling receiver thread")
+        self.enable_receiver = True
+        self.enable_receiver_lock.release()
+        self.enable_consumer_lock.acquire()
+        print("[PY-API] Enabling consumer thread")
+        self.enable_consumer = True
+        self.enable_consumer_lock.release()
+        self.acquisition_done = Future()
+        self.drain_on_stop = False
+        self.ring_buffer = self._create_ring_buffer()
+        self.raw_queue = None
+        if self.acquisition_mode == AcquisitionMode.RAW_DATA:
+            self._open_raw_data(raw_data_bytes)
+        self._accumulated_bins = 0
+        self._active_filter = None
+        if self.event_filter is not None and self.acquisition_mode == AcquisitionMode.SPECTROSCOPY:
+            self.event_filter.reset()
+            self._active_filter = self.event_filter
+        self.metrics.reset()
+        if self.pipeline is not None:
+            self._start_pipeline()
+        self.receiver_thread = threading.Thread(target=receiver_target)
+        self.consumer_thread = threading.Thread(target=self.consumer_task)
+        self.receiver_thread.start()
+        self.consumer_thread.start()
+
     def _acquire_from_reader(self, chunk_size: int, chunks: int, additional_args: str = None):  #chunk size: grandezza chunk. quanti chunk puoi scaricare. additional args: parametri in più passati a flim procesor
         try:
-            output_file = "output_" + time.strftime("%Y%m%d-%H%M%S") + ".bin"
-            self.enable_receiver_lock.acquire()
-            print("[PY-API] Enabling receiver thread")
-            self.enable_receiver = True
-            self.enable_receiver_lock.release()
-            self.enable_consumer_lock.acquire()
-            print("[PY-API] Enabling consumer thread")
-            self.enable_consumer = True
-            self.enable_consumer_lock.release()
-            self.receiver_thread = threading.Thread(target=self.receiver_task)
-            self.consumer_thread = threading.Thread(target=self.consumer_task)
-            self.receiver_thread.start()
-            self.consumer_thread.start()
-            self.queue = Queue()
-            print("[PY-API] Starting flim-processor")
-            subprocess.Popen(["flim-processor.exe"])
-            print("[PY-API] Sending command to flim-processor")
-            self.z_commands.send_string(self.acquisition_mode)
-            args_response = self.z_commands.recv_string()
-            if args_response != "args":
-                raise Exception("Unexpected response from flim-processor")
-            print("[PY-API] Sending command args to flim-processor")
-            commands = self.firmware + ";" + output_file + ";" + str(chunk_size) + ";" + str(chunks)
-            if additional_args is not None:
-                commands += ";" + additional_args
-            self.z_commands.send_string(commands)
-            print("[PY-API] Command args sent, commands=" + commands)
-            ok = self.z_commands.recv_string()
-            print("[PY-API] Response from flim-processor: " + ok)
+            output_file = self._output_file()
+            self.replay_file = None
+            self._start_threads(self.receiver_task, chunk_size * chunks)
+            self._start_processor()
+            # a stop from the consumer or the receiver waits for the end of the handshake
+            self._commands_lock.acquire()
+            try:
+                print("[PY-API] Sending command to flim-processor")
+                self.z_commands.send_string(self.acquisition_mode)
+                args_response = self.z_commands.recv_string()
+                if args_response != "args":
+                    raise Exception("Unexpected response from flim-processor")
+                print("[PY-API] Sending command args to flim-processor")
+                commands = processor_commands(self.firmware, output_file, chunk_size, chunks, additional_args)
+                self.z_commands.send_string(commands)
+                print("[PY-API] Command args sent, commands=" + commands)
+                ok = self.z_commands.recv_string()
+                print("[PY-API] Response from flim-processor: " + ok)
+                self.metrics.acquisition_started()
+                self._negotiate_filter()
+                self._negotiate_wire_format()
+            finally:
+                self._commands_lock.release()
         except Exception as e:
             print("[PY-API] Error: " + str(e))
             # print stacktrace
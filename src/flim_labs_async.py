@@ -0,0 +1,211 @@
+import asyncio
+import time
+
+import numpy as np
+import zmq
+import zmq.asyncio
+
+from flim_labs_api import AcquisitionMode, photons_tracing_args, spectroscopy_args, processor_commands
+from flim_labs_session import ProcessorProcess, kill_stale_processor, pid_file, DATA_ENDPOINT, COMMANDS_ENDPOINT
+from flim_labs_wire import WireFormat, is_binary_frame, decode_binary_frame, decode_text_message, events_to_array
+
+
+class AsyncFlimLabsApi:
+    # asyncio client: no receiver/consumer threads, the data socket is awaited directly
+    # by the caller's task, so cancelling the task stops the acquisition immediately.
+    def __init__(self, data_endpoint: str = DATA_ENDPOINT, commands_endpoint: str = COMMANDS_ENDPOINT):
+        self.data_endpoint = data_endpoint
+        self.commands_endpoint = commands_endpoint
+        # the processor left by a crashed session is killed by the first acquisition, off the event loop
+        self._stale_processor_checked = False
+
+        self.context = zmq.asyncio.Context.instance()
+        self.processor_executable = "flim-processor.exe"
+        self.processor_args = []
+        self.processor = None
+        self.firmware = None
+        # opt-in, as for FlimLabsApi
+        self.wire_format = WireFormat.TEXT
+        self.negotiated_wire_format = WireFormat.TEXT
+        self.acquisition_mode = AcquisitionMode.UNSET
+        self.z_sub = None
+        self.z_commands = None
+
+    def set_firmware(self, firmware):
+        print("[PY-API] Setting firmware to " + firmware)
+        self.firmware = firmware
+
+    # same as FlimLabsApi.set_processor_executable: None expects an already running processor
+    def set_processor_executable(self, executable, args: list[str] = None):
+        self.processor_executable = executable
+        self.processor_args = list(args or [])
+
+    def set_wire_format(self, wire_format):
+        if wire_format != WireFormat.TEXT and wire_format != WireFormat.BINARY:
+            raise Exception("Wire format must be " + WireFormat.TEXT + " or " + WireFormat.BINARY)
+        self.wire_format = wire_format
+
+    async def stream_spectroscopy(self, laser_frequency_mhz: int, acquisition_time_seconds: int,
+                                  max_batch: int = 4096, max_latency_ms: float = 50):
+        additional_args = spectroscopy_args(laser_frequency_mhz, acquisition_time_seconds)
+        limit = acquisition_time_seconds * 1_000_000_000
+        await self._start(AcquisitionMode.SPECTROSCOPY, 1024, 800 * 1024, additional_args)
+        try:
+            async for batch in self._batches(max_batch, max_latency_ms):
+                over = (batch['macro_time'] > limit).nonzero()[0]
+                if len(over) > 0:
+                    if over[0] > 0:
+                        yield batch[:over[0]]
+                    print("[PY-API] Acquisition time reached. Stopping acquisition.")
+                    return
+                yield batch
+        finally:
+            await self.stop_acquisition()
+
+    async def stream_photons_tracing(self, channels: list[int], acquisition_time_seconds: int = 300,
+                                     max_batch: int = 4096, max_latency_ms: float = 50):
+        channels_str = photons_tracing_args(channels)
+        # every time_bin is 100 microseconds seconds
+        remaining_bins = int(acquisition_time_seconds * 10_000)
+        await self._start(AcquisitionMode.PHOTONS_TRACING, 1024, 800 * 1024, channels_str)
+        try:
+            async for batch in self._batches(max_batch, max_latency_ms):
+                if len(batch) >= remaining_bins:
+                    if remaining_bins > 0:
+                        yield batch[:remaining_bins]
+                    print("[PY-API] Acquisition time reached. Stopping acquisition.")
+                    return
+                remaining_bins -= len(batch)
+                yield batch
+        finally:
+            await self.stop_acquisition()
+
+    async def measure_frequency(self):
+        await self._start(AcquisitionMode.MEASURE_FREQUENCY, 32, 1)
+        try:
+            async for batch in self._batches(1, 0):
+                return float(batch[0])
+        finally:
+            await self.stop_acquisition()
+
+    async def stop_acquisition(self):
+        print("[PY-API] Stopping acquisition")
+        await self._kill_processor()
+        if self.z_sub is not None:
+            self.z_sub.close(linger=0)
+            self.z_sub = None
+        if self.z_commands is not None:
+            self.z_commands.close(linger=0)
+            self.z_commands = None
+        self.acquisition_mode = AcquisitionMode.UNSET
+        print("[PY-API] Acquisition stopped.")
+
+    async def aclose(self):
+        # the context is shared with the other asyncio sockets of the process
+        if self.acquisition_mode != AcquisitionMode.UNSET:
+            await self.stop_acquisition()
+        await self._kill_processor()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _kill_processor(self):
+        # killing the process tree waits for it to exit, up to seconds: not on the event loop
+        processor = self.processor
+        self.processor = None
+        if processor is not None:
+            await asyncio.to_thread(processor.kill)
+
+    async def _start(self, acquisition_mode, chunk_size: int, chunks: int, additional_args: str = None):
+        if self.acquisition_mode != AcquisitionMode.UNSET:
+            raise Exception("An acquisition is already running")
+        self.acquisition_mode = acquisition_mode
+        try:
+            if not self._stale_processor_checked:
+                await asyncio.to_thread(kill_stale_processor, pid_file(self.commands_endpoint),
+                                        self.processor_executable)
+                self._stale_processor_checked = True
+            self.z_sub = self.context.socket(zmq.SUB)
+            self.z_sub.connect(self.data_endpoint)
+            self.z_sub.setsockopt(zmq.SUBSCRIBE, b"")
+            self._connect_commands_socket()
+
+            output_file = "output_" + time.strftime("%Y%m%d-%H%M%S") + ".bin"
+            if self.processor_executable is not None:
+                print("[PY-API] Starting flim-processor")
+                self.processor = ProcessorProcess(self.processor_executable, self.processor_args,
+                                                  pid_file(self.commands_endpoint))
+                self.processor.start()
+            print("[PY-API] Sending command to flim-processor")
+            await self.z_commands.send_string(acquisition_mode)
+            if await self.z_commands.recv_string() != "args":
+                raise Exception("Unexpected response from flim-processor")
+            commands = processor_commands(self.firmware, output_file, chunk_size, chunks, additional_args)
+            await self.z_commands.send_string(commands)
+            print("[PY-API] Command args sent, commands=" + commands)
+            ok = await self.z_commands.recv_string()
+            print("[PY-API] Response from flim-processor: " + ok)
+            await self._negotiate_wire_format()
+        except BaseException:
+            await self.stop_acquisition()
+            raise
+
+    def _connect_commands_socket(self):
+        if self.z_commands is not None:
+            self.z_commands.close(linger=0)
+        self.z_commands = self.context.socket(zmq.REQ)
+        self.z_commands.connect(self.commands_endpoint)
+
+    async def _negotiate_wire_format(self):
+        # same negotiation as FlimLabsApi: no answer means an older text-only processor
+        self.negotiated_wire_format = WireFormat.TEXT
+        if self.wire_format != WireFormat.BINARY:
+            return
+        await self.z_commands.send_string("wire-format;" + WireFormat.BINARY)
+        if await self.z_commands.poll(500) == 0:
+            print("[PY-API] flim-processor did not answer wire-format, using text format")
+            self._connect_commands_socket()
+            return
+        if await self.z_commands.recv_string() == WireFormat.BINARY:
+            self.negotiated_wire_format = WireFormat.BINARY
+        print("[PY-API] Wire format: " + self.negotiated_wire_format)
+
+    async def _batches(self, max_batch, max_latency_ms):
+        # waits without timeout for the first event of a batch, then collects events
+        # until max_batch or max_latency_ms after the first one
+        loop = asyncio.get_running_loop()
+        while True:
+            blocks = []
+            events = []
+            size = 0
+            deadline = None
+            while size < max_batch:
+                if deadline is not None:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0 or await self.z_sub.poll(remaining * 1000) == 0:
+                        break
+                message = await self.z_sub.recv()
+                if is_binary_frame(message):
+                    if events:
+                        blocks.append(events_to_array(self.acquisition_mode, events))
+                        events = []
+                    block = decode_binary_frame(message)
+                    blocks.append(block)
+                    size += len(block)
+                else:
+                    event = decode_text_message(self.acquisition_mode, message)
+                    if event is None:
+                        continue
+                    events.append(event)
+                    size += 1
+                if deadline is None:
+                    deadline = loop.time() + max_latency_ms / 1000
+            if events:
+                blocks.append(events_to_array(self.acquisition_mode, events))
+            batch = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+            for start in range(0, len(batch), max_batch):
+                yield batch[start:start + max_batch]
+
@@ -0,0 +1,206 @@
+import threading
+
+import numpy as np
+
+from flim_labs_trace import BIN_SECONDS
+
+
+class PhotonCorrelator:
+    # Live photon statistics of a photons tracing acquisition, without keeping the trace.
+    # Multi-tau correlator: level 0 correlates the 100 microseconds bins at lags 1 to
+    # points - 1, every following level correlates the sums of pairs of entries of the
+    # previous one at lags points / 2 to points - 1, so levels cover lags up to
+    # points * 2^(levels - 1) bins with a cost per bin that halves at every level.
+    # Every level keeps the channel x channel sums of products for each lag, so auto and
+    # cross-correlations (g2, symmetric normalization) of all the channels are available
+    # at any time. Count rates and Fano factors are kept for the whole acquisition and,
+    # with window_seconds, for its last window_seconds in window_slices slices.
+    acquisition_mode = 'photons-tracing'
+
+    def __init__(self, levels: int = 16, points: int = 16, window_seconds: float = None, window_slices: int = 10):
+        if levels <= 0:
+            raise Exception("Number of levels must be greater than 0")
+        if points < 4 or points % 2 != 0:
+            raise Exception("Points per level must be an even number of at least 4")
+        if window_seconds is not None and window_seconds <= 0:
+            raise Exception("Statistics window must be greater than 0 seconds")
+        if window_slices <= 0:
+            raise Exception("Number of window slices must be greater than 0")
+        self.levels = levels
+        self.points = points
+        self.window_seconds = window_seconds
+        self.window_slices = window_slices
+        self.channels = None
+        self.bins = 0
+        self._lock = threading.Lock()
+        self._slice_bins = None if window_seconds is None else max(int(round(window_seconds / BIN_SECONDS / window_slices)), 1)
+        self._current_slice = None
+
+    def feed(self, batch):
+        self._lock.acquire()
+        try:
+            if self.channels != batch.shape[1]:
+                self._allocate(batch.shape[1])
+            values = batch.astype(np.float64)
+            self._feed_statistics(values)
+            self.bins += len(values)
+            for level in range(self.levels):
+                self._correlate(level, values)
+                if level + 1 == self.levels:
+                    break
+                values = self._coarsen(level, values)
+                if len(values) == 0:
+                    break
+        finally:
+            self._lock.release()
+
+    def lags(self):
+        # lag in seconds of every point of the correlation curves
+        lags = [np.arange(1, self.points)]
+        for level in range(1, self.levels):
+            lags.append(np.arange(self.points // 2, self.points) * 2 ** level)
+        return np.concatenate(lags) * BIN_SECONDS
+
+    def correlation(self, channel_a: int = None, channel_b: int = None):
+        # g2 at every lag, (channels x channels x lags) or the curve of channel_a delayed
+        # against channel_b, NaN at the lags not reached yet
+        self._lock.acquire()
+        try:
+            if self.channels is None:
+                return np.full(len(self.lags()), np.nan) if channel_a is not None else np.zeros((0, 0, 0))
+            curves = []
+            for level in range(self.levels):
+                first = 1 if level == 0 else self.points // 2
+                curves.append(self._g2(level, first))
+        finally:
+            self._lock.release()
+        g2 = np.concatenate(curves, axis=2)
+        if channel_a is None:
+            return g2
+        return g2[channel_a, channel_a if channel_b is None else channel_b]
+
+    def counts(self, window: bool = False):
+        return self._moments(window)[1].astype(np.int64)
+
+    def count_rates(self, window: bool = False):
+        # photons/s of every channel
+        bins, total, _ = self._moments(window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return total / (bins * BIN_SECONDS)
+
+    def fano_factors(self, window: bool = False):
+        # variance / mean of the counts of every channel per 100 microseconds bin, 1 for
+        # Poisson light
+        bins, total, squares = self._moments(window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = total / bins
+            return (squares / bins - mean * mean) / mean
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            if self.channels is not None:
+                self._allocate(self.channels)
+        finally:
+            self._lock.release()
+
+    def _allocate(self, channels):
+        self.channels = channels
+        self.bins = 0
+        # per level: entries seen, sum of the entries, first and last points - 1 entries
+        # (zero padded until seen), sums of products (channel x channel x lag)
+        self._seen = [0] * self.levels
+        self._sums = np.zeros((self.levels, channels))
+        self._heads = np.zeros((self.levels, self.points - 1, channels))
+        self._histories = np.zeros((self.levels, self.points - 1, channels))
+        self._products = np.zeros((self.levels, channels, channels, self.points))
+        self._carry = [None] * self.levels
+        # rows: bins, sum of counts, sum of squared counts
+        self._moments_total = np.zeros((3, channels))
+        self._slices = None if self._slice_bins is None else np.zeros((self.window_slices, 3, channels))
+        self._window = None if self._slice_bins is None else np.zeros((3, channels))
+        self._current_slice = None
+
+    def _correlate(self, level, values):
+        history = self._histories[level]
+        seen = self._seen[level]
+        combined = np.concatenate((history, values))
+        # delayed[t, c, w] = combined[t + w, c], lag points - 1 - w of entry t
+        delayed = np.lib.stride_tricks.sliding_window_view(combined, self.points, axis=0)
+        products = values.T @ delayed.reshape(len(values), -1)
+        self._products[level] += products.reshape(self.channels, self.channels, self.points)[:, :, ::-1]
+        if seen < self.points - 1:
+            head = min(self.points - 1 - seen, len(values))
+            self._heads[level, seen:seen + head] = values[:head]
+        self._sums[level] += values.sum(axis=0)
+        self._histories[level] = combined[-(self.points - 1):]
+        self._seen[level] = seen + len(values)
+
+    def _coarsen(self, level, values):
+        if self._carry[level] is not None:
+            values = np.concatenate((self._carry[level], values))
+        pairs = len(values) // 2
+        self._carry[level] = values[2 * pairs:] if len(values) % 2 else None
+        return values[0:2 * pairs:2] + values[1:2 * pairs:2]
+
+    def _g2(self, level, first):
+        lags = np.arange(first, self.points)
+        seen = self._seen[level]
+        pairs = np.maximum(seen - lags, 0).astype(np.float64)
+        # entries of the delayed channel, the first seen - lag, and of the direct channel,
+        # the last seen - lag
+        tails = np.cumsum(self._histories[level][::-1], axis=0)
+        heads = np.cumsum(self._heads[level], axis=0)
+        delayed = self._sums[level] - tails[lags - 1]
+        direct = self._sums[level] - heads[lags - 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            g2 = self._products[level][:, :, lags] * pairs / (direct.T[:, None, :] * delayed.T[None, :, :])
+        g2[:, :, pairs == 0] = np.nan
+        return g2
+
+    def _feed_statistics(self, values):
+        if self._slices is None:
+            self._add_moments(self._moments_total, values)
+            return
+        slice_index = (self.bins + np.arange(len(values))) // self._slice_bins
+        for index in np.unique(slice_index):
+            in_slice = values[slice_index == index]
+            self._advance_window(int(index))
+            partial = np.zeros((3, self.channels))
+            self._add_moments(partial, in_slice)
+            self._slices[index % self.window_slices] += partial
+            self._window += partial
+            self._moments_total += partial
+
+    def _add_moments(self, moments, values):
+        moments[0] += len(values)
+        moments[1] += values.sum(axis=0)
+        moments[2] += (values * values).sum(axis=0)
+
+    def _advance_window(self, index):
+        if self._current_slice is None:
+            self._current_slice = index
+            return
+        if index <= self._current_slice:
+            return
+        if index - self._current_slice >= self.window_slices:
+            self._slices[:] = 0
+            self._window[:] = 0
+        else:
+            for expired in range(self._current_slice + 1, index + 1):
+                slot = expired % self.window_slices
+                self._window -= self._slices[slot]
+                self._slices[slot] = 0
+        self._current_slice = index
+
+    def _moments(self, window):
+        if window and self._slice_bins is None:
+            raise Exception("Statistics window is not enabled")
+        self._lock.acquire()
+        try:
+            if self.channels is None:
+                return np.zeros(0), np.zeros(0), np.zeros(0)
+            bins, total, squares = (self._window if window else self._moments_total).copy()
+        finally:
+            self._lock.release()
+        return bins, total, squares
@@ -0,0 +1,185 @@
+import threading
+
+import numpy as np
+
+from flim_labs_api import AcquisitionMode
+from flim_labs_wire import SPECTROSCOPY_DTYPE, PHOTONS_TRACING_DTYPE
+
+# merged spectroscopy events: the fields of SPECTROSCOPY_DTYPE and the index of the device
+MERGED_SPECTROSCOPY_DTYPE = np.dtype(SPECTROSCOPY_DTYPE.descr + [('device', '<u1')])
+
+
+class DeviceFanIn:
+    # Acquires from several devices at once, one FlimLabsApi session (endpoints, receiver
+    # and consumer threads) per device.
+    # With merge the batches of all the devices are passed to handler(batch) by a merge
+    # thread: spectroscopy events in macro_time order with a device field, photons tracing
+    # bins side by side (the channels of device 0, then those of device 1, ...). The
+    # macro_time of every device counts from the start of its own acquisition, events are
+    # only merged once every device running has received a later one.
+    # Without merge handler(device, batch) is called by the consumer thread of each device.
+    def __init__(self, apis, handler, merge: bool = True, max_batch: int = 4096, max_latency_ms: float = 50):
+        if len(apis) == 0:
+            raise Exception("Device list is empty")
+        if len(apis) > 256:
+            raise Exception("Maximum number of devices is 256")
+        self.apis = list(apis)
+        self.handler = handler
+        self.merge = merge
+        self.max_batch = max_batch
+        self.acquisition_mode = AcquisitionMode.UNSET
+        self.events_merged = 0
+        self.merge_thread = None
+        self._condition = threading.Condition()
+        self._pending = [[] for _ in self.apis]
+        self._received = [0] * len(self.apis)
+        self._merged_bins = 0
+        self._watermarks = [-np.inf] * len(self.apis)
+        self._finished = [False] * len(self.apis)
+        self._closed = False
+        for device, api in enumerate(self.apis):
+            if merge:
+                receive = lambda batch, device=device: self._receive(device, batch)
+            else:
+                receive = lambda batch, device=device: handler(device, batch)
+            api.set_batch_consumer_handler(receive, max_batch, max_latency_ms)
+
+    def acquire_spectroscopy(self, laser_frequency_mhz: int, acquisition_time_seconds: int):
+        self._start(AcquisitionMode.SPECTROSCOPY,
+                    lambda api: api.acquire_spectroscopy(laser_frequency_mhz, acquisition_time_seconds))
+
+    def acquire_photons_tracing(self, channels: list[int], acquisition_time_seconds: int = 300):
+        self._start(AcquisitionMode.PHOTONS_TRACING,
+                    lambda api: api.acquire_photons_tracing(channels, acquisition_time_seconds))
+
+    def stop_acquisition(self, drain: bool = False):
+        for api in self.apis:
+            api.stop_acquisition(drain)
+
+    def join(self, timeout: float = None):
+        # waits for the end of the acquisition of every device and for the last merged
+        # batch, returns the final stats of every device
+        stats = [api.join(timeout) for api in self.apis]
+        if self.merge_thread is not None:
+            self.merge_thread.join(timeout)
+        return stats
+
+    def stats(self):
+        with self._condition:
+            pending = sum(sum(len(batch) for batch in batches) for batches in self._pending)
+        return {
+            'devices': [api.stats() for api in self.apis],
+            'events_merged': self.events_merged,
+            'events_pending': pending,
+        }
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        for api in self.apis:
+            api.close()
+        if self.merge_thread is not None:
+            self.merge_thread.join()
+
+    def _start(self, acquisition_mode, acquire):
+        if self.merge_thread is not None and self.merge_thread.is_alive():
+            raise Exception("An acquisition is already running")
+        self.acquisition_mode = acquisition_mode
+        self.events_merged = 0
+        self._pending = [[] for _ in self.apis]
+        self._received = [0] * len(self.apis)
+        self._merged_bins = 0
+        self._watermarks = [-np.inf] * len(self.apis)
+        self._finished = [False] * len(self.apis)
+        if self.merge:
+            self.merge_thread = threading.Thread(target=self.merge_task)
+            self.merge_thread.start()
+        for device, api in enumerate(self.apis):
+            acquire(api)
+            if api.acquisition_done is not None:
+                api.acquisition_done.add_done_callback(lambda _, device=device: self._device_finished(device))
+
+    def _receive(self, device, batch):
+        with self._condition:
+            self._pending[device].append(batch)
+            self._received[device] += len(batch)
+            if self.acquisition_mode == AcquisitionMode.SPECTROSCOPY:
+                self._watermarks[device] = batch['macro_time'][-1]
+            self._condition.notify()
+
+    def _device_finished(self, device):
+        with self._condition:
+            self._finished[device] = True
+            self._condition.notify()
+
+    def merge_task(self):
+        while True:
+            with self._condition:
+                merged = self._take_mergeable()
+                done = all(self._finished) and not any(self._pending)
+                while merged is None and not done and not self._closed:
+                    self._condition.wait()
+                    merged = self._take_mergeable()
+                    done = all(self._finished) and not any(self._pending)
+                if merged is None and (done or self._closed):
+                    break
+            try:
+                for first in range(0, len(merged), self.max_batch):
+                    self.handler(merged[first:first + self.max_batch])
+                self.events_merged += len(merged)
+            except Exception as e:
+                print("[PY-API] Merge handler error: " + str(e))
+        print("[PY-API] Merge thread stopped.")
+
+    def _take_mergeable(self):
+        # removes from the pending batches what can be merged in order, None if nothing
+        if self.acquisition_mode == AcquisitionMode.SPECTROSCOPY:
+            return self._take_spectroscopy()
+        return self._take_photons_tracing()
+
+    def _take_spectroscopy(self):
+        # every device delivers its events in macro_time order: the events up to the
+        # lowest last macro_time of the running devices can not be preceded by later ones
+        limit = min((np.inf if finished else watermark) for finished, watermark in zip(self._finished, self._watermarks))
+        parts = []
+        for device, batches in enumerate(self._pending):
+            if not batches:
+                continue
+            events = batches[0] if len(batches) == 1 else np.concatenate(batches)
+            split = len(events) if limit == np.inf else np.searchsorted(events['macro_time'], limit, 'right')
+            self._pending[device] = [events[split:]] if split < len(events) else []
+            if split > 0:
+                part = np.empty(split, dtype=MERGED_SPECTROSCOPY_DTYPE)
+                for field in SPECTROSCOPY_DTYPE.names:
+                    part[field] = events[field][:split]
+                part['device'] = device
+                parts.append(part)
+        if not parts:
+            return None
+        merged = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        if len(parts) > 1:
+            # a stable sort keeps the order of the events of a device with the same macro_time
+            merged = merged[np.argsort(merged['macro_time'], kind='stable')]
+        return merged
+
+    def _take_photons_tracing(self):
+        # bin n of every device covers the same 100 microseconds: a bin is merged once
+        # every running device has received it, the devices that stopped earlier are
+        # padded with zeros
+        running = [received for finished, received in zip(self._finished, self._received) if not finished]
+        bins = (min(running) if running else max(self._received)) - self._merged_bins
+        if bins <= 0:
+            return None
+        columns = []
+        for device, api in enumerate(self.apis):
+            channels = len(api.photons_tracing_channels)
+            batches = self._pending[device]
+            rows = np.concatenate(batches) if batches else np.zeros((0, channels), dtype=PHOTONS_TRACING_DTYPE)
+            taken = rows[:bins]
+            if len(taken) < bins:
+                taken = np.concatenate((taken, np.zeros((bins - len(taken), channels), dtype=PHOTONS_TRACING_DTYPE)))
+            self._pending[device] = [rows[bins:]] if len(rows) > bins else []
+            columns.append(taken)
+        self._merged_bins += bins
+        return np.hstack(columns)
@@ -0,0 +1,149 @@
+import numpy as np
+
+
+class EventFilter:
+    # Selects the spectroscopy events kept by the API. channels is a set of values of the
+    # channel field, micro_time (ns), time_bin and macro_time (ns) are inclusive (low, high)
+    # ranges where None is unbounded, decimation keeps one event every decimation of those
+    # passing the channel, micro_time and time_bin criteria. The macro_time window is
+    # applied last and is never forwarded to flim-processor: the API still needs the later
+    # events to reach the end of the acquisition.
+    def __init__(self, channels=None, micro_time=None, time_bin=None, macro_time=None, decimation: int = 1):
+        if channels is not None:
+            channels = sorted(set(int(channel) for channel in channels))
+            if len(channels) == 0:
+                raise Exception("Channel filter is empty")
+            if channels[0] < 0 or channels[-1] > 255:
+                raise Exception("Channel filter values must be between 0 and 255")
+        if decimation < 1:
+            raise Exception("Decimation must be at least 1")
+        self.channels = channels
+        self.micro_time = _range(micro_time, "Micro time")
+        self.time_bin = _range(time_bin, "Time bin")
+        self.macro_time = _range(macro_time, "Macro time")
+        self.decimation = int(decimation)
+        self.passed = 0
+        self._channel_table = None
+        if channels is not None:
+            self._channel_table = np.zeros(256, dtype=bool)
+            self._channel_table[channels] = True
+
+    def reset(self):
+        self.passed = 0
+
+    def is_empty(self):
+        return (self.channels is None and self.micro_time is None and self.time_bin is None and
+                self.macro_time is None and self.decimation == 1)
+
+    def apply(self, batch):
+        # the kept events of a spectroscopy batch, a copy when any is filtered out
+        if len(batch) == 0:
+            return batch
+        mask = None
+        if self._channel_table is not None:
+            mask = self._channel_table[batch['channel']]
+        mask = _within(mask, batch['micro_time'], self.micro_time)
+        mask = _within(mask, batch['time_bin'], self.time_bin)
+        if self.decimation > 1:
+            passed = np.flatnonzero(mask) if mask is not None else np.arange(len(batch))
+            kept = passed[(self.passed + np.arange(len(passed))) % self.decimation == 0]
+            self.passed += len(passed)
+            mask = np.zeros(len(batch), dtype=bool)
+            mask[kept] = True
+        mask = _within(mask, batch['macro_time'], self.macro_time)
+        if mask is None or mask.all():
+            return batch
+        return batch[mask]
+
+    def accepts(self, event):
+        # the same criteria for one (channel, time_bin, micro_time, monotonic_counter,
+        # macro_time) event of the text wire format
+        channel, time_bin, micro_time, _, macro_time = event
+        if self._channel_table is not None and not self._channel_table[channel]:
+            return False
+        if not _inside(micro_time, self.micro_time) or not _inside(time_bin, self.time_bin):
+            return False
+        if self.decimation > 1:
+            passed = self.passed
+            self.passed += 1
+            if passed % self.decimation != 0:
+                return False
+        return _inside(macro_time, self.macro_time)
+
+    def processor_args(self):
+        # the criteria flim-processor can apply, None if there are none
+        args = []
+        if self.channels is not None:
+            args.append("channels=" + ",".join(map(str, self.channels)))
+        if self.micro_time is not None:
+            args.append("micro-time=" + _range_arg(self.micro_time))
+        if self.time_bin is not None:
+            args.append("time-bin=" + _range_arg(self.time_bin))
+        if self.decimation > 1:
+            args.append("decimation=" + str(self.decimation))
+        return ";".join(args) if args else None
+
+    def local_part(self):
+        # what is left to the API once flim-processor applies processor_args()
+        if self.macro_time is None:
+            return None
+        return EventFilter(macro_time=self.macro_time)
+
+    @staticmethod
+    def from_processor_args(args):
+        # inverse of processor_args, used to simulate flim-processor
+        criteria = {}
+        for arg in args.split(";"):
+            if arg == "":
+                continue
+            name, _, value = arg.partition("=")
+            match name:
+                case 'channels':
+                    criteria['channels'] = [int(channel) for channel in value.split(",")]
+                case 'micro-time':
+                    criteria['micro_time'] = _parse_range(value, float)
+                case 'time-bin':
+                    criteria['time_bin'] = _parse_range(value, int)
+                case 'decimation':
+                    criteria['decimation'] = int(value)
+                case _:
+                    raise Exception("Unknown filter criterion=" + name)
+        return EventFilter(**criteria)
+
+
+def _range(bounds, name):
+    if bounds is None:
+        return None
+    low, high = bounds
+    if low is not None and high is not None and low > high:
+        raise Exception(name + " filter range is empty")
+    if low is None and high is None:
+        return None
+    return low, high
+
+
+def _within(mask, values, bounds):
+    if bounds is None:
+        return mask
+    low, high = bounds
+    if low is not None:
+        mask = values >= low if mask is None else mask & (values >= low)
+    if high is not None:
+        mask = values <= high if mask is None else mask & (values <= high)
+    return mask
+
+
+def _inside(value, bounds):
+    if bounds is None:
+        return True
+    low, high = bounds
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+def _range_arg(bounds):
+    return ("" if bounds[0] is None else str(bounds[0])) + ":" + ("" if bounds[1] is None else str(bounds[1]))
+
+
+def _parse_range(value, parse):
+    low, _, high = value.partition(":")
+    return None if low == "" else parse(low), None if high == "" else parse(high)
@@ -0,0 +1,214 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+class FitModel:
+    # parameters of every fitted curve, in this order:
+    # mono: amplitude, tau (ns), offset
+    # bi: amplitude_1, tau_1 (ns), amplitude_2, tau_2 (ns), offset
+    MONO = 'mono'
+    BI = 'bi'
+
+
+PARAMETERS = {FitModel.MONO: 3, FitModel.BI: 5}
+
+
+def decay_bin_width_ns(laser_frequency_mhz: int, bins: int = 256):
+    # the spectroscopy time_bins split one laser period
+    return 1000 / laser_frequency_mhz / bins
+
+
+def initial_parameters(histograms, bin_width_ns: float, model: str = FitModel.MONO):
+    histograms = np.asarray(histograms, dtype=np.float64)
+    tail_start = np.argmax(histograms, axis=1)
+    peak = histograms[np.arange(len(histograms)), tail_start]
+    offset = np.maximum(histograms[:, -max(histograms.shape[1] // 16, 1):].mean(axis=1), 0)
+    amplitude = np.maximum(peak - offset, 1)
+    # mean photon delay after the peak, exact for an untruncated exponential
+    t = _tail_times(histograms.shape, tail_start, bin_width_ns)
+    signal = np.where(t >= 0, np.maximum(histograms - offset[:, None], 0), 0)
+    total = np.maximum(signal.sum(axis=1), 1)
+    tau = np.clip((signal * np.maximum(t, 0)).sum(axis=1) / total, bin_width_ns, None)
+    if model == FitModel.MONO:
+        return np.stack((amplitude, tau, offset), axis=1)
+    return np.stack((amplitude / 2, tau / 2, amplitude / 2, tau * 2, offset), axis=1)
+
+
+def fit_decays(histograms, bin_width_ns: float, model: str = FitModel.MONO, initial=None, iterations: int = 50,
+               tail_fit: bool = True):
+    # Levenberg-Marquardt fit of all the histograms (curves x bins) at once, with Poisson
+    # weights. With tail_fit only the bins from the peak of every curve are fitted.
+    # Returns (parameters (curves x PARAMETERS[model]), reduced chi square (curves,)).
+    if model not in PARAMETERS:
+        raise Exception("Fit model must be " + FitModel.MONO + " or " + FitModel.BI)
+    histograms = np.asarray(histograms, dtype=np.float64)
+    if histograms.ndim == 1:
+        histograms = histograms[None]
+    curves, bins = histograms.shape
+    params = initial_parameters(histograms, bin_width_ns, model) if initial is None \
+        else np.array(initial, dtype=np.float64).reshape(curves, PARAMETERS[model])
+    tail_start = np.argmax(histograms, axis=1) if tail_fit else np.zeros(curves, dtype=np.intp)
+    t = _tail_times(histograms.shape, tail_start, bin_width_ns)
+    weights = np.where(t >= 0, 1 / np.maximum(histograms, 1), 0)
+    t = np.maximum(t, 0)
+    tau_columns = [1] if model == FitModel.MONO else [1, 3]
+
+    damping = np.full(curves, 1e-3)
+    cost = _cost(histograms, weights, _model(params, t, model)[0])
+    # every curve stops at its own convergence, the others keep iterating
+    converged = np.zeros(curves, dtype=bool)
+    for _ in range(iterations):
+        active = np.flatnonzero(~converged)
+        if len(active) == 0:
+            break
+        curve_params, curve_histograms, curve_weights, curve_t = params[active], histograms[active], weights[active], t[active]
+        curve_cost, curve_damping = cost[active], damping[active]
+        f, jacobian = _model(curve_params, curve_t, model)
+        residuals = curve_histograms - f
+        jtwj = np.einsum('nbp,nb,nbq->npq', jacobian, curve_weights, jacobian)
+        gradient = np.einsum('nbp,nb,nb->np', jacobian, curve_weights, residuals)
+        diagonal = np.diagonal(jtwj, axis1=1, axis2=2)
+        system = jtwj + (curve_damping[:, None] * diagonal + 1e-12)[:, :, None] * np.eye(len(diagonal[0]))
+        step = np.linalg.solve(system, gradient[:, :, None])[:, :, 0]
+        candidate = curve_params + step
+        # lifetimes stay positive, at least a hundredth of a bin
+        candidate[:, tau_columns] = np.maximum(candidate[:, tau_columns], bin_width_ns / 100)
+        candidate_cost = _cost(curve_histograms, curve_weights, _model(candidate, curve_t, model)[0])
+        better = candidate_cost < curve_cost
+        improvement = (curve_cost - candidate_cost) / np.maximum(curve_cost, 1e-300)
+        params[active] = np.where(better[:, None], candidate, curve_params)
+        cost[active] = np.where(better, candidate_cost, curve_cost)
+        damping[active] = np.clip(np.where(better, curve_damping / 10, curve_damping * 10), 1e-12, 1e12)
+        # converged once an accepted step barely lowers the cost, a rejected step does not count
+        converged[active] = better & (improvement < 1e-8)
+
+    if model == FitModel.BI:
+        # shorter lifetime first
+        swap = params[:, 1] > params[:, 3]
+        params[swap] = params[swap][:, [2, 3, 0, 1, 4]]
+    fitted_bins = np.count_nonzero(weights, axis=1)
+    chi_square = cost / np.maximum(fitted_bins - PARAMETERS[model], 1)
+    empty = histograms.sum(axis=1) == 0
+    params[empty] = np.nan
+    chi_square[empty] = np.nan
+    return params, chi_square
+
+
+def _fit_chunk(arguments):
+    return fit_decays(*arguments)
+
+
+def _tail_times(shape, tail_start, bin_width_ns):
+    return (np.arange(shape[1])[None, :] - tail_start[:, None]) * bin_width_ns
+
+
+def _model(params, t, model):
+    a1, tau1 = params[:, 0:1], params[:, 1:2]
+    e1 = np.exp(-t / tau1)
+    if model == FitModel.MONO:
+        f = a1 * e1 + params[:, 2:3]
+        jacobian = np.stack((e1, a1 * e1 * t / (tau1 * tau1), np.ones_like(t)), axis=2)
+        return f, jacobian
+    a2, tau2 = params[:, 2:3], params[:, 3:4]
+    e2 = np.exp(-t / tau2)
+    f = a1 * e1 + a2 * e2 + params[:, 4:5]
+    jacobian = np.stack((e1, a1 * e1 * t / (tau1 * tau1), e2, a2 * e2 * t / (tau2 * tau2), np.ones_like(t)), axis=2)
+    return f, jacobian
+
+
+def _cost(histograms, weights, f):
+    return (weights * (histograms - f) ** 2).sum(axis=1)
+
+
+class LifetimeFitter:
+    # Fits the decay histograms of a live acquisition (e.g. DecayHistogram.snapshot()),
+    # starting every fit from the lifetimes of the previous one. Batches of at least
+    # parallel_threshold curves are split across a pool of worker processes.
+    def __init__(self, laser_frequency_mhz: int, bins: int = 256, model: str = FitModel.MONO,
+                 iterations: int = 50, tail_fit: bool = True, workers: int = None, parallel_threshold: int = 512):
+        if laser_frequency_mhz != 40 and laser_frequency_mhz != 80:
+            raise Exception("Laser frequency must be 40 or 80 MHz")
+        if model not in PARAMETERS:
+            raise Exception("Fit model must be " + FitModel.MONO + " or " + FitModel.BI)
+        if workers is None:
+            workers = max(multiprocessing.cpu_count() - 1, 1)
+        if workers <= 0:
+            raise Exception("Number of workers must be greater than 0")
+        self.bin_width_ns = decay_bin_width_ns(laser_frequency_mhz, bins)
+        self.model = model
+        self.iterations = iterations
+        self.tail_fit = tail_fit
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self.parameters = None
+        self.chi_square = None
+        self._executor = None
+
+    def fit(self, histograms):
+        histograms = np.asarray(histograms, dtype=np.float64)
+        if histograms.ndim == 1:
+            histograms = histograms[None]
+        initial = self._warm_start(histograms)
+        if self.workers > 1 and len(histograms) >= self.parallel_threshold:
+            params, chi_square = self._fit_parallel(histograms, initial)
+        else:
+            params, chi_square = fit_decays(histograms, self.bin_width_ns, self.model, initial, self.iterations,
+                                            self.tail_fit)
+        self.parameters = params
+        self.chi_square = chi_square
+        return params, chi_square
+
+    def lifetimes(self):
+        # lifetime of every curve of the last fit, amplitude weighted average for bi
+        if self.parameters is None:
+            return None
+        if self.model == FitModel.MONO:
+            return self.parameters[:, 1]
+        a1, tau1, a2, tau2 = self.parameters[:, 0], self.parameters[:, 1], self.parameters[:, 2], self.parameters[:, 3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (a1 * tau1 + a2 * tau2) / (a1 + a2)
+
+    def reset(self):
+        self.parameters = None
+        self.chi_square = None
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _warm_start(self, histograms):
+        initial = initial_parameters(histograms, self.bin_width_ns, self.model)
+        previous = self.parameters
+        if previous is None or previous.shape != initial.shape:
+            return initial
+        # the lifetimes (and the share of each exponential) of the previous fit, with the
+        # amplitudes of the current counts
+        usable = np.isfinite(previous).all(axis=1)
+        if self.model == FitModel.MONO:
+            initial[usable, 1] = previous[usable, 1]
+        else:
+            total = initial[usable, 0] + initial[usable, 2]
+            share = previous[usable, 0] / np.maximum(previous[usable, 0] + previous[usable, 2], 1e-300)
+            initial[usable, 0] = total * share
+            initial[usable, 2] = total * (1 - share)
+            initial[usable, 1] = previous[usable, 1]
+            initial[usable, 3] = previous[usable, 3]
+        return initial
+
+    def _fit_parallel(self, histograms, initial):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        bounds = np.linspace(0, len(histograms), self.workers + 1).astype(np.intp)
+        chunks = [(histograms[first:last], self.bin_width_ns, self.model, initial[first:last], self.iterations,
+                   self.tail_fit) for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+        results = list(self._executor.map(_fit_chunk, chunks))
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
@@ -0,0 +1,126 @@
+import threading
+
+import numpy as np
+
+
+class DecayHistogram:
+    # Per-channel TCSPC decay histogram fed with spectroscopy batches by the receiver
+    # thread. The counts are published through two preallocated buffers guarded by a
+    # generation counter, so snapshot() can be called from a UI thread at any time
+    # without stopping or locking the acquisition.
+    acquisition_mode = 'spectroscopy'
+
+    def __init__(self, channels: int = 16, bins: int = 256, window_ms: float = None, window_slices: int = 10):
+        if channels <= 0:
+            raise Exception("Number of channels must be greater than 0")
+        if bins <= 0:
+            raise Exception("Number of bins must be greater than 0")
+        if window_ms is not None and window_ms <= 0:
+            raise Exception("Rolling window must be greater than 0 ms")
+        if window_slices <= 0:
+            raise Exception("Number of window slices must be greater than 0")
+        self.channels = channels
+        self.bins = bins
+        self.window_ms = window_ms
+        self.window_slices = window_slices
+        self.discarded = 0
+        self._totals = np.zeros((channels, bins), dtype=np.int64)
+        self._buffers = [np.zeros((channels, bins), dtype=np.int64), np.zeros((channels, bins), dtype=np.int64)]
+        self._published = 0
+        self._generation = 0
+        self._reset_requested = False
+        self._feed_lock = threading.Lock()
+        # rolling window: one partial histogram per slice of window_ms / window_slices
+        self._slice_ns = None if window_ms is None else window_ms * 1_000_000 / window_slices
+        self._slices = None if window_ms is None else np.zeros((window_slices, channels, bins), dtype=np.int64)
+        self._current_slice = None
+
+    def feed(self, batch):
+        self._feed_lock.acquire()
+        try:
+            if self._reset_requested:
+                self._clear()
+            channel = batch['channel'].astype(np.intp)
+            time_bin = batch['time_bin'].astype(np.intp)
+            valid = (channel < self.channels) & (time_bin < self.bins)
+            if not valid.all():
+                self.discarded += int(len(valid) - np.count_nonzero(valid))
+                channel = channel[valid]
+                time_bin = time_bin[valid]
+                batch = batch[valid]
+            flat = channel * self.bins + time_bin
+            if self._slices is None:
+                self._totals += np.bincount(flat, minlength=self.channels * self.bins).reshape(self.channels, self.bins)
+            else:
+                self._feed_window(flat, batch['macro_time'])
+            self._publish()
+        finally:
+            self._feed_lock.release()
+
+    def snapshot(self, channel: int = None):
+        if self._reset_requested:
+            counts = np.zeros((self.channels, self.bins), dtype=np.int64)
+        else:
+            while True:
+                generation = self._generation
+                counts = self._buffers[self._published].copy()
+                if generation == self._generation:
+                    break
+        if channel is None:
+            return counts
+        return counts[channel]
+
+    def total(self):
+        return self.snapshot().sum(axis=0)
+
+    def reset(self):
+        # applied by the next feed, so the receiver thread is never interrupted mid-batch
+        self._reset_requested = True
+        if self._feed_lock.acquire(blocking=False):
+            try:
+                self._clear()
+                self._publish()
+            finally:
+                self._feed_lock.release()
+
+    def _clear(self):
+        self._totals[:] = 0
+        if self._slices is not None:
+            self._slices[:] = 0
+            self._current_slice = None
+        self.discarded = 0
+        self._reset_requested = False
+
+    def _feed_window(self, flat, macro_time):
+        slice_index = (macro_time // self._slice_ns).astype(np.int64)
+        for index in np.unique(slice_index):
+            self._advance_window(int(index))
+            if index <= self._current_slice - self.window_slices:
+                # older than the rolling window
+                continue
+            counts = np.bincount(flat[slice_index == index], minlength=self.channels * self.bins)
+            counts = counts.reshape(self.channels, self.bins)
+            self._slices[index % self.window_slices] += counts
+            self._totals += counts
+
+    def _advance_window(self, index):
+        if self._current_slice is None:
+            self._current_slice = index
+            return
+        if index <= self._current_slice:
+            return
+        if index - self._current_slice >= self.window_slices:
+            self._slices[:] = 0
+            self._totals[:] = 0
+        else:
+            for expired in range(self._current_slice + 1, index + 1):
+                slot = expired % self.window_slices
+                self._totals -= self._slices[slot]
+                self._slices[slot] = 0
+        self._current_slice = index
+
+    def _publish(self):
+        back = 1 - self._published
+        np.copyto(self._buffers[back], self._totals)
+        self._published = back
+        self._generation += 1
@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+
+from flim_labs_wire import SPECTROSCOPY_DTYPE
+
+# Record layout of the spectroscopy output files written by flim-processor:
+# 1 byte channel, 8 bytes micro time (double), 8 bytes macro time (double), no padding.
+SPECTROSCOPY_FILE_DTYPE = np.dtype([
+    ('channel', '<u1'),
+    ('micro_time', '<f8'),
+    ('macro_time', '<f8'),
+])
+
+
+class SpectroscopyFile:
+    # Memory-mapped view over a spectroscopy output file. Columns are zero-copy strided
+    # views over the mapping, so files larger than RAM can be processed in chunks.
+    def __init__(self, path):
+        self.path = path
+        size = os.path.getsize(path)
+        count = size // SPECTROSCOPY_FILE_DTYPE.itemsize
+        if size % SPECTROSCOPY_FILE_DTYPE.itemsize != 0:
+            print("[PY-API] Ignoring truncated record at the end of " + str(path))
+        if count == 0:
+            self.records = np.zeros(0, dtype=SPECTROSCOPY_FILE_DTYPE)
+        else:
+            self.records = np.memmap(path, dtype=SPECTROSCOPY_FILE_DTYPE, mode='r', shape=(count,))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def channel(self):
+        return self.records['channel']
+
+    @property
+    def micro_time(self):
+        return self.records['micro_time']
+
+    @property
+    def macro_time(self):
+        return self.records['macro_time']
+
+    def iter_chunks(self, chunk_size: int = 1024 * 1024):
+        if chunk_size <= 0:
+            raise Exception("Chunk size must be greater than 0")
+        for start in range(0, len(self.records), chunk_size):
+            yield self.records[start:start + chunk_size]
+
+    def micro_time_range(self, chunk_size: int = 1024 * 1024):
+        low = np.inf
+        high = -np.inf
+        for chunk in self.iter_chunks(chunk_size):
+            micro_time = chunk['micro_time']
+            low = min(low, float(micro_time.min()))
+            high = max(high, float(micro_time.max()))
+        if low > high:
+            return 0.0, 1.0
+        if low == high:
+            return low, low + 1.0
+        return low, high
+
+    def histogram(self, bins: int = 256, micro_time_range=None, channel: int = None,
+                  chunk_size: int = 1024 * 1024):
+        if micro_time_range is None:
+            micro_time_range = self.micro_time_range(chunk_size)
+        edges = np.linspace(micro_time_range[0], micro_time_range[1], bins + 1)
+        counts = np.zeros(bins, dtype=np.int64)
+        for chunk in self.iter_chunks(chunk_size):
+            micro_time = chunk['micro_time']
+            if channel is not None:
+                micro_time = micro_time[chunk['channel'] == channel]
+            counts += np.histogram(micro_time, bins=bins, range=micro_time_range)[0]
+        return counts, edges
+
+    def close(self):
+        # the mapping is released once the views handed out are released as well
+        self.records = np.zeros(0, dtype=SPECTROSCOPY_FILE_DTYPE)
+
+
+def open_spectroscopy_file(path):
+    return SpectroscopyFile(path)
+
+
+def spectroscopy_events(records, laser_frequency_mhz: int, bins: int = 256):
+    # file records to the events of a live acquisition: the time_bin splits one laser
+    # period in bins and monotonic_counter counts the laser periods
+    period_ns = 1000 / laser_frequency_mhz
+    events = np.empty(len(records), dtype=SPECTROSCOPY_DTYPE)
+    events['channel'] = records['channel']
+    events['time_bin'] = np.clip(records['micro_time'] / period_ns * bins, 0, bins - 1)
+    events['micro_time'] = records['micro_time']
+    events['monotonic_counter'] = records['macro_time'] // period_ns
+    events['macro_time'] = records['macro_time']
+    return events
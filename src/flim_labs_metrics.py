@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+
+import numpy as np
+
+
+class AcquisitionMetrics:
+    # Counters are only ever written by one thread each (receiver or consumer), so they
+    # are plain attributes. Handler times are kept in a fixed ring of the last samples.
+    def __init__(self, handler_samples: int = 4096):
+        self.handler_times = np.zeros(handler_samples)
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.monotonic()
+        self.acquisition_started_at = None
+        self.messages_received = 0
+        self.bytes_received = 0
+        self.events_decoded = 0
+        self.events_filtered = 0
+        self.parse_errors = 0
+        self.handler_calls = 0
+        self.events_delivered = 0
+        self.events_discarded = 0
+        self.last_received_macro_time = None
+        self.last_delivered_macro_time = None
+        self.handler_samples = 0
+        self.handler_times[:] = 0
+
+    def acquisition_started(self):
+        # macro_time counts from the start of the acquisition, used as reference for the lag
+        self.acquisition_started_at = time.monotonic()
+
+    def record_message(self, events: int, macro_time=None, size: int = 0):
+        self.messages_received += 1
+        self.bytes_received += size
+        self.events_decoded += events
+        if macro_time is not None:
+            self.last_received_macro_time = macro_time
+
+    def record_filtered(self, events: int):
+        # decoded but dropped by the event filter
+        self.events_filtered += int(events)
+
+    def record_parse_error(self):
+        self.parse_errors += 1
+
+    def record_discarded(self, events: int):
+        # received but not delivered: after the acquisition time or left queued at the stop
+        self.events_discarded += int(events)
+
+    def record_handler(self, seconds: float, events: int, macro_time=None):
+        self.handler_times[self.handler_samples % len(self.handler_times)] = seconds
+        self.handler_samples += 1
+        self.handler_calls += 1
+        self.events_delivered += events
+        if macro_time is not None:
+            self.last_delivered_macro_time = macro_time
+
+    def snapshot(self, ring_buffer_stats=None):
+        now = time.monotonic()
+        elapsed = now - self.started_at
+        stats = {
+            'timestamp': time.time(),
+            'elapsed_s': elapsed,
+            'messages_received': self.messages_received,
+            'bytes_received': self.bytes_received,
+            'events_decoded': self.events_decoded,
+            'events_filtered': self.events_filtered,
+            'parse_errors': self.parse_errors,
+            'handler_calls': self.handler_calls,
+            'events_delivered': self.events_delivered,
+            'events_discarded': self.events_discarded,
+            'events_per_second': self.events_decoded / elapsed if elapsed > 0 else 0.0,
+            'handler_time_p50_ms': None,
+            'handler_time_p90_ms': None,
+            'handler_time_p99_ms': None,
+            'receive_lag_ms': self._lag_ms(now, self.last_received_macro_time),
+            'delivery_lag_ms': self._lag_ms(now, self.last_delivered_macro_time),
+            'queue_depth': None,
+            'queue_high_water_mark': None,
+            'queue_dropped': None,
+        }
+        samples = min(self.handler_samples, len(self.handler_times))
+        if samples > 0:
+            p50, p90, p99 = _percentiles(self.handler_times[:samples], [50, 90, 99]) * 1000
+            stats['handler_time_p50_ms'] = float(p50)
+            stats['handler_time_p90_ms'] = float(p90)
+            stats['handler_time_p99_ms'] = float(p99)
+        if ring_buffer_stats is not None:
+            stats['queue_depth'] = ring_buffer_stats['depth']
+            stats['queue_high_water_mark'] = ring_buffer_stats['high_water_mark']
+            stats['queue_dropped'] = ring_buffer_stats['dropped']
+        return stats
+
+    def _lag_ms(self, now, macro_time):
+        if macro_time is None or self.acquisition_started_at is None:
+            return None
+        return (now - self.acquisition_started_at) * 1000 - macro_time / 1_000_000
+
+
+def _percentiles(values, percentiles):
+    # same linear interpolation as np.percentile, whose first call in a process takes
+    # tens of milliseconds, too long for the final stats of a stopped acquisition
+    values = np.sort(values)
+    positions = np.asarray(percentiles) / 100 * (len(values) - 1)
+    low = np.floor(positions).astype(np.intp)
+    high = np.minimum(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (positions - low)
+
+
+class MetricsExporter:
+    # appends one JSON object per interval to path
+    def __init__(self, path, stats, interval_s: float = 1.0):
+        if interval_s <= 0:
+            raise Exception("Export interval must be greater than 0 seconds")
+        self.path = path
+        self.interval_s = interval_s
+        self._stats = stats
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._export_task, name="flim-labs-metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _export_task(self):
+        with open(self.path, 'a') as f:
+            while not self._stop.wait(self.interval_s):
+                f.write(json.dumps(self._stats()) + "\n")
+                f.flush()
+            f.write(json.dumps(self._stats()) + "\n")
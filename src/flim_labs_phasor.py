@@ -0,0 +1,160 @@
+import math
+import threading
+
+import numpy as np
+
+
+class PhasorEngine:
+    # Streaming phasor of the spectroscopy photons: for every channel it keeps the number
+    # of photons and the sums of cos/sin of the micro_time (ns) phase at harmonic times
+    # the laser frequency, so G = sum(cos) / n and S = sum(sin) / n are available at any
+    # time without storing the events. With window_ms only the photons of the last
+    # window_ms of macro_time are counted, in window_slices slices.
+    acquisition_mode = 'spectroscopy'
+
+    def __init__(self, laser_frequency_mhz: int, harmonic: int = 1, channels: int = 16, window_ms: float = None,
+                 window_slices: int = 10):
+        if laser_frequency_mhz != 40 and laser_frequency_mhz != 80:
+            raise Exception("Laser frequency must be 40 or 80 MHz")
+        if harmonic <= 0:
+            raise Exception("Harmonic must be greater than 0")
+        if channels <= 0:
+            raise Exception("Number of channels must be greater than 0")
+        if window_ms is not None and window_ms <= 0:
+            raise Exception("Rolling window must be greater than 0 ms")
+        if window_slices <= 0:
+            raise Exception("Number of window slices must be greater than 0")
+        self.laser_frequency_mhz = laser_frequency_mhz
+        self.harmonic = harmonic
+        self.channels = channels
+        self.window_ms = window_ms
+        self.window_slices = window_slices
+        # angular frequency in rad/ns
+        self.omega = 2 * math.pi * laser_frequency_mhz * harmonic / 1000
+        self.discarded = 0
+        self.calibration_phase = 0.0
+        self.calibration_modulation = 1.0
+        # rows: photons, sum of cos, sum of sin
+        self._sums = np.zeros((3, channels))
+        self._lock = threading.Lock()
+        self._slice_ns = None if window_ms is None else window_ms * 1_000_000 / window_slices
+        self._slices = None if window_ms is None else np.zeros((window_slices, 3, channels))
+        self._current_slice = None
+
+    def feed(self, batch):
+        channel = batch['channel'].astype(np.intp)
+        valid = channel < self.channels
+        if not valid.all():
+            channel = channel[valid]
+            batch = batch[valid]
+        phase = batch['micro_time'] * self.omega
+        cos = np.cos(phase)
+        sin = np.sin(phase)
+        self._lock.acquire()
+        try:
+            self.discarded += int(len(valid) - len(channel))
+            if self._slices is None:
+                self._add(self._sums, channel, cos, sin)
+            else:
+                slice_index = (batch['macro_time'] // self._slice_ns).astype(np.int64)
+                for index in np.unique(slice_index):
+                    self._advance_window(int(index))
+                    if index <= self._current_slice - self.window_slices:
+                        # older than the rolling window
+                        continue
+                    in_slice = slice_index == index
+                    partial = np.zeros((3, self.channels))
+                    self._add(partial, channel[in_slice], cos[in_slice], sin[in_slice])
+                    self._slices[index % self.window_slices] += partial
+                    self._sums += partial
+        finally:
+            self._lock.release()
+
+    def counts(self):
+        self._lock.acquire()
+        try:
+            return self._sums[0].astype(np.int64)
+        finally:
+            self._lock.release()
+
+    def phasor(self, channel: int = None):
+        # calibrated (G, S), nan for channels without photons
+        self._lock.acquire()
+        try:
+            photons, cos, sin = self._sums.copy()
+        finally:
+            self._lock.release()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            g = cos / photons
+            s = sin / photons
+        g, s = self._calibrate(g, s)
+        if channel is None:
+            return g, s
+        return g[channel], s[channel]
+
+    def lifetimes(self, channel: int = None):
+        # (phase lifetime, modulation lifetime) in ns
+        g, s = self.phasor(channel)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tau_phase = s / (g * self.omega)
+            tau_modulation = np.sqrt(np.maximum(1 / (g * g + s * s) - 1, 0)) / self.omega
+        return tau_phase, tau_modulation
+
+    def calibrate(self, reference_lifetime_ns: float, channel: int = None):
+        # the photons fed so far come from a reference with a known single exponential
+        # lifetime: its measured phasor is rotated and scaled onto the theoretical one
+        self._lock.acquire()
+        try:
+            photons, cos, sin = self._sums.copy()
+        finally:
+            self._lock.release()
+        if channel is not None:
+            photons, cos, sin = photons[channel], cos[channel], sin[channel]
+        else:
+            photons, cos, sin = photons.sum(), cos.sum(), sin.sum()
+        if photons == 0:
+            raise Exception("No photons to calibrate with")
+        g, s = cos / photons, sin / photons
+        wt = self.omega * reference_lifetime_ns
+        expected_g, expected_s = 1 / (1 + wt * wt), wt / (1 + wt * wt)
+        self.calibration_phase = math.atan2(expected_s, expected_g) - math.atan2(s, g)
+        self.calibration_modulation = math.hypot(expected_g, expected_s) / math.hypot(g, s)
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._sums[:] = 0
+            if self._slices is not None:
+                self._slices[:] = 0
+                self._current_slice = None
+            self.discarded = 0
+        finally:
+            self._lock.release()
+
+    def _calibrate(self, g, s):
+        if self.calibration_phase == 0.0 and self.calibration_modulation == 1.0:
+            return g, s
+        cos = math.cos(self.calibration_phase) * self.calibration_modulation
+        sin = math.sin(self.calibration_phase) * self.calibration_modulation
+        return g * cos - s * sin, g * sin + s * cos
+
+    def _add(self, sums, channel, cos, sin):
+        sums[0] += np.bincount(channel, minlength=self.channels)
+        sums[1] += np.bincount(channel, weights=cos, minlength=self.channels)
+        sums[2] += np.bincount(channel, weights=sin, minlength=self.channels)
+
+    def _advance_window(self, index):
+        if self._current_slice is None:
+            self._current_slice = index
+            return
+        if index <= self._current_slice:
+            return
+        if index - self._current_slice >= self.window_slices:
+            self._slices[:] = 0
+            self._sums[:] = 0
+        else:
+            for expired in range(self._current_slice + 1, index + 1):
+                slot = expired % self.window_slices
+                self._sums -= self._slices[slot]
+                self._slices[slot] = 0
+        self._current_slice = index
@@ -0,0 +1,233 @@
+import multiprocessing
+import struct
+from multiprocessing import shared_memory
+
+import numpy as np
+import zmq
+
+from flim_labs_wire import WIRE_HEADER, is_binary_frame, decode_binary_frame, decode_text_message, events_to_array
+
+# Every forwarded frame is preceded by the maximum number of records of that frame a
+# worker may keep (-1 for all of them), used to cut photons tracing at the exact bin.
+RECORD_LIMIT = struct.Struct('<q')
+
+# counters of every worker, one int64 each
+EVENTS = 0
+FRAMES = 1
+PARSE_ERRORS = 2
+CUTOFF_REACHED = 3
+COUNTERS = 4
+# text frames a worker drains from its socket before reducing them in one call
+TEXT_BATCH = 4096
+
+
+def _layout(workers, channels, bins, tracing_channels):
+    # name -> (dtype, shape) of the arrays stored one after the other in shared memory
+    return [
+        ('decay', np.int64, (workers, channels, bins)),
+        ('trace_sums', np.int64, (workers, tracing_channels)),
+        ('counters', np.int64, (workers, COUNTERS)),
+        ('last_macro_time', np.float64, (workers,)),
+    ]
+
+
+def _attach_arrays(buffer, layout):
+    arrays = {}
+    offset = 0
+    for name, dtype, shape in layout:
+        array = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+        arrays[name] = array
+        offset += array.nbytes
+    return arrays
+
+
+def _layout_size(layout):
+    return sum(np.dtype(dtype).itemsize * int(np.prod(shape)) for _, dtype, shape in layout)
+
+
+def _reduce(batch, acquisition_mode, macro_time_limit, event_filter, decay, trace_sums, counters, last_macro_time,
+            index):
+    channels, bins = decay.shape
+    match acquisition_mode:
+        case 'spectroscopy':
+            in_time = batch['macro_time'] <= macro_time_limit
+            if not in_time.all():
+                counters[CUTOFF_REACHED] = 1
+                batch = batch[in_time]
+            if event_filter is not None:
+                # every worker decimates its own share of the events
+                batch = event_filter.apply(batch)
+            batch = batch[(batch['channel'] < channels) & (batch['time_bin'] < bins)]
+            if len(batch) > 0:
+                flat = batch['channel'].astype(np.intp) * bins + batch['time_bin']
+                decay += np.bincount(flat, minlength=channels * bins).reshape(channels, bins)
+                last_macro_time[index] = max(last_macro_time[index], batch['macro_time'].max())
+        case 'photons-tracing':
+            width = min(batch.shape[1], len(trace_sums))
+            trace_sums[:width] += batch[:, :width].sum(axis=0, dtype=np.int64)
+    counters[EVENTS] += len(batch)
+
+
+def _pipeline_worker(index, endpoint, shm_name, layout, acquisition_mode, macro_time_limit, stop_event,
+                     event_filter=None):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    arrays = _attach_arrays(shm.buf, layout)
+    decay = arrays['decay'][index]
+    trace_sums = arrays['trace_sums'][index]
+    counters = arrays['counters'][index]
+    last_macro_time = arrays['last_macro_time']
+    z_pull = zmq.Context.instance().socket(zmq.PULL)
+    z_pull.connect(endpoint)
+    try:
+        while True:
+            if z_pull.poll(100) == 0:
+                if stop_event.is_set():
+                    break
+                continue
+            # text frames carry a single event: the queued ones are decoded one by one but
+            # reduced at once, binary frames are reduced as they come
+            events = []
+            for _ in range(TEXT_BATCH):
+                try:
+                    limit, message = z_pull.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                limit = RECORD_LIMIT.unpack(limit)[0]
+                counters[FRAMES] += 1
+                try:
+                    if is_binary_frame(message):
+                        batch = decode_binary_frame(message)
+                        if limit >= 0:
+                            batch = batch[:limit]
+                        _reduce(batch, acquisition_mode, macro_time_limit, event_filter, decay, trace_sums, counters,
+                                last_macro_time, index)
+                        continue
+                    event = decode_text_message(acquisition_mode, message)
+                except Exception:
+                    counters[PARSE_ERRORS] += 1
+                    continue
+                if event is not None and limit != 0:
+                    events.append(event)
+            if events:
+                _reduce(events_to_array(acquisition_mode, events), acquisition_mode, macro_time_limit, event_filter,
+                        decay, trace_sums, counters, last_macro_time, index)
+    finally:
+        z_pull.close(linger=0)
+        del decay, trace_sums, counters, last_macro_time, arrays
+        shm.close()
+
+
+class PhotonPipeline:
+    # Raw frames received by FlimLabsApi are pushed, undecoded, to N worker processes
+    # (ZMQ PUSH/PULL load balancing). Each worker decodes and reduces its share into its
+    # own slice of a shared memory block, which the parent sums on demand.
+    def __init__(self, workers: int = None, channels: int = 16, bins: int = 256, tracing_channels: int = 12):
+        if workers is None:
+            workers = max(multiprocessing.cpu_count() - 1, 1)
+        if workers <= 0:
+            raise Exception("Number of workers must be greater than 0")
+        self.workers = workers
+        self.layout = _layout(workers, channels, bins, tracing_channels)
+        self.acquisition_mode = None
+        self.forwarded_records = 0
+        self._shm = None
+        self._arrays = {name: np.zeros(shape, dtype=dtype) for name, dtype, shape in self.layout}
+        self._processes = []
+        self._stop_event = None
+        self._z_push = None
+        self._record_limit = None
+
+    def start(self, acquisition_mode, macro_time_limit=np.inf, record_limit: int = None, event_filter=None):
+        if self._processes:
+            raise Exception("Pipeline already started")
+        self.acquisition_mode = acquisition_mode
+        self.forwarded_records = 0
+        self._record_limit = record_limit
+        self._release_shared_memory()
+        self._shm = shared_memory.SharedMemory(create=True, size=_layout_size(self.layout))
+        self._arrays = _attach_arrays(self._shm.buf, self.layout)
+        for array in self._arrays.values():
+            array[:] = 0
+        self._z_push = zmq.Context.instance().socket(zmq.PUSH)
+        port = self._z_push.bind_to_random_port("tcp://127.0.0.1")
+        endpoint = "tcp://127.0.0.1:" + str(port)
+        context = multiprocessing.get_context('spawn')
+        self._stop_event = context.Event()
+        for index in range(self.workers):
+            process = context.Process(
+                target=_pipeline_worker,
+                args=(index, endpoint, self._shm.name, self.layout, acquisition_mode, macro_time_limit,
+                      self._stop_event, event_filter),
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+        print("[PY-API] Pipeline started with " + str(self.workers) + " workers")
+
+    def forward(self, message):
+        # called by the receiver thread for every frame, only the header is looked at
+        limit = -1
+        if self._record_limit is not None:
+            remaining = self._record_limit - self.forwarded_records
+            if remaining <= 0:
+                return False
+            records = _frame_records(message)
+            if records > remaining:
+                limit = remaining
+                records = remaining
+            self.forwarded_records += records
+        self._z_push.send_multipart((RECORD_LIMIT.pack(limit), message), copy=False)
+        return True
+
+    def stop(self, timeout: float = 5):
+        if not self._processes:
+            return
+        # the workers exit once the frames already pushed are drained
+        self._stop_event.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        self._z_push.close(linger=0)
+        self._z_push = None
+        print("[PY-API] Pipeline stopped")
+
+    def close(self):
+        self.stop()
+        self._release_shared_memory()
+
+    def _release_shared_memory(self):
+        if self._shm is not None:
+            # keep a private copy of the results readable after the shared block is gone
+            self._arrays = {name: array.copy() for name, array in self._arrays.items()}
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def cutoff_reached(self):
+        if self._record_limit is not None and self.forwarded_records >= self._record_limit:
+            return True
+        return bool(self._arrays['counters'][:, CUTOFF_REACHED].any())
+
+    def decay_histogram(self):
+        return self._arrays['decay'].sum(axis=0)
+
+    def trace_sums(self):
+        return self._arrays['trace_sums'].sum(axis=0)
+
+    def stats(self):
+        counters = self._arrays['counters'].sum(axis=0)
+        return {
+            'workers': self.workers,
+            'events': int(counters[EVENTS]),
+            'frames': int(counters[FRAMES]),
+            'parse_errors': int(counters[PARSE_ERRORS]),
+            'last_macro_time': float(self._arrays['last_macro_time'].max()),
+        }
+
+
+def _frame_records(message):
+    if is_binary_frame(message):
+        return WIRE_HEADER.unpack_from(message)[4]
+    return 0 if message == b'exp' else 1
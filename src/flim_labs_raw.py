@@ -0,0 +1,141 @@
+import os
+import queue
+
+import numpy as np
+
+# gathered writes are split in groups of at most this many buffers (IOV_MAX is 1024 on Linux)
+MAX_WRITE_BUFFERS = 1024
+
+
+class RawDataWriter:
+    # Appends raw data frames to a file without copying them: the buffers of a batch are
+    # written with a single os.writev where available. The file can be preallocated to
+    # the expected size and is truncated to the bytes written when closed.
+    def __init__(self, path, preallocate_bytes: int = 0):
+        self.path = path
+        self.bytes_written = 0
+        self.preallocated = preallocate_bytes
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        if preallocate_bytes > 0:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(self._fd, 0, preallocate_bytes)
+            else:
+                os.ftruncate(self._fd, preallocate_bytes)
+
+    def write(self, buffers):
+        buffers = [memoryview(b).cast('B') for b in buffers]
+        for first in range(0, len(buffers), MAX_WRITE_BUFFERS):
+            self._write_all(buffers[first:first + MAX_WRITE_BUFFERS])
+
+    def close(self):
+        if self._fd is None:
+            return
+        if self.preallocated > self.bytes_written:
+            os.ftruncate(self._fd, self.bytes_written)
+        os.close(self._fd)
+        self._fd = None
+
+    def _write_all(self, buffers):
+        while buffers:
+            if hasattr(os, 'writev'):
+                written = os.writev(self._fd, buffers)
+            else:
+                written = os.write(self._fd, buffers[0])
+            self.bytes_written += written
+            # drop what was written, a partially written buffer is sliced, not copied
+            while buffers and written >= len(buffers[0]):
+                written -= len(buffers[0])
+                buffers = buffers[1:]
+            if buffers and written > 0:
+                buffers = [buffers[0][written:]] + buffers[1:]
+
+
+class RawFrameQueue:
+    # Bounded queue of the raw data frames received by the receiver thread. Frames are
+    # zmq.Frame objects received with copy=False: their memory is the ZMQ message buffer
+    # and stays valid as long as the frame is referenced.
+    def __init__(self, max_frames: int = 1024, byte_limit: int = None):
+        if max_frames <= 0:
+            raise Exception("Raw frame queue size must be greater than 0")
+        self.byte_limit = byte_limit
+        self.bytes_received = 0
+        self.frames_received = 0
+        self.high_water_mark = 0
+        self.closed = False
+        self.finished = False
+        self._queue = queue.Queue(max_frames)
+
+    def put(self, frame):
+        # returns False once byte_limit bytes were queued, the frame exceeding it is trimmed
+        view = frame.buffer
+        if self.byte_limit is not None:
+            remaining = self.byte_limit - self.bytes_received
+            if remaining <= 0:
+                return False
+            if len(view) > remaining:
+                view = view[:remaining]
+        self.bytes_received += len(view)
+        self.frames_received += 1
+        # a full queue blocks the receiver until the consumer catches up or the queue is closed
+        while not self.closed:
+            try:
+                self._queue.put((frame, view), timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.high_water_mark = max(self.high_water_mark, self._queue.qsize())
+        return self.byte_limit is None or self.bytes_received < self.byte_limit
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        while not self.closed:
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+    def close(self):
+        self.closed = True
+
+    def get_many(self, max_frames: int, timeout: float):
+        # (frames, views, finished): up to max_frames queued frames, waiting at most
+        # timeout for the first one
+        frames = []
+        views = []
+        try:
+            item = self._queue.get(timeout=timeout)
+            while True:
+                if item is None:
+                    return frames, views, True
+                frames.append(item[0])
+                views.append(item[1])
+                if len(frames) >= max_frames:
+                    break
+                item = self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        return frames, views, False
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def queued_bytes(self):
+        return sum(len(item[1]) for item in list(self._queue.queue) if item is not None)
+
+    def stats(self):
+        return {
+            'capacity': self._queue.maxsize,
+            'depth': self._queue.qsize(),
+            'high_water_mark': self.high_water_mark,
+            'dropped': 0,
+            'bytes_received': self.bytes_received,
+            'frames_received': self.frames_received,
+        }
+
+
+def raw_frame_array(view):
+    # NumPy view of a raw data frame, no copy
+    return np.frombuffer(view, dtype=np.uint8)
@@ -0,0 +1,254 @@
+import atexit
+import json
+import struct
+import threading
+import zlib
+from queue import Queue
+
+import numpy as np
+
+# Chunked columnar recording of a live acquisition.
+#
+#   magic (8s) | header length (I) | JSON header | chunks... | JSON index | index length (Q) | magic (8s)
+#
+# Every chunk stores each column as a separate zlib block. The index at the end of the
+# file lists, for every chunk, its offset, the size of every column block, the number
+# of the first record and the first/last key (macro_time in spectroscopy mode, the bin
+# number otherwise), so readers can seek without decompressing the whole file.
+RECORDING_MAGIC = b'FLREC001'
+INDEX_FOOTER = struct.Struct('<Q8s')
+
+
+def _columns_of(batch):
+    if batch.dtype.names is not None:
+        return {name: batch[name] for name in batch.dtype.names}
+    if batch.ndim == 2:
+        return {'ch' + str(i): batch[:, i] for i in range(batch.shape[1])}
+    return {'value': batch}
+
+
+class StreamRecorder:
+    acquisition_mode = None
+    # detached and closed by FlimLabsApi.stop_acquisition
+    close_on_stop = True
+
+    def __init__(self, path, acquisition_mode: str, chunk_records: int = 65536, compression_level: int = 1,
+                 max_pending_chunks: int = 8):
+        if chunk_records <= 0:
+            raise Exception("Chunk size must be greater than 0 records")
+        self.path = path
+        self.acquisition_mode = acquisition_mode
+        self.chunk_records = chunk_records
+        self.compression_level = compression_level
+        self.records_written = 0
+        self.closed = False
+        self._file = open(path, 'wb')
+        self._stage = None
+        self._staged = 0
+        self._index = []
+        self._header_written = False
+        self._condition = threading.Condition()
+        # at most max_pending_chunks queued, so memory stays flat when the disk is slower
+        # than the acquisition; only feed waits for room, close never blocks
+        self._pending = Queue()
+        self._max_pending_chunks = max_pending_chunks
+        self._queued_chunks = 0
+        # a daemon thread does not keep the interpreter alive when close is never called,
+        # the file is completed at exit instead
+        self._writer_thread = threading.Thread(target=self._writer_task, name="flim-labs-recorder", daemon=True)
+        self._writer_thread.start()
+        atexit.register(self._close_at_exit)
+
+    def feed(self, batch):
+        with self._condition:
+            if self.closed:
+                return
+            if self._stage is None:
+                self._stage = np.zeros((self.chunk_records,) + batch.shape[1:], dtype=batch.dtype)
+            start = 0
+            while start < len(batch):
+                size = min(self.chunk_records - self._staged, len(batch) - start)
+                self._stage[self._staged:self._staged + size] = batch[start:start + size]
+                self._staged += size
+                start += size
+                if self._staged == self.chunk_records:
+                    # waiting releases the lock: a close meanwhile queues the full stage itself
+                    while self._queued_chunks >= self._max_pending_chunks and not self.closed:
+                        self._condition.wait()
+                    if self.closed:
+                        return
+                    self._flush_stage()
+
+    def close(self, wait: bool = False):
+        # the writer thread finishes compressing the queued chunks in background
+        with self._condition:
+            if self.closed:
+                return
+            self.closed = True
+            if self._staged > 0:
+                self._flush_stage()
+            self._pending.put(None)
+            self._condition.notify_all()
+        atexit.unregister(self._close_at_exit)
+        if wait:
+            self.join()
+
+    def join(self, timeout: float = None):
+        self._writer_thread.join(timeout)
+
+    def _close_at_exit(self):
+        self.close(wait=True)
+
+    def _flush_stage(self):
+        self._queued_chunks += 1
+        self._pending.put(self._stage[:self._staged].copy())
+        self._staged = 0
+
+    def _writer_task(self):
+        try:
+            while True:
+                chunk = self._pending.get()
+                if chunk is None:
+                    break
+                self._write_chunk(chunk)
+                with self._condition:
+                    self._queued_chunks -= 1
+                    self._condition.notify_all()
+            self._write_index()
+        except Exception as e:
+            print("[PY-API] Recorder error: " + str(e))
+            # nothing will be written anymore, feed must not wait for room
+            with self._condition:
+                self.closed = True
+                self._condition.notify_all()
+        finally:
+            self._file.close()
+
+    def _write_header(self, chunk):
+        columns = _columns_of(chunk)
+        header = {
+            'acquisition_mode': self.acquisition_mode,
+            'dtype': np.lib.format.dtype_to_descr(chunk.dtype),
+            'shape': list(chunk.shape[1:]),
+            'columns': [[name, column.dtype.str] for name, column in columns.items()],
+            'compression': 'zlib',
+        }
+        header = json.dumps(header).encode('utf-8')
+        self._file.write(RECORDING_MAGIC + struct.pack('<I', len(header)) + header)
+        self._header_written = True
+
+    def _write_chunk(self, chunk):
+        if not self._header_written:
+            self._write_header(chunk)
+        offset = self._file.tell()
+        sizes = []
+        for column in _columns_of(chunk).values():
+            block = zlib.compress(np.ascontiguousarray(column).tobytes(), self.compression_level)
+            self._file.write(block)
+            sizes.append(len(block))
+        if self.acquisition_mode == 'spectroscopy':
+            first_key = float(chunk['macro_time'][0])
+            last_key = float(chunk['macro_time'][-1])
+        else:
+            first_key = self.records_written
+            last_key = self.records_written + len(chunk) - 1
+        self._index.append({
+            'offset': offset,
+            'sizes': sizes,
+            'count': len(chunk),
+            'first_record': self.records_written,
+            'first_key': first_key,
+            'last_key': last_key,
+        })
+        self.records_written += len(chunk)
+
+    def _write_index(self):
+        if not self._header_written:
+            return
+        index = json.dumps({'chunks': self._index, 'records': self.records_written}).encode('utf-8')
+        self._file.write(index)
+        self._file.write(INDEX_FOOTER.pack(len(index), RECORDING_MAGIC))
+
+
+class RecordingReader:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        if self._file.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            self._file.close()
+            raise Exception("Not a flim labs recording: " + str(path))
+        header_size = struct.unpack('<I', self._file.read(4))[0]
+        header = json.loads(self._file.read(header_size).decode('utf-8'))
+        self.acquisition_mode = header['acquisition_mode']
+        self.dtype = np.lib.format.descr_to_dtype(_as_descr(header['dtype']))
+        self.shape = tuple(header['shape'])
+        self.columns = [(name, np.dtype(dtype)) for name, dtype in header['columns']]
+        self._file.seek(-INDEX_FOOTER.size, 2)
+        index_size, magic = INDEX_FOOTER.unpack(self._file.read(INDEX_FOOTER.size))
+        if magic != RECORDING_MAGIC:
+            self._file.close()
+            raise Exception("Recording has no index, it was not closed: " + str(path))
+        self._file.seek(-INDEX_FOOTER.size - index_size, 2)
+        index = json.loads(self._file.read(index_size).decode('utf-8'))
+        self.chunks = index['chunks']
+        self.records = index['records']
+
+    def __len__(self):
+        return self.records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        for i in range(len(self.chunks)):
+            yield self.read_chunk(i)
+
+    def read_chunk(self, i: int):
+        entry = self.chunks[i]
+        self._file.seek(entry['offset'])
+        records = np.zeros((entry['count'],) + self.shape, dtype=self.dtype)
+        for (name, dtype), size in zip(self.columns, entry['sizes']):
+            column = np.frombuffer(zlib.decompress(self._file.read(size)), dtype=dtype)
+            if self.dtype.names is not None:
+                records[name] = column
+            elif records.ndim == 2:
+                records[:, int(name[2:])] = column
+            else:
+                records[:] = column
+        return records
+
+    def read(self, first_key=None, last_key=None):
+        # records whose key (macro_time or bin number) is within [first_key, last_key]
+        selected = []
+        for i, entry in enumerate(self.chunks):
+            if first_key is not None and entry['last_key'] < first_key:
+                continue
+            if last_key is not None and entry['first_key'] > last_key:
+                continue
+            records = self.read_chunk(i)
+            if self.dtype.names is not None and 'macro_time' in self.dtype.names:
+                keys = records['macro_time']
+            else:
+                keys = np.arange(entry['first_record'], entry['first_record'] + entry['count'])
+            mask = np.ones(len(records), dtype=bool)
+            if first_key is not None:
+                mask &= keys >= first_key
+            if last_key is not None:
+                mask &= keys <= last_key
+            selected.append(records[mask])
+        if not selected:
+            return np.zeros((0,) + self.shape, dtype=self.dtype)
+        return np.concatenate(selected)
+
+    def close(self):
+        self._file.close()
+
+
+def _as_descr(descr):
+    # JSON turns the tuples of a structured dtype description into lists
+    if isinstance(descr, list):
+        return [tuple(_as_descr(item) if isinstance(item, list) else item for item in field) for field in descr]
+    return descr
@@ -0,0 +1,144 @@
+import threading
+
+import numpy as np
+
+
+class OverflowPolicy:
+    BLOCK = 'block'               # the receiver waits for the consumer to free space
+    DROP_OLDEST = 'drop-oldest'   # the oldest unread events are overwritten
+    DROP_NEWEST = 'drop-newest'   # the incoming events are discarded
+
+
+class RingBuffer:
+    # Single producer (receiver thread) / single consumer (consumer thread) ring over a
+    # preallocated NumPy array. read_count and write_count only ever grow and each one
+    # is written by a single thread, so no lock is needed except for DROP_OLDEST where
+    # the producer also moves the read position.
+    def __init__(self, dtype, capacity: int, overflow_policy: str = OverflowPolicy.BLOCK):
+        if capacity <= 0:
+            raise Exception("Ring buffer capacity must be greater than 0")
+        if overflow_policy not in (OverflowPolicy.BLOCK, OverflowPolicy.DROP_OLDEST, OverflowPolicy.DROP_NEWEST):
+            raise Exception("Invalid ring buffer overflow policy=" + str(overflow_policy))
+        self.buffer = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.overflow_policy = overflow_policy
+        self.read_count = 0
+        self.write_count = 0
+        self.dropped = 0
+        self.high_water_mark = 0
+        self.closed = False
+        self._lock = threading.Lock() if overflow_policy == OverflowPolicy.DROP_OLDEST else None
+        self._data_available = threading.Event()
+        self._space_available = threading.Event()
+
+    def __len__(self):
+        return self.write_count - self.read_count
+
+    def close(self):
+        # wakes up a receiver blocked on a full buffer and a consumer waiting for data
+        self.closed = True
+        self._data_available.set()
+        self._space_available.set()
+
+    def push_one(self, record):
+        if self.write_count - self.read_count >= self.capacity and not self._make_room(1):
+            return
+        self.buffer[self.write_count % self.capacity] = record
+        self._advance_write(1)
+
+    def push(self, records):
+        count = len(records)
+        if count == 0:
+            return
+        if count > self.capacity and self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+            self._lock.acquire()
+            self.dropped += count - self.capacity
+            self._lock.release()
+            records = records[count - self.capacity:]
+            count = self.capacity
+        start = 0
+        while start < count:
+            free = self.capacity - (self.write_count - self.read_count)
+            if free == 0:
+                if not self._make_room(count - start):
+                    return
+                free = self.capacity - (self.write_count - self.read_count)
+            size = min(free, count - start)
+            self._write(records[start:start + size])
+            start += size
+
+    def pop(self, max_count: int):
+        if self._lock is not None:
+            self._lock.acquire()
+        try:
+            count = min(self.write_count - self.read_count, max_count)
+            first = self.read_count % self.capacity
+            end = min(first + count, self.capacity)
+            records = self.buffer[first:end].copy()
+            if end - first < count:
+                records = np.concatenate((records, self.buffer[:count - (end - first)]))
+            self.read_count += count
+        finally:
+            if self._lock is not None:
+                self._lock.release()
+        if count > 0:
+            self._space_available.set()
+        return records
+
+    def wait_for_data(self, timeout: float, min_count: int = 1):
+        while self.write_count - self.read_count < min_count and not self.closed:
+            self._data_available.clear()
+            # checked again after clear(), so a push or close in between is not missed
+            if self.write_count - self.read_count >= min_count or self.closed:
+                break
+            if not self._data_available.wait(timeout):
+                break
+        return self.write_count - self.read_count
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'depth': self.write_count - self.read_count,
+            'high_water_mark': self.high_water_mark,
+            'dropped': self.dropped,
+            'overflow_policy': self.overflow_policy,
+        }
+
+    def _make_room(self, count):
+        match self.overflow_policy:
+            case OverflowPolicy.DROP_NEWEST:
+                self.dropped += count
+                return False
+            case OverflowPolicy.DROP_OLDEST:
+                self._lock.acquire()
+                overflow = self.write_count - self.read_count + min(count, self.capacity) - self.capacity
+                if overflow > 0:
+                    self.read_count += overflow
+                    self.dropped += overflow
+                self._lock.release()
+                return True
+            case _:
+                while self.write_count - self.read_count >= self.capacity:
+                    if self.closed:
+                        self.dropped += count
+                        return False
+                    self._space_available.clear()
+                    if self.write_count - self.read_count < self.capacity:
+                        break
+                    self._space_available.wait(0.1)
+                return True
+
+    def _write(self, records):
+        first = self.write_count % self.capacity
+        end = min(first + len(records), self.capacity)
+        self.buffer[first:end] = records[:end - first]
+        if end - first < len(records):
+            self.buffer[:len(records) - (end - first)] = records[end - first:]
+        self._advance_write(len(records))
+
+    def _advance_write(self, count):
+        self.write_count += count
+        depth = self.write_count - self.read_count
+        if depth > self.high_water_mark:
+            self.high_water_mark = depth
+        self._data_available.set()
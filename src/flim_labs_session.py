@@ -0,0 +1,129 @@
+import os
+import re
+import subprocess
+import tempfile
+
+DATA_ENDPOINT = "tcp://localhost:5556"
+COMMANDS_ENDPOINT = "tcp://localhost:5550"
+
+# pid and executable name of the flim-processor started by the last FlimLabsApi, so that
+# a processor left running by a crashed session can be killed without scanning every process
+PID_FILE = os.path.join(tempfile.gettempdir(), "flim-labs-processor.pid")
+PROCESSOR_NAME = "flim-processor.exe"
+# started by flim-processor, it keeps the device open until it exits
+READER_NAME = "flim-reader.exe"
+
+
+def pid_file(commands_endpoint: str = COMMANDS_ENDPOINT):
+    # one pid file per device: the processors of the other devices are not stale
+    if commands_endpoint == COMMANDS_ENDPOINT:
+        return PID_FILE
+    suffix = re.sub(r'[^0-9A-Za-z]+', '-', commands_endpoint).strip('-')
+    return os.path.join(tempfile.gettempdir(), "flim-labs-processor-" + suffix + ".pid")
+
+
+def kill_process_tree(pid: int):
+    import psutil
+    try:
+        process = psutil.Process(pid)
+        processes = process.children(recursive=True) + [process]
+    except psutil.NoSuchProcess:
+        return
+    for p in processes:
+        try:
+            p.kill()
+        except psutil.NoSuchProcess:
+            pass
+    psutil.wait_procs(processes, timeout=5)
+
+
+def kill_stale_processor(path: str = PID_FILE, executable: str = PROCESSOR_NAME):
+    # executable is the flim-processor command of this session, None when it is started
+    # by someone else: its readers are then not looked for
+    pid, name = _read_pid_file(path)
+    if pid is None and executable is None:
+        return
+    # psutil is only imported when there is something to look for
+    import psutil
+    if pid is not None:
+        # the name recorded with the pid, files written by older versions only have the pid
+        if name is None:
+            name = PROCESSOR_NAME if executable is None else os.path.basename(executable)
+        try:
+            if psutil.Process(pid).name() == name:
+                print("[PY-API] Killing stale flim-processor, pid=" + str(pid))
+                kill_process_tree(pid)
+        except psutil.NoSuchProcess:
+            pass
+        _remove_pid_file(path, pid)
+    if executable is not None:
+        kill_orphaned_readers(os.path.basename(executable))
+
+
+def kill_orphaned_readers(processor_name: str = PROCESSOR_NAME):
+    # flim-reader outlives a flim-processor killed without its children: the readers whose
+    # parent is not a running flim-processor are stale, those of other devices are not
+    import psutil
+    processor_names = (processor_name, PROCESSOR_NAME)
+    for process in psutil.process_iter(['name']):
+        if process.info['name'] != READER_NAME:
+            continue
+        try:
+            parent = process.parent()
+            if parent is not None and parent.name() in processor_names and \
+                    parent.create_time() <= process.create_time():
+                continue
+            print("[PY-API] Killing orphaned flim-reader, pid=" + str(process.pid))
+            kill_process_tree(process.pid)
+        except psutil.NoSuchProcess:
+            pass
+
+
+def _read_pid_file(path: str):
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+        return int(lines[0]), lines[1].strip() if len(lines) > 1 else None
+    except (OSError, ValueError, IndexError):
+        return None, None
+
+
+def _remove_pid_file(path: str, pid: int):
+    if _read_pid_file(path)[0] != pid:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ProcessorProcess:
+    # flim-processor started by this process, tracked by pid: flim-reader runs as its
+    # child and is killed with it
+    def __init__(self, executable: str, args: list[str] = None, path: str = PID_FILE):
+        self.executable = executable
+        self.args = list(args or [])
+        self.pid_file = path
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen([self.executable] + self.args)
+        try:
+            with open(self.pid_file, 'w') as f:
+                f.write(str(self.process.pid) + "\n" + os.path.basename(self.executable))
+        except OSError:
+            pass
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def kill(self):
+        if self.process is None:
+            return
+        kill_process_tree(self.process.pid)
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            print("[PY-API] flim-processor did not exit, pid=" + str(self.process.pid))
+        _remove_pid_file(self.pid_file, self.process.pid)
+        self.process = None
@@ -0,0 +1,237 @@
+import threading
+
+import numpy as np
+
+# every photons tracing time_bin is 100 microseconds
+BIN_SECONDS = 0.0001
+
+
+class TraceViewBuffer:
+    # Fixed-size multi-resolution buffer for live photons tracing plots. Level 0 keeps
+    # the last capacity bins of every channel, each following level keeps min/max/sum of
+    # groups of factor entries of the previous one, so level L spans capacity * factor^L
+    # bins. view() picks the coarsest level with enough points for the requested pixels,
+    # so its cost does not depend on the length of the acquisition.
+    acquisition_mode = 'photons-tracing'
+
+    def __init__(self, capacity: int = 16384, levels: int = 8, factor: int = 4):
+        if capacity <= 0:
+            raise Exception("Trace view capacity must be greater than 0 bins")
+        if levels <= 0:
+            raise Exception("Number of levels must be greater than 0")
+        if factor < 2:
+            raise Exception("Decimation factor must be at least 2")
+        self.capacity = capacity
+        self.levels = levels
+        self.factor = factor
+        self.channels = None
+        self.total_bins = 0
+        self._lock = threading.Lock()
+        self._min = None
+        self._max = None
+        self._sum = None
+        self._counts = [0] * levels
+        self._carry = [None] * levels
+
+    def feed(self, batch):
+        self._lock.acquire()
+        try:
+            if self.channels is None:
+                self._allocate(batch.shape[1])
+            low, high, total = batch, batch, batch.astype(np.int64)
+            self.total_bins += len(batch)
+            for level in range(self.levels):
+                self._append(level, low, high, total)
+                if level + 1 == self.levels:
+                    break
+                low, high, total = self._decimate(level, low, high, total)
+                if len(total) == 0:
+                    break
+        finally:
+            self._lock.release()
+
+    def view(self, seconds: float, pixels: int):
+        # (start time in seconds of every column, min, max, mean) of the last seconds,
+        # reduced to at most pixels columns, arrays are (columns x channels)
+        if pixels <= 0:
+            raise Exception("Number of pixels must be greater than 0")
+        self._lock.acquire()
+        try:
+            if self.channels is None or self.total_bins == 0:
+                empty = np.zeros((0, 0))
+                return np.zeros(0), empty, empty, empty
+            wanted_bins = min(max(int(round(seconds / BIN_SECONDS)), 1), self.total_bins)
+            level = 0
+            while level + 1 < self.levels and (
+                    wanted_bins > self.capacity * self.factor ** level
+                    or wanted_bins // self.factor ** (level + 1) >= pixels):
+                level += 1
+            scale = self.factor ** level
+            # the newest bins not yet grouped in a whole entry of the level are the last entry
+            pending = self._pending(level)
+            pending_bins = 0 if pending is None else pending[3]
+            entries = min(max(-(-(wanted_bins - pending_bins) // scale), 0), self._counts[level], self.capacity)
+            low, high, total = self._last(level, entries)
+            first_bin = (self._counts[level] - entries) * scale
+            sizes = np.full(entries, scale)
+            if pending is not None:
+                low = np.concatenate((low, pending[0][None]))
+                high = np.concatenate((high, pending[1][None]))
+                total = np.concatenate((total, pending[2][None]))
+                sizes = np.append(sizes, pending_bins)
+        finally:
+            self._lock.release()
+
+        # group the entries in columns, the last column ends with the last entry
+        entries = len(total)
+        columns = min(pixels, entries)
+        starts = np.linspace(0, entries, columns, endpoint=False).astype(np.intp)
+        low = np.minimum.reduceat(low, starts, axis=0)
+        high = np.maximum.reduceat(high, starts, axis=0)
+        mean = np.add.reduceat(total, starts, axis=0) / np.add.reduceat(sizes, starts)[:, None]
+        times = (first_bin + starts * scale) * BIN_SECONDS
+        return times, low, high, mean
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.channels = None
+            self.total_bins = 0
+            self._counts = [0] * self.levels
+            self._carry = [None] * self.levels
+        finally:
+            self._lock.release()
+
+    def _allocate(self, channels):
+        self.channels = channels
+        shape = (self.levels, self.capacity, channels)
+        self._min = np.zeros(shape, dtype=np.uint32)
+        self._max = np.zeros(shape, dtype=np.uint32)
+        self._sum = np.zeros(shape, dtype=np.int64)
+
+    def _append(self, level, low, high, total):
+        count = len(total)
+        if count > self.capacity:
+            low, high, total = low[-self.capacity:], high[-self.capacity:], total[-self.capacity:]
+            self._counts[level] += count - self.capacity
+            count = self.capacity
+        first = self._counts[level] % self.capacity
+        end = min(first + count, self.capacity)
+        split = end - first
+        for target, values in ((self._min, low), (self._max, high), (self._sum, total)):
+            target[level, first:end] = values[:split]
+            target[level, :count - split] = values[split:]
+        self._counts[level] += count
+
+    def _decimate(self, level, low, high, total):
+        carry = self._carry[level]
+        if carry is not None:
+            low = np.concatenate((carry[0], low))
+            high = np.concatenate((carry[1], high))
+            total = np.concatenate((carry[2], total))
+        groups = len(total) // self.factor
+        end = groups * self.factor
+        self._carry[level] = (low[end:], high[end:], total[end:]) if end < len(total) else None
+        shape = (groups, self.factor, self.channels)
+        return (low[:end].reshape(shape).min(axis=1),
+                high[:end].reshape(shape).max(axis=1),
+                total[:end].reshape(shape).sum(axis=1))
+
+    def _pending(self, level):
+        # (min, max, sum, bins) of the bins kept in the carries of the finer levels, None if none
+        carries = [(carry, self.factor ** index) for index, carry in enumerate(self._carry[:level]) if carry is not None]
+        if not carries:
+            return None
+        low = np.min([carry[0].min(axis=0) for carry, _ in carries], axis=0)
+        high = np.max([carry[1].max(axis=0) for carry, _ in carries], axis=0)
+        total = np.sum([carry[2].sum(axis=0) for carry, _ in carries], axis=0)
+        return low, high, total, sum(len(carry[2]) * scale for carry, scale in carries)
+
+    def _last(self, level, entries):
+        end = self._counts[level] % self.capacity
+        indexes = np.arange(end - entries, end) % self.capacity
+        return self._min[level, indexes], self._max[level, indexes], self._sum[level, indexes]
+
+
+class TraceStore:
+    # Whole photons tracing acquisition as one (bins x channels) array, in the order of
+    # the channels passed to acquire_photons_tracing. The array is preallocated and grows
+    # by chunk_bins rows at a time, the receiver copies every batch in with one slice
+    # assignment.
+    acquisition_mode = 'photons-tracing'
+
+    def __init__(self, chunk_bins: int = 100_000, max_bins: int = None):
+        if chunk_bins <= 0:
+            raise Exception("Chunk size must be greater than 0 bins")
+        if max_bins is not None and max_bins <= 0:
+            raise Exception("Maximum number of bins must be greater than 0")
+        self.chunk_bins = chunk_bins
+        self.max_bins = max_bins
+        self.bins = 0
+        self.discarded = 0
+        self._data = None
+        self._lock = threading.Lock()
+
+    def feed(self, batch):
+        self._lock.acquire()
+        try:
+            if self._data is None or self._data.shape[1] != batch.shape[1]:
+                self._data = np.zeros((self.chunk_bins, batch.shape[1]), dtype=np.uint32)
+                self.bins = 0
+            if self.max_bins is not None and self.bins + len(batch) > self.max_bins:
+                self.discarded += self.bins + len(batch) - self.max_bins
+                batch = batch[:self.max_bins - self.bins]
+            needed = self.bins + len(batch)
+            if needed > len(self._data):
+                # at least half of the current size, so the copies stay amortized
+                grow = max(self.chunk_bins, len(self._data) // 2, needed - len(self._data))
+                data = np.zeros((len(self._data) + grow, self._data.shape[1]), dtype=np.uint32)
+                data[:self.bins] = self._data[:self.bins]
+                self._data = data
+            self._data[self.bins:needed] = batch
+            self.bins = needed
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.bins = 0
+            self.discarded = 0
+        finally:
+            self._lock.release()
+
+    def counts(self, seconds: float = None):
+        # view of the counts of the last seconds (all of them by default), not a copy
+        self._lock.acquire()
+        try:
+            if self._data is None:
+                return np.zeros((0, 0), dtype=np.uint32)
+            first = 0 if seconds is None else max(self.bins - int(round(seconds / BIN_SECONDS)), 0)
+            return self._data[first:self.bins]
+        finally:
+            self._lock.release()
+
+    def channel(self, index: int, seconds: float = None):
+        return self.counts(seconds)[:, index]
+
+    def rates(self, seconds: float = None):
+        # photons per second of every channel
+        counts = self.counts(seconds)
+        if len(counts) == 0:
+            return np.zeros(counts.shape[1])
+        return counts.sum(axis=0, dtype=np.int64) / (len(counts) * BIN_SECONDS)
+
+    def cumulative(self, seconds: float = None):
+        return np.cumsum(self.counts(seconds), axis=0, dtype=np.int64)
+
+    def correlation(self, seconds: float = None):
+        # Pearson correlation between the channels, nan for channels without variance
+        counts = self.counts(seconds).astype(np.float64)
+        if len(counts) < 2:
+            return np.full((counts.shape[1], counts.shape[1]), np.nan)
+        centered = counts - counts.mean(axis=0)
+        covariance = centered.T @ centered
+        deviation = np.sqrt(np.diag(covariance))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return covariance / np.outer(deviation, deviation)
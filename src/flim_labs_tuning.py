@@ -0,0 +1,191 @@
+import threading
+import time
+
+# bounds of the tuned values
+MIN_BATCH = 256
+MAX_BATCH = 65536
+MIN_RING_BUFFER = 65536
+MAX_RING_BUFFER = 16 * 1024 * 1024
+MIN_RECEIVE_HWM = 1000
+MAX_RECEIVE_HWM = 1_000_000
+MIN_RECEIVE_BUFFER = 256 * 1024
+MAX_RECEIVE_BUFFER = 64 * 1024 * 1024
+# settings left to the user, with the reason, see report()
+UNTUNED = {
+    'chunk_size': "sized by the byte rate of the device, which the API does not observe: the bytes received are "
+                  "those published by flim-processor, which depend on the wire format and the event filter",
+}
+
+
+def _power_of_two(value, low, high):
+    # smallest power of two >= value, within [low, high]
+    value = max(int(value), 1)
+    return min(max(1 << (value - 1).bit_length(), low), high)
+
+
+class AcquisitionTuner:
+    # Samples api.stats() every interval_s while an acquisition runs.
+    # During the acquisition the consumer batch size follows the decode rate: a batch
+    # holds the events of max_latency_ms. It is doubled while the ring buffer fills up
+    # and halved when the handler takes longer than max_latency_ms with an empty queue.
+    # When the acquisition ends, the values applied at the start of the next one are
+    # sized from its peaks: the ring buffer holds 4x the events received while the
+    # handler runs plus max_latency_ms, and is doubled after drops. The ZMQ receive high
+    # water mark holds 1 s of messages and the kernel receive buffer 100 ms of bytes. The
+    # flim-reader chunk size is not tuned, see UNTUNED.
+    def __init__(self, api, max_latency_ms: float = 50, interval_s: float = 0.25):
+        if max_latency_ms <= 0:
+            raise Exception("Maximum latency must be greater than 0 ms")
+        if interval_s <= 0:
+            raise Exception("Tuning interval must be greater than 0 seconds")
+        self.api = api
+        self.max_latency_ms = max_latency_ms
+        self.interval_s = interval_s
+        self.changes = []
+        self.observed = {}
+        self._acquisition = None
+        self._previous = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._tuning_task, name="flim-labs-tuning", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self):
+        # the values in use, the peaks observed in the last acquisition and every change made
+        self._lock.acquire()
+        try:
+            return {
+                'batch_max_size': self.api.batch_max_size,
+                'batch_max_latency_ms': self.api.batch_max_latency_ms,
+                'ring_buffer_capacity': self.api.ring_buffer_capacity,
+                'receive_hwm': self.api.receive_hwm,
+                'receive_buffer': self.api.receive_buffer,
+                'chunk_size': self.api.chunk_size,
+                'chunks': self.api.chunks,
+                'observed': dict(self.observed),
+                'changes': list(self.changes),
+                'untuned': dict(UNTUNED),
+            }
+        finally:
+            self._lock.release()
+
+    def _tuning_task(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                done = self.api.acquisition_done
+                if done is None:
+                    continue
+                self._lock.acquire()
+                try:
+                    if done is not self._acquisition:
+                        self._acquisition = done
+                        self._previous = None
+                        self.observed = {}
+                        # the values of the next acquisition are set as soon as this one ends
+                        done.add_done_callback(lambda _, done=done: self._acquisition_finished(done))
+                    if not done.done():
+                        self._sample(False)
+                finally:
+                    self._lock.release()
+            except Exception as e:
+                print("[PY-API] Autotuning error: " + str(e))
+
+    def _acquisition_finished(self, done):
+        self._lock.acquire()
+        try:
+            if done is self._acquisition and not self._stop.is_set():
+                self._sample(True)
+        except Exception as e:
+            print("[PY-API] Autotuning error: " + str(e))
+        finally:
+            self._lock.release()
+
+    def _sample(self, finished):
+        stats = self.api.stats()
+        # the raw data queue counts frames, not events: only the ring buffer is tuned
+        queue = self.api.ring_buffer.stats() if self.api.raw_queue is None and self.api.ring_buffer is not None else None
+        now = time.monotonic()
+        previous = self._previous
+        self._previous = (now, stats, queue)
+        if previous is None:
+            return
+        elapsed = now - previous[0]
+        if elapsed <= 0:
+            return
+        rates = {}
+        for name, counter in (('events_per_second', 'events_decoded'), ('messages_per_second', 'messages_received'),
+                              ('bytes_per_second', 'bytes_received')):
+            rates[name] = (stats[counter] - previous[1][counter]) / elapsed
+            self.observed[name] = max(self.observed.get(name, 0.0), rates[name])
+        if stats['handler_time_p99_ms'] is not None:
+            self.observed['handler_time_p99_ms'] = stats['handler_time_p99_ms']
+        if queue is not None:
+            self.observed['queue_high_water_mark'] = queue['high_water_mark']
+            self.observed['queue_capacity'] = queue['capacity']
+            self.observed['queue_dropped'] = queue['dropped']
+        if finished:
+            self._tune_next_acquisition()
+        elif queue is not None:
+            dropping = previous[2] is not None and queue['dropped'] > previous[2]['dropped']
+            self._tune_batch(rates['events_per_second'], stats['handler_time_p99_ms'], queue, dropping)
+
+    def _tune_batch(self, events_per_second, handler_time_ms, queue, dropping):
+        if events_per_second <= 0:
+            # nothing received yet, e.g. flim-processor still starting
+            return
+        batch = self.api.batch_max_size
+        target = _power_of_two(events_per_second * self.max_latency_ms / 1000, MIN_BATCH, MAX_BATCH)
+        fill = queue['depth'] / queue['capacity']
+        if fill > 0.5 or dropping:
+            # the consumer falls behind: fewer, larger handler calls
+            target = max(target, min(batch * 2, MAX_BATCH))
+            reason = "queue at " + str(int(fill * 100)) + "%" + (", dropping" if dropping else "")
+        elif handler_time_ms is not None and handler_time_ms > self.max_latency_ms and fill < 0.1:
+            target = min(target, max(batch // 2, MIN_BATCH))
+            reason = "handler p99 " + ("%.1f" % handler_time_ms) + " ms"
+        else:
+            reason = ("%.0f" % events_per_second) + " events/s"
+        if target != batch:
+            self.api.batch_max_size = target
+            self.api.batch_max_latency_ms = self.max_latency_ms
+            self._record('batch_max_size', batch, target, reason)
+
+    def _tune_next_acquisition(self):
+        observed = self.observed
+        api = self.api
+        events_per_second = observed.get('events_per_second', 0.0)
+        bytes_per_second = observed.get('bytes_per_second', 0.0)
+        if 'queue_capacity' in observed:
+            handler_ms = observed.get('handler_time_p99_ms') or 0.0
+            capacity = _power_of_two(4 * events_per_second * (handler_ms + self.max_latency_ms) / 1000,
+                                     MIN_RING_BUFFER, MAX_RING_BUFFER)
+            reason = ("%.0f" % events_per_second) + " events/s"
+            if observed['queue_dropped'] > 0 or observed['queue_high_water_mark'] > 0.75 * observed['queue_capacity']:
+                capacity = max(capacity, min(observed['queue_capacity'] * 2, MAX_RING_BUFFER))
+                reason = "high water mark " + str(observed['queue_high_water_mark']) + ", dropped " + str(
+                    observed['queue_dropped'])
+            if capacity != api.ring_buffer_capacity:
+                self._record('ring_buffer_capacity', api.ring_buffer_capacity, capacity, reason)
+                api.set_ring_buffer(capacity, api.ring_buffer_overflow_policy)
+        if events_per_second <= 0 and bytes_per_second <= 0:
+            return
+        hwm = _power_of_two(observed.get('messages_per_second', 0.0), MIN_RECEIVE_HWM, MAX_RECEIVE_HWM)
+        buffer_bytes = _power_of_two(bytes_per_second / 10, MIN_RECEIVE_BUFFER, MAX_RECEIVE_BUFFER)
+        if (hwm, buffer_bytes) != (api.receive_hwm, api.receive_buffer):
+            reason = ("%.0f" % observed.get('messages_per_second', 0.0)) + " messages/s, " + (
+                    "%.0f" % bytes_per_second) + " bytes/s"
+            self._record('receive_hwm', api.receive_hwm, hwm, reason)
+            self._record('receive_buffer', api.receive_buffer, buffer_bytes, reason)
+            api.set_receive_buffers(hwm, buffer_bytes)
+
+    def _record(self, name, old, new, reason):
+        print("[PY-API] Autotuning: " + name + " " + str(old) + " -> " + str(new) + " (" + reason + ")")
+        self._lock.acquire()
+        try:
+            self.changes.append({'time': time.time(), 'name': name, 'old': old, 'new': new, 'reason': reason})
+        finally:
+            self._lock.release()
@@ -0,0 +1,115 @@
+import struct
+
+import numpy as np
+
+# Binary batched frames published by flim-processor once the "binary" wire format
+# has been negotiated. Every frame is a fixed header followed by a packed block of
+# fixed-width records, so a whole block is decoded with a single numpy.frombuffer.
+#
+#   magic (4s) | version (B) | mode (B) | width (H) | count (I) | records...
+#
+# width is the number of counters per record in photons-tracing mode and 1 otherwise.
+WIRE_MAGIC = b'FLB1'
+WIRE_VERSION = 1
+WIRE_HEADER = struct.Struct('<4sBBHI')
+
+SPECTROSCOPY_DTYPE = np.dtype([
+    ('channel', '<u1'),
+    ('time_bin', '<u1'),
+    ('micro_time', '<f8'),
+    ('monotonic_counter', '<u8'),
+    ('macro_time', '<f8'),
+])
+PHOTONS_TRACING_DTYPE = np.dtype('<u4')
+MEASURE_FREQUENCY_DTYPE = np.dtype('<f8')
+
+MODE_CODES = {
+    'photons-tracing': 1,
+    'spectroscopy': 2,
+    'measure-frequency': 3,
+}
+MODES_BY_CODE = {code: mode for mode, code in MODE_CODES.items()}
+
+
+class WireFormat:
+    TEXT = 'text'        # one UTF-8 "[a,b,c]" message per event
+    BINARY = 'binary'    # packed blocks of events, see WIRE_HEADER
+
+
+def is_binary_frame(message) -> bool:
+    return message[:4] == WIRE_MAGIC
+
+
+def decode_binary_frame(message):
+    magic, version, mode_code, width, count = WIRE_HEADER.unpack_from(message)
+    if version != WIRE_VERSION:
+        raise Exception("[PY-API] Unsupported wire format version=" + str(version))
+    mode = MODES_BY_CODE.get(mode_code)
+    offset = WIRE_HEADER.size
+    match mode:
+        case 'spectroscopy':
+            return np.frombuffer(message, dtype=SPECTROSCOPY_DTYPE, count=count, offset=offset)
+        case 'photons-tracing':
+            data = np.frombuffer(message, dtype=PHOTONS_TRACING_DTYPE, count=count * width, offset=offset)
+            return data.reshape(count, width)
+        case 'measure-frequency':
+            return np.frombuffer(message, dtype=MEASURE_FREQUENCY_DTYPE, count=count, offset=offset)
+        case _:
+            raise Exception("[PY-API] Invalid wire format mode code=" + str(mode_code))
+
+
+def encode_binary_frame(mode, records):
+    # mainly used to simulate flim-processor, the processor itself produces these frames
+    match mode:
+        case 'spectroscopy':
+            records = np.ascontiguousarray(records, dtype=SPECTROSCOPY_DTYPE)
+            width = 1
+        case 'photons-tracing':
+            records = np.ascontiguousarray(records, dtype=PHOTONS_TRACING_DTYPE)
+            if records.ndim == 1:
+                records = records.reshape(1, -1)
+            width = records.shape[1]
+        case 'measure-frequency':
+            records = np.ascontiguousarray(records, dtype=MEASURE_FREQUENCY_DTYPE).reshape(-1)
+            width = 1
+        case _:
+            raise Exception("[PY-API] Invalid acquisition mode for binary frame=" + str(mode))
+    header = WIRE_HEADER.pack(WIRE_MAGIC, WIRE_VERSION, MODE_CODES[mode], width, len(records))
+    return header + records.tobytes()
+
+
+
+def decode_text_message(mode, message):
+    # "[a,b,c]" UTF-8 messages, one event each; flim-processor also sends "exp" messages
+    # that carry no event and are skipped (None)
+    message = message.decode('utf-8')
+    if message == 'exp':
+        return None
+    message = message[1:-1].split(',')
+    match mode:
+        case 'photons-tracing':
+            return list(map(int, message))
+        case 'measure-frequency':
+            return list(map(float, message))[0]
+        case 'spectroscopy':
+            return (
+                int(message[0]),
+                int(message[1]),
+                float(message[2]),
+                int(message[3]),
+                float(message[4])
+            )
+        case _:
+            raise Exception("[PY-API] receiver_task: Invalid acquisition mode=" + str(mode))
+
+
+def events_to_array(mode, events):
+    match mode:
+        case 'spectroscopy':
+            return np.array(events, dtype=SPECTROSCOPY_DTYPE)
+        case 'photons-tracing':
+            return np.array(events, dtype=PHOTONS_TRACING_DTYPE).reshape(len(events), -1)
+        case 'measure-frequency':
+            return np.array(events, dtype=MEASURE_FREQUENCY_DTYPE)
+        case _:
+            raise Exception("[PY-API] Invalid acquisition mode for batch=" + str(mode))
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# the modules are imported flat from src, like the examples do, and the flim-processor
+# simulator from Benchmarks
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("src", "Benchmarks"):
+    path = os.path.join(ROOT, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
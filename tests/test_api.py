@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from flim_labs_api import FlimLabsApi
+from flim_labs_wire import WireFormat
+from flim_processor_simulator import FlimProcessorSimulator
+
+COMMANDS_PORT = 5660
+DATA_PORT = 5666
+
+
+@pytest.fixture
+def api():
+    api = FlimLabsApi()
+    yield api
+    api.close()
+
+
+def test_only_one_consumer_handler_can_be_set(api):
+    api.set_batch_consumer_handler(lambda batch: None)
+    with pytest.raises(Exception):
+        api.set_consumer_handler(lambda *event: None)
+    api.set_batch_consumer_handler(None)
+    api.set_consumer_handler(lambda *event: None)
+    with pytest.raises(Exception):
+        api.set_batch_consumer_handler(lambda batch: None)
+
+
+@pytest.mark.parametrize("wire_format, handler", [(WireFormat.BINARY, 'batch'), (WireFormat.TEXT, 'batch'),
+                                                  (WireFormat.TEXT, 'event')])
+def test_spectroscopy_is_trimmed_at_the_acquisition_time(wire_format, handler):
+    rate, seconds = 20_000, 1
+    simulator = FlimProcessorSimulator(rate, seconds + 0.2, WireFormat.BINARY, frame_events=256,
+                                       commands_port=COMMANDS_PORT, data_port=DATA_PORT)
+    simulator.start()
+    api = FlimLabsApi("tcp://localhost:" + str(DATA_PORT), "tcp://localhost:" + str(COMMANDS_PORT))
+    macro_times = []
+    try:
+        api.set_processor_executable(None)
+        api.set_firmware("simulator.flim")
+        api.set_wire_format(wire_format)
+        if handler == 'batch':
+            api.set_batch_consumer_handler(lambda batch: macro_times.extend(batch['macro_time'].tolist()))
+        else:
+            api.set_consumer_handler(lambda *event: macro_times.append(event[4]))
+        api.acquire_spectroscopy(laser_frequency_mhz=40, acquisition_time_seconds=seconds)
+        stats = api.acquisition_done.result(30)
+    finally:
+        api.close()
+        simulator.join(5)
+    # the cutoff is inclusive: the events from 0 ns up to the acquisition time, once each
+    assert np.array_equal(macro_times, np.arange(rate * seconds + 1) * (1_000_000_000 / rate))
+    assert stats['events_delivered'] == rate * seconds + 1
+    assert stats['events_discarded'] > 0
+    assert api.negotiated_wire_format == wire_format
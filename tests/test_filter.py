@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from flim_labs_filter import EventFilter
+from flim_labs_wire import SPECTROSCOPY_DTYPE
+
+
+def _events(count, seed=0):
+    rng = np.random.default_rng(seed)
+    events = np.zeros(count, dtype=SPECTROSCOPY_DTYPE)
+    events['channel'] = rng.integers(0, 4, count)
+    events['time_bin'] = rng.integers(0, 256, count)
+    events['micro_time'] = rng.uniform(0, 25, count)
+    events['monotonic_counter'] = np.arange(count)
+    events['macro_time'] = np.arange(count) * 100.0
+    return events
+
+
+def _brute_force(events, channels=None, micro_time=None, time_bin=None, macro_time=None, decimation=1):
+    kept = []
+    passed = 0
+    for event in events:
+        if channels is not None and event['channel'] not in channels:
+            continue
+        if micro_time is not None and not micro_time[0] <= event['micro_time'] <= micro_time[1]:
+            continue
+        if time_bin is not None and not time_bin[0] <= event['time_bin'] <= time_bin[1]:
+            continue
+        passed += 1
+        if (passed - 1) % decimation != 0:
+            continue
+        if macro_time is not None and not macro_time[0] <= event['macro_time'] <= macro_time[1]:
+            continue
+        kept.append(event)
+    return np.array(kept, dtype=SPECTROSCOPY_DTYPE)
+
+
+@pytest.mark.parametrize("criteria", [
+    {'channels': [1, 3]},
+    {'micro_time': (2.0, 10.0)},
+    {'time_bin': (0, 127)},
+    {'macro_time': (5_000.0, 50_000.0)},
+    {'decimation': 3},
+    {'channels': [0, 2], 'time_bin': (10, 200), 'decimation': 4, 'macro_time': (0.0, 80_000.0)},
+])
+def test_apply_matches_brute_force_across_batches(criteria):
+    events = _events(1000)
+    event_filter = EventFilter(**criteria)
+    # the decimation continues from one batch to the next
+    kept = np.concatenate([event_filter.apply(events[start:start + 77]) for start in range(0, len(events), 77)])
+    assert np.array_equal(kept, _brute_force(events, **criteria))
+
+
+def test_accepts_matches_apply():
+    events = _events(500)
+    criteria = {'channels': [1, 2], 'micro_time': (1.0, None), 'decimation': 2, 'macro_time': (None, 30_000.0)}
+    batch_filter = EventFilter(**criteria)
+    event_filter = EventFilter(**criteria)
+    accepted = [event for event in events if event_filter.accepts(tuple(event.tolist()))]
+    assert np.array_equal(np.array(accepted, dtype=SPECTROSCOPY_DTYPE), batch_filter.apply(events))
+
+
+def test_unfiltered_batch_is_not_copied():
+    events = _events(10)
+    assert EventFilter(time_bin=(0, 255)).apply(events) is events
+    assert EventFilter().is_empty()
+
+
+def test_reset_restarts_the_decimation():
+    events = _events(10)
+    event_filter = EventFilter(decimation=3)
+    first = event_filter.apply(events[:4])
+    event_filter.reset()
+    assert np.array_equal(event_filter.apply(events[:4]), first)
+
+
+def test_processor_args_round_trip():
+    event_filter = EventFilter(channels=[3, 1], micro_time=(1.5, None), time_bin=(None, 100), decimation=2,
+                               macro_time=(0, 1e9))
+    args = event_filter.processor_args()
+    assert args == "channels=1,3;micro-time=1.5:;time-bin=:100;decimation=2"
+    parsed = EventFilter.from_processor_args(args)
+    assert (parsed.channels, parsed.micro_time, parsed.time_bin, parsed.decimation) == (
+        [1, 3], (1.5, None), (None, 100), 2)
+    # the macro_time window stays in the API
+    assert parsed.macro_time is None
+    assert event_filter.local_part().macro_time == (0, 1e9)
+
+
+@pytest.mark.parametrize("criteria", [
+    {'channels': []},
+    {'channels': [256]},
+    {'micro_time': (10.0, 1.0)},
+    {'decimation': 0},
+])
+def test_invalid_criteria(criteria):
+    with pytest.raises(Exception):
+        EventFilter(**criteria)
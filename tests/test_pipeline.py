@@ -0,0 +1,32 @@
+from flim_labs_api import FlimLabsApi
+from flim_labs_wire import WireFormat
+from flim_processor_simulator import FlimProcessorSimulator
+
+COMMANDS_PORT = 5650
+DATA_PORT = 5656
+RATE = 20_000
+SECONDS = 1
+
+
+def test_text_pipeline_acquisition_ends_after_the_last_message():
+    # the processor publishes only a few events past the acquisition time: the workers
+    # reach the cutoff after the receiver forwarded the last message
+    simulator = FlimProcessorSimulator(RATE, SECONDS + 0.01, WireFormat.TEXT, commands_port=COMMANDS_PORT,
+                                       data_port=DATA_PORT)
+    simulator.start()
+    api = FlimLabsApi("tcp://localhost:" + str(DATA_PORT), "tcp://localhost:" + str(COMMANDS_PORT))
+    try:
+        api.set_processor_executable(None)
+        api.set_firmware("simulator.flim")
+        pipeline = api.enable_pipeline(workers=2, channels=1)
+        api.acquire_spectroscopy(laser_frequency_mhz=40, acquisition_time_seconds=SECONDS)
+        api.acquisition_done.result(30)
+        api.receiver_thread.join(5)
+        assert not api.receiver_thread.is_alive()
+        # the events with macro_time <= the acquisition time, the first one at 0 ns
+        assert pipeline.decay_histogram().sum() == RATE * SECONDS + 1
+        assert pipeline.stats()['parse_errors'] == 0
+    finally:
+        api.disable_pipeline()
+        api.close()
+        simulator.join(5)
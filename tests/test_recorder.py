@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from flim_labs_recorder import StreamRecorder, RecordingReader
+from flim_labs_wire import SPECTROSCOPY_DTYPE
+
+
+def _record(path, acquisition_mode, batches, chunk_records):
+    recorder = StreamRecorder(str(path), acquisition_mode, chunk_records)
+    for batch in batches:
+        recorder.feed(batch)
+    recorder.close(wait=True)
+
+
+def _spectroscopy_batches():
+    events = np.zeros(1000, dtype=SPECTROSCOPY_DTYPE)
+    events['channel'] = np.arange(1000) % 3
+    events['time_bin'] = np.arange(1000) % 256
+    events['micro_time'] = np.linspace(0, 25, 1000)
+    events['monotonic_counter'] = np.arange(1000)
+    events['macro_time'] = np.arange(1000) * 10.0
+    return events, [events[start:start + 37] for start in range(0, 1000, 37)]
+
+
+def test_spectroscopy_round_trip(tmp_path):
+    events, batches = _spectroscopy_batches()
+    path = tmp_path / "spectroscopy.flrec"
+    _record(path, 'spectroscopy', batches, chunk_records=100)
+    with RecordingReader(str(path)) as reader:
+        assert reader.acquisition_mode == 'spectroscopy'
+        assert len(reader) == 1000
+        assert len(reader.chunks) == 10
+        assert np.array_equal(reader.read(), events)
+        assert np.array_equal(np.concatenate(list(reader)), events)
+
+
+@pytest.mark.parametrize("first_key, last_key", [(None, None), (2_000.0, 2_990.0), (1_005.0, 7_777.0),
+                                                 (None, 50.0), (9_990.0, None), (20_000.0, None)])
+def test_spectroscopy_key_ranges(tmp_path, first_key, last_key):
+    events, batches = _spectroscopy_batches()
+    path = tmp_path / "spectroscopy.flrec"
+    _record(path, 'spectroscopy', batches, chunk_records=64)
+    keys = events['macro_time']
+    mask = np.ones(len(events), dtype=bool)
+    if first_key is not None:
+        mask &= keys >= first_key
+    if last_key is not None:
+        mask &= keys <= last_key
+    with RecordingReader(str(path)) as reader:
+        assert np.array_equal(reader.read(first_key, last_key), events[mask])
+
+
+def test_photons_tracing_bin_ranges(tmp_path):
+    counts = np.arange(3000, dtype=np.uint32).reshape(1000, 3)
+    path = tmp_path / "tracing.flrec"
+    _record(path, 'photons-tracing', [counts[start:start + 90] for start in range(0, 1000, 90)], chunk_records=128)
+    with RecordingReader(str(path)) as reader:
+        assert reader.shape == (3,)
+        assert np.array_equal(reader.read(), counts)
+        # the key of photons tracing is the bin number
+        assert np.array_equal(reader.read(250, 260), counts[250:261])
+        assert np.array_equal(reader.read(990), counts[990:])
+
+
+def test_unclosed_recording_is_refused(tmp_path):
+    path = tmp_path / "open.flrec"
+    recorder = StreamRecorder(str(path), 'photons-tracing', 4)
+    recorder.feed(np.ones((10, 2), dtype=np.uint32))
+    try:
+        with pytest.raises(Exception):
+            RecordingReader(str(path))
+    finally:
+        recorder.close(wait=True)
+    with RecordingReader(str(path)) as reader:
+        assert len(reader) == 10
@@ -0,0 +1,110 @@
+import threading
+
+import numpy as np
+import pytest
+
+from flim_labs_ring import RingBuffer, OverflowPolicy
+from flim_labs_wire import SPECTROSCOPY_DTYPE
+
+
+def _records(first, count):
+    return np.arange(first, first + count, dtype=np.int64)
+
+
+@pytest.mark.parametrize("policy", [OverflowPolicy.BLOCK, OverflowPolicy.DROP_OLDEST, OverflowPolicy.DROP_NEWEST])
+def test_order_is_kept_across_the_wrap_around(policy):
+    ring = RingBuffer(np.int64, 8, policy)
+    popped = []
+    for first in range(0, 100, 5):
+        ring.push(_records(first, 5))
+        popped.append(ring.pop(3))
+        popped.append(ring.pop(2))
+    assert np.array_equal(np.concatenate(popped), np.arange(100))
+    assert ring.dropped == 0 and len(ring) == 0
+
+
+def test_block_waits_for_the_consumer():
+    ring = RingBuffer(np.int64, 16, OverflowPolicy.BLOCK)
+    total = 10_000
+
+    def produce():
+        for first in range(0, total, 100):
+            ring.push(_records(first, 100))
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    popped = []
+    count = 0
+    while count < total:
+        if ring.wait_for_data(1) > 0:
+            batch = ring.pop(7)
+            popped.append(batch)
+            count += len(batch)
+    producer.join(5)
+    assert np.array_equal(np.concatenate(popped), np.arange(total))
+    assert ring.dropped == 0
+    assert ring.high_water_mark <= 16
+
+
+def test_block_close_releases_a_waiting_producer():
+    ring = RingBuffer(np.int64, 4, OverflowPolicy.BLOCK)
+    ring.push(_records(0, 4))
+    producer = threading.Thread(target=ring.push, args=(_records(4, 3),))
+    producer.start()
+    producer.join(0.3)
+    assert producer.is_alive()
+    ring.close()
+    producer.join(5)
+    assert not producer.is_alive()
+    assert ring.dropped == 3
+    assert np.array_equal(ring.pop(10), np.arange(4))
+
+
+def test_drop_oldest_keeps_the_newest_records():
+    ring = RingBuffer(np.int64, 4, OverflowPolicy.DROP_OLDEST)
+    ring.push(_records(0, 3))
+    ring.push(_records(3, 3))
+    assert ring.dropped == 2
+    assert np.array_equal(ring.pop(10), np.arange(2, 6))
+    # a push larger than the buffer keeps its last records
+    ring.push(_records(6, 10))
+    assert ring.dropped == 8
+    assert np.array_equal(ring.pop(10), np.arange(12, 16))
+    for value in range(16, 22):
+        ring.push_one(value)
+    assert ring.dropped == 10
+    assert np.array_equal(ring.pop(10), np.arange(18, 22))
+
+
+def test_drop_newest_keeps_the_oldest_records():
+    ring = RingBuffer(np.int64, 4, OverflowPolicy.DROP_NEWEST)
+    ring.push(_records(0, 3))
+    ring.push(_records(3, 3))
+    assert ring.dropped == 2
+    assert np.array_equal(ring.pop(10), np.arange(4))
+    ring.push(_records(6, 10))
+    assert ring.dropped == 8
+    for value in range(16, 22):
+        ring.push_one(value)
+    assert ring.dropped == 14
+    assert np.array_equal(ring.pop(10), np.arange(6, 10))
+
+
+def test_structured_records_and_stats():
+    ring = RingBuffer(SPECTROSCOPY_DTYPE, 8)
+    ring.push_one((1, 2, 3.5, 4, 5.5))
+    events = np.zeros(3, dtype=SPECTROSCOPY_DTYPE)
+    events['macro_time'] = [6, 7, 8]
+    ring.push(events)
+    stats = ring.stats()
+    assert stats['depth'] == 4 and stats['high_water_mark'] == 4 and stats['capacity'] == 8
+    popped = ring.pop(10)
+    assert popped[0].tolist() == (1, 2, 3.5, 4, 5.5)
+    assert popped['macro_time'].tolist() == [5.5, 6, 7, 8]
+
+
+def test_invalid_arguments():
+    with pytest.raises(Exception):
+        RingBuffer(np.int64, 0)
+    with pytest.raises(Exception):
+        RingBuffer(np.int64, 4, 'unknown')
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from flim_labs_trace import TraceViewBuffer, BIN_SECONDS
+
+
+def _fed_view_buffer(bins, channels, capacity, levels, factor, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.poisson(5, (bins, channels)).astype(np.uint32)
+    view = TraceViewBuffer(capacity, levels, factor)
+    fed = 0
+    while fed < bins:
+        size = int(rng.integers(1, 300))
+        view.feed(data[fed:fed + size])
+        fed += size
+    return view, data
+
+
+@pytest.mark.parametrize("bins", [1, 1000, 12345, 100_003])
+@pytest.mark.parametrize("seconds, pixels", [(0.05, 100), (1.0, 100), (5.0, 300), (100.0, 50)])
+def test_view_matches_brute_force_downsample(bins, seconds, pixels):
+    view, data = _fed_view_buffer(bins, 3, capacity=1024, levels=6, factor=4)
+    times, low, high, mean = view.view(seconds, pixels)
+    assert 0 < len(times) <= pixels
+    # column i covers the raw bins from its start to the start of the next one, the last
+    # column ends with the last bin fed
+    edges = np.append(np.round(times / BIN_SECONDS).astype(np.intp), bins)
+    assert np.all(np.diff(edges) > 0)
+    wanted = min(max(int(round(seconds / BIN_SECONDS)), 1), bins)
+    # the window covers the requested bins, or everything the coarsest level still holds
+    assert edges[0] <= bins - wanted or edges[0] >= bins - 1024 * 4 ** 5
+    for column, (start, end) in enumerate(zip(edges[:-1], edges[1:])):
+        expected = data[start:end]
+        assert np.array_equal(low[column], expected.min(axis=0))
+        assert np.array_equal(high[column], expected.max(axis=0))
+        assert np.allclose(mean[column], expected.mean(axis=0))
+
+
+def test_coarse_view_includes_the_newest_bins():
+    # 4^3 = 64 bins per level 3 entry: the last 63 bins are not in a whole entry yet
+    view, data = _fed_view_buffer(64 * 100 + 63, 1, capacity=256, levels=4, factor=4)
+    times, low, high, mean = view.view(0.64, 10)
+    last = int(round(times[-1] / BIN_SECONDS))
+    assert last <= len(data) - 1
+    assert high[-1, 0] == data[last:].max()
+
+
+def test_empty_view():
+    times, low, high, mean = TraceViewBuffer().view(1.0, 100)
+    assert len(times) == 0 and low.shape == (0, 0)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from flim_labs_wire import WIRE_HEADER, WIRE_MAGIC, SPECTROSCOPY_DTYPE, is_binary_frame, decode_binary_frame, \
+    encode_binary_frame, decode_text_message, events_to_array
+
+
+def _spectroscopy_events(count):
+    rng = np.random.default_rng(0)
+    events = np.zeros(count, dtype=SPECTROSCOPY_DTYPE)
+    events['channel'] = rng.integers(0, 16, count)
+    events['time_bin'] = rng.integers(0, 256, count)
+    events['micro_time'] = rng.uniform(0, 25, count)
+    events['monotonic_counter'] = np.arange(count) + 2 ** 40
+    events['macro_time'] = np.arange(count) * 12.5
+    return events
+
+
+def test_spectroscopy_round_trip():
+    events = _spectroscopy_events(1000)
+    frame = encode_binary_frame('spectroscopy', events)
+    assert is_binary_frame(frame)
+    assert len(frame) == WIRE_HEADER.size + events.nbytes
+    decoded = decode_binary_frame(frame)
+    assert decoded.dtype == SPECTROSCOPY_DTYPE
+    assert np.array_equal(decoded, events)
+
+
+def test_photons_tracing_round_trip():
+    counts = np.arange(60, dtype=np.uint32).reshape(20, 3)
+    decoded = decode_binary_frame(encode_binary_frame('photons-tracing', counts))
+    assert decoded.shape == (20, 3)
+    assert np.array_equal(decoded, counts)
+    # a single record is one row
+    assert decode_binary_frame(encode_binary_frame('photons-tracing', counts[0])).shape == (1, 3)
+
+
+def test_measure_frequency_round_trip():
+    decoded = decode_binary_frame(encode_binary_frame('measure-frequency', [80.0001]))
+    assert decoded.tolist() == [80.0001]
+
+
+def test_empty_frame():
+    decoded = decode_binary_frame(encode_binary_frame('spectroscopy', np.zeros(0, dtype=SPECTROSCOPY_DTYPE)))
+    assert len(decoded) == 0
+
+
+def test_invalid_frames():
+    with pytest.raises(Exception):
+        decode_binary_frame(WIRE_HEADER.pack(WIRE_MAGIC, 2, 2, 1, 0))
+    with pytest.raises(Exception):
+        decode_binary_frame(WIRE_HEADER.pack(WIRE_MAGIC, 1, 9, 1, 0))
+    with pytest.raises(Exception):
+        encode_binary_frame('raw-data', np.zeros(1))
+    assert not is_binary_frame(b"[1,2,3.5,4,5.5]")
+
+
+def test_text_messages_decode_to_the_binary_records():
+    events = _spectroscopy_events(10)
+    messages = [("[%d,%d,%r,%d,%r]" % tuple(event)).encode() for event in events.tolist()]
+    decoded = [decode_text_message('spectroscopy', message) for message in messages]
+    assert np.array_equal(events_to_array('spectroscopy', decoded), events)
+    assert decode_text_message('spectroscopy', b"exp") is None
+    assert decode_text_message('photons-tracing', b"[1,2,3]") == [1, 2, 3]
+    assert events_to_array('photons-tracing', [[1, 2, 3], [4, 5, 6]]).shape == (2, 3)